@@ -0,0 +1,138 @@
+"""
+Benchmark: cost of dispatching a single command through PluginLoader.run_command
+with 10, 100 and 1000 registered commands, for exact hits and for misspelled commands.
+
+Run from the repository root:
+    python -m benchmarks.bench_command_dispatch
+"""
+
+import asyncio
+import operator
+import os
+import tempfile
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Dict
+
+import yaml
+from thefuzz import fuzz
+
+from core.config import Config
+from core.plugin import Plugin, PluginCommand
+from core.pluginloader import PluginLoader
+from core.registry import FuzzyCommandIndex
+
+COMMANDS_PER_PLUGIN: int = 10
+ITERATIONS: int = 2000
+
+
+async def noop(command):
+    pass
+
+
+def make_loader(state_dir: str) -> PluginLoader:
+    """a PluginLoader configured by a minimal config file, all other options keep the defaults of Config"""
+    config_path: str = os.path.join(state_dir, "config.yaml")
+    plugins_src_dir: str = os.path.join(state_dir, "plugins")
+    os.mkdir(plugins_src_dir)
+    with open(config_path, "w") as file:
+        yaml.safe_dump(
+            {
+                "matrix": {
+                    "user_id": "@bench:example.com",
+                    "user_password": "",
+                    "device_id": "BENCH",
+                    "homeserver_url": "https://example.com",
+                    "enable_encryption": False,
+                },
+                "storage": {"state_dir": state_dir, "plugins_src_dir": plugins_src_dir, "plugins_config_dir": state_dir, "write_delay": 0},
+                "command_prefix": "!c",
+                "cpu": {"use_processes": False},
+                "logging": {"file_logging": {"enabled": False}, "console_logging": {"enabled": False}},
+            },
+            file,
+        )
+    return PluginLoader(Config(config_path), None)
+
+
+def make_command(command: str) -> SimpleNamespace:
+    return SimpleNamespace(
+        command=command,
+        args=[],
+        room=SimpleNamespace(room_id="!room:example.com", power_levels=SimpleNamespace(get_user_level=lambda user: 0)),
+        event=SimpleNamespace(sender="@user:example.com"),
+    )
+
+
+def rebuild_commands(plugins) -> Dict[str, PluginCommand]:
+    """the former PluginLoader.get_commands(), called up to five times per command"""
+    plugin_commands: Dict[str, PluginCommand] = {}
+    for plugin in plugins:
+        plugin_commands.update(plugin._get_commands())
+    return plugin_commands
+
+
+def plain_fuzzy_match(commands: Dict[str, PluginCommand], word: str) -> str:
+    """the former fuzzy matching in PluginLoader.run_command"""
+    ratios: Dict[str, int] = {}
+    for key in commands.keys():
+        if fuzz.ratio(word, key) > 60:
+            ratios[key] = fuzz.ratio(word, key)
+    if ratios != {}:
+        return sorted(ratios.items(), key=operator.itemgetter(1), reverse=True)[0][0]
+    return ""
+
+
+async def bench(num_commands: int):
+    with tempfile.TemporaryDirectory() as state_dir:
+        Plugin.state_dir = state_dir
+        loader: PluginLoader = make_loader(state_dir)
+        plugins = []
+        for plugin_index in range(num_commands // COMMANDS_PER_PLUGIN):
+            plugin = Plugin(f"bench{plugin_index}", "Bench", "benchmark plugin")
+            for command_index in range(COMMANDS_PER_PLUGIN):
+                plugin.add_command(f"cmd{plugin_index}_{command_index}", noop, "help")
+            plugin._set_command_registry(loader.command_registry)
+            plugins.append(plugin)
+
+        command = make_command(f"cmd{len(plugins) - 1}_{COMMANDS_PER_PLUGIN - 1}")
+
+        start: float = perf_counter()
+        for _ in range(ITERATIONS):
+            for _ in range(5):
+                rebuild_commands(plugins)
+        rebuild_time: float = (perf_counter() - start) / ITERATIONS
+
+        start = perf_counter()
+        for _ in range(ITERATIONS):
+            await loader.run_command(command)
+        dispatch_time: float = (perf_counter() - start) / ITERATIONS
+
+        typo: str = f"cdm{len(plugins) - 1}_{COMMANDS_PER_PLUGIN - 1}"
+        commands: Dict[str, PluginCommand] = loader.get_commands()
+
+        start = perf_counter()
+        for _ in range(ITERATIONS // 10):
+            plain_fuzzy_match(commands, typo)
+        plain_fuzzy_time: float = (perf_counter() - start) / (ITERATIONS // 10)
+
+        start = perf_counter()
+        for _ in range(ITERATIONS // 10):
+            FuzzyCommandIndex(loader.command_registry).match(typo)
+        indexed_fuzzy_time: float = (perf_counter() - start) / (ITERATIONS // 10)
+
+        start = perf_counter()
+        for _ in range(ITERATIONS):
+            loader.fuzzy_command_index.match(typo)
+        cached_fuzzy_time: float = (perf_counter() - start) / ITERATIONS
+
+        print(f"{num_commands:>5} commands: rebuild-per-dispatch {rebuild_time * 1e6:9.2f}µs | registry dispatch {dispatch_time * 1e6:7.2f}µs")
+        print(
+            f"{'':>5} typo:     plain fuzzy match {plain_fuzzy_time * 1e6:9.2f}µs | fuzzy index (cold) {indexed_fuzzy_time * 1e6:9.2f}µs | "
+            f"fuzzy index (repeated typo) {cached_fuzzy_time * 1e6:7.2f}µs"
+        )
+
+
+if __name__ == "__main__":
+    for count in (10, 100, 1000):
+        asyncio.run(bench(count))
@@ -0,0 +1,65 @@
+"""
+Benchmark: event loop latency while plugins perform CPU-bound work, either directly on the event loop or through
+Plugin.run_cpu. Latency is measured by a ticker task that should wake up every millisecond.
+
+Run from the repository root:
+    python -m benchmarks.bench_cpu_offload
+"""
+
+import asyncio
+from time import perf_counter
+from typing import List
+
+from core.executor import setup_executor, shutdown_executor, run_cpu
+from plugins.roll.roll import roll_dice
+
+ROLLS: int = 20
+DICE: int = 100000
+
+
+async def ticker(lags: List[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start: float = perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(perf_counter() - start - 0.001)
+
+
+async def measure(name: str, offload: bool):
+    lags: List[float] = []
+    stop = asyncio.Event()
+    ticker_task: asyncio.Task = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(0.01)
+
+    start: float = perf_counter()
+    if offload:
+        await asyncio.gather(*[run_cpu(roll_dice, DICE, 1, 6) for _ in range(ROLLS)])
+    else:
+        for _ in range(ROLLS):
+            roll_dice(DICE, 1, 6)
+            await asyncio.sleep(0)
+    duration: float = perf_counter() - start
+
+    stop.set()
+    await ticker_task
+    lags.sort()
+    print(
+        f"{name:<22} total {duration * 1000:8.1f}ms | loop lag p50 {lags[len(lags) // 2] * 1000:6.2f}ms "
+        f"p99 {lags[int(len(lags) * 0.99)] * 1000:6.2f}ms max {lags[-1] * 1000:7.2f}ms"
+    )
+
+
+async def main():
+    print(f"{ROLLS} x roll_dice({DICE})")
+    await measure("on the event loop", offload=False)
+
+    setup_executor(use_processes=False)
+    await measure("run_cpu (threads)", offload=True)
+
+    setup_executor(use_processes=True)
+    await run_cpu(roll_dice, 1, 1, 6)  # start worker processes
+    await measure("run_cpu (processes)", offload=True)
+    shutdown_executor()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
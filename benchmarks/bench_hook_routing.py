@@ -0,0 +1,70 @@
+"""
+Benchmark: cost of selecting the hooks for a single m.room.message event with per-room hooks active on 5,000 rooms
+(comparable to aichat, translate and dates being enabled in many rooms).
+
+Run from the repository root:
+    python -m benchmarks.bench_hook_routing
+"""
+
+import tempfile
+from time import perf_counter
+from typing import List
+
+from core.plugin import Plugin, PluginHook
+from core.registry import HookRegistry
+
+ROOMS: int = 5000
+ITERATIONS: int = 2000
+
+
+async def room_hook(client, room_id, event):
+    pass
+
+
+async def global_hook(client, room_id, event):
+    pass
+
+
+def linear_scan(hooks, room_id: str) -> List[PluginHook]:
+    """the former selection in PluginLoader.run_hooks"""
+    return [hook for hook in hooks if not hook.room_id_list or room_id in hook.room_id_list]
+
+
+def bench():
+    with tempfile.TemporaryDirectory() as state_dir:
+        Plugin.state_dir = state_dir
+        registry = HookRegistry()
+        plugins: List[Plugin] = []
+        for name in ("aichat", "translate", "dates"):
+            plugin = Plugin(f"bench_{name}", "Bench", "benchmark plugin")
+            plugin._set_hook_registry(registry)
+            plugin.add_hook("m.room.message", global_hook)
+            plugins.append(plugin)
+
+        start: float = perf_counter()
+        for room_index in range(ROOMS):
+            for plugin in plugins:
+                plugin.add_hook("m.room.message", room_hook, room_id_list=[f"!room{room_index}:example.com"])
+        setup_time: float = perf_counter() - start
+
+        room_id: str = f"!room{ROOMS - 1}:example.com"
+        hooks = registry.get("m.room.message")
+        assert len(linear_scan(hooks, room_id)) == len(registry.get_for_room("m.room.message", room_id))
+
+        start = perf_counter()
+        for _ in range(ITERATIONS):
+            linear_scan(hooks, room_id)
+        linear_time: float = (perf_counter() - start) / ITERATIONS
+
+        start = perf_counter()
+        for _ in range(ITERATIONS):
+            registry.get_for_room("m.room.message", room_id)
+        indexed_time: float = (perf_counter() - start) / ITERATIONS
+
+        print(f"{ROOMS} rooms, {len(plugins)} plugins: indexing {setup_time * 1e3:.1f}ms total")
+        print(f"  linear scan   {linear_time * 1e6:9.2f}µs per event")
+        print(f"  room index    {indexed_time * 1e6:9.2f}µs per event")
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,53 @@
+"""
+Benchmark: cost of the data access of a single quote command with 10k stored quotes,
+reading the quotes and nick_links settings either as deep copies or as read-only views.
+
+Run from the repository root:
+    python -m benchmarks.bench_read_data
+"""
+
+import asyncio
+from time import perf_counter
+
+from plugins.quote.quote import plugin, Quote, QuoteLine
+
+QUOTES: int = 10000
+ITERATIONS: int = 20
+
+
+def make_quotes():
+    quotes = {}
+    for quote_id in range(1, QUOTES + 1):
+        lines = [QuoteLine(f"message {quote_id} line {line}", nick=f"nick{line}") for line in range(3)]
+        quote = Quote("local", text=" | ".join(f"<nick{line}> message {quote_id}" for line in range(3)), lines=lines)
+        quote.id = str(quote_id)
+        quotes[quote.id] = quote
+    return quotes
+
+
+async def quote_command_reads(read_only: bool):
+    """the data accessed by displaying a random 3-line quote"""
+    quotes = await plugin.read_data("quotes", read_only=read_only)
+    dict(filter(lambda item: not item[1].deleted, quotes.items()))
+    for _ in range(3):
+        await plugin.read_data("nick_links", read_only=read_only)
+        await plugin.read_data("nick_links_fuzzy", read_only=read_only)
+
+
+async def measure(name: str, read_only: bool):
+    start: float = perf_counter()
+    for _ in range(ITERATIONS):
+        await quote_command_reads(read_only)
+    duration: float = (perf_counter() - start) / ITERATIONS
+    print(f"{name:<18} {duration * 1000:10.3f}ms per command")
+
+
+async def main():
+    plugin.plugin_data = {"quotes": make_quotes(), "nick_links": True, "nick_links_fuzzy": False}
+    print(f"{QUOTES} quotes")
+    await measure("deep copy", read_only=False)
+    await measure("read-only view", read_only=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
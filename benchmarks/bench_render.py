@@ -0,0 +1,104 @@
+"""
+Benchmark: cost of building the content of outgoing messages (help text, quote display, timer notice),
+rendering markdown and plain text for every message as before, or with the render cache of core.chat_functions,
+and of stripping tags with a new HTMLParser per message as before or with strip_tags.
+
+Run from the repository root:
+    python -m benchmarks.bench_render
+"""
+
+from html.parser import HTMLParser
+from io import StringIO
+from time import perf_counter
+
+import mistune
+
+from core.chat_functions import render_message, strip_tags, text_content
+
+ITERATIONS: int = 2000
+
+MESSAGES = {
+    "help text": "**Available commands:**  \n" + "  \n".join(f"- `command{index}`: does **something** useful with `arguments`" for index in range(40)),
+    "quote": "**Quote 1234** (added by @someone:example.com, 3 ratings, 👍 2):  \n<nick1> first line  \n<nick2> second line  \n<nick1> third line",
+    "timer notice": "New xkcd-Comic: [Some Title (1234)](https://xkcd.com/1234/). `!xkcd` or 👀 to display.",
+}
+
+
+class MLStripper(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.reset()
+        self.strict = False
+        self.convert_charrefs = True
+        self.text = StringIO()
+
+    def handle_data(self, d):
+        self.text.write(d)
+
+    def get_data(self):
+        return self.text.getvalue()
+
+
+def legacy_strip_tags(html: str) -> str:
+    """tags stripped as before, by a new HTMLParser per call"""
+    s = MLStripper()
+    s.feed(html)
+    return s.get_data()
+
+
+def legacy_text_content(message: str) -> dict:
+    """the content as built before: markdown rendered on every send and the plain text stripped twice"""
+    formatted_message: str = mistune.html(message)
+    return {
+        "msgtype": "m.notice",
+        "body": legacy_strip_tags(message),
+        "format": "org.matrix.custom.html",
+        "formatted_body": formatted_message,
+        "m.message": [{"mimetype": "text/plain", "body": legacy_strip_tags(message)}, {"mimetype": "text/html", "body": formatted_message}],
+    }
+
+
+def uncached_text_content(message: str) -> dict:
+    render_message.cache_clear()
+    return text_content(message)
+
+
+def measure(name: str, message: str):
+    results = {}
+    for builder_name, build in [("before", legacy_text_content), ("uncached", uncached_text_content), ("cached", text_content)]:
+        assert build(message) == legacy_text_content(message)
+        start: float = perf_counter()
+        for _ in range(ITERATIONS):
+            build(message)
+        results[builder_name] = (perf_counter() - start) / ITERATIONS
+
+    print(
+        f"{name:<13} before {results['before'] * 1e6:8.1f}us | uncached {results['uncached'] * 1e6:8.1f}us | "
+        f"cached {results['cached'] * 1e6:8.1f}us | speedup {results['before'] / results['cached']:6.1f}x"
+    )
+
+
+def measure_strip_tags(name: str, message: str):
+    results = {}
+    for stripper_name, strip in [("HTMLParser", legacy_strip_tags), ("strip_tags", strip_tags)]:
+        assert strip(message) == legacy_strip_tags(message)
+        start: float = perf_counter()
+        for _ in range(ITERATIONS):
+            strip(message)
+        results[stripper_name] = (perf_counter() - start) / ITERATIONS
+
+    print(
+        f"{name:<13} HTMLParser {results['HTMLParser'] * 1e6:8.1f}us | strip_tags {results['strip_tags'] * 1e6:8.1f}us | "
+        f"speedup {results['HTMLParser'] / results['strip_tags']:6.1f}x"
+    )
+
+
+def main():
+    for name, message in MESSAGES.items():
+        measure(name, message)
+    for name, message in MESSAGES.items():
+        measure_strip_tags(name, message)
+
+
+if __name__ == "__main__":
+    main()
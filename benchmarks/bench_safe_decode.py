@@ -0,0 +1,54 @@
+"""
+Benchmark: decoding plugin states of 100 and 1000 dynamic timers and plugin data of 10k quotes written by jsonpickle,
+with jsonpickle itself and with the restricted decoder of core.schema.
+
+Run from the repository root:
+    python -m benchmarks.bench_safe_decode
+"""
+
+import datetime
+from time import perf_counter
+
+import jsonpickle
+
+from benchmarks.bench_serializer import make_quotes
+from core.plugin import PluginCommand, PluginHook
+from core.schema import decode_json
+from core.timer import Timer
+from plugins.quote.quote import quote_command
+
+REPEAT = 5
+
+
+def make_state(count: int):
+    commands = {f"command{index}": PluginCommand(f"command{index}", quote_command, "help", 0, [], "dynamic") for index in range(count // 10)}
+    hooks = {"m.reaction": [PluginHook("m.reaction", quote_command, event_ids=[f"$event{index}"], hook_type="dynamic") for index in range(count // 10)]}
+    timers = [
+        Timer(f"quote.timer{index}", quote_command, datetime.timedelta(minutes=index), datetime.datetime.now(), timer_type="dynamic")
+        for index in range(count)
+    ]
+    return commands, hooks, timers
+
+
+def measure(name: str, encoded: str):
+    results = {}
+    for decoder_name, decode in [("jsonpickle", jsonpickle.decode), ("schema", decode_json)]:
+        start: float = perf_counter()
+        for _ in range(REPEAT):
+            decode(encoded)
+        results[decoder_name] = (perf_counter() - start) / REPEAT
+
+    print(
+        f"{name:<14} jsonpickle {results['jsonpickle'] * 1000:8.1f}ms | schema {results['schema'] * 1000:8.1f}ms | "
+        f"speedup {results['jsonpickle'] / results['schema']:5.1f}x"
+    )
+
+
+def main():
+    for count in [100, 1000]:
+        measure(f"{count} timers", jsonpickle.encode(make_state(count)))
+    measure("10000 quotes", jsonpickle.encode({"quotes": make_quotes(10000)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Benchmark: encoding and decoding plugin data of 1k, 10k and 100k quotes with jsonpickle and msgpack,
+including writing the encoded data to and reading it from the plugin's data store.
+
+Run from the repository root:
+    python -m benchmarks.bench_serializer
+"""
+
+import asyncio
+import os
+import tempfile
+from time import perf_counter
+
+from core.datastore import PluginDataStore
+from core.serializer import get_serializer
+from plugins.quote.quote import Quote, QuoteLine
+
+SIZES = [1000, 10000, 100000]
+
+
+def make_quotes(count: int):
+    quotes = {}
+    for quote_id in range(1, count + 1):
+        lines = [QuoteLine(f"message {quote_id} line {line}", nick=f"nick{line}") for line in range(3)]
+        quote = Quote("local", text=" | ".join(f"<nick{line}> message {quote_id}" for line in range(3)), lines=lines)
+        quote.id = str(quote_id)
+        quotes[quote.id] = quote
+    return quotes
+
+
+async def measure(state_dir: str, count: int, value_format: str):
+    quotes = make_quotes(count)
+    serializer = get_serializer(value_format)
+    data_store = PluginDataStore(f"bench_{value_format}_{count}", os.path.join(state_dir, "bench.db"))
+
+    start: float = perf_counter()
+    encoded = serializer.encode(quotes)
+    await data_store.save("quotes", encoded, value_format)
+    save: float = perf_counter() - start
+
+    start = perf_counter()
+    (stored_format, stored) = (await data_store.load())["quotes"]
+    get_serializer(stored_format).decode(stored)
+    load: float = perf_counter() - start
+
+    await data_store.close()
+    print(f"{count:>7} quotes {value_format:<11} save {save * 1000:9.1f}ms | load {load * 1000:9.1f}ms | size {len(encoded) / 1024:9.1f}KiB")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as state_dir:
+        for count in SIZES:
+            for value_format in ["jsonpickle", "msgpack"]:
+                await measure(state_dir, count, value_format)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
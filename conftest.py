@@ -1,6 +1,7 @@
 # internal modules
 import os
 import logging
+from typing import Callable
 # external modules
 import pytest
 # own modules
@@ -13,4 +14,19 @@ logger = logging.getLogger(__name__)
 def mock_plugin_setup_of_static_vars(tmp_path):
     Plugin.state_dir = os.path.join(tmp_path, "state/")
     Plugin.config_dir = os.path.join(tmp_path, "config/")
-    yield
\ No newline at end of file
+    yield
+
+
+@pytest.fixture
+def make_plugin(mock_plugin_setup_of_static_vars) -> Callable[[str], Plugin]:
+    """
+    Create plugins storing their data and state in the test's state directory, e.g. make_plugin("datastore_test")
+    """
+
+    os.makedirs(Plugin.state_dir, exist_ok=True)
+
+    def make(name: str) -> Plugin:
+        return Plugin(name, "General", f"Test plugin {name}")
+
+    return make
+
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Callable, Awaitable, Any
 
 from core.bot_commands import Command
 from nio import JoinError, MatrixRoom, UnknownEvent, InviteEvent, RoomMessageText, RoomMemberEvent
@@ -6,12 +6,13 @@ from nio import JoinError, MatrixRoom, UnknownEvent, InviteEvent, RoomMessageTex
 import logging
 
 from core.pluginloader import PluginLoader
+from core.workqueue import WorkQueue
 
 logger = logging.getLogger(__name__)
 
 
 class Callbacks(object):
-    def __init__(self, client, store, config, plugin_loader):
+    def __init__(self, client, store, config, plugin_loader, event_queue=None):
         """
         Args:
             client (nio.AsyncClient): nio client used to interact with matrix
@@ -19,12 +20,32 @@ class Callbacks(object):
             store (Storage): Bot storage
 
             config (Config): Bot configuration parameters
+
+            plugin_loader (PluginLoader): the PluginLoader running commands and hooks
+
+            event_queue (WorkQueue): optional queue to process events outside of the sync loop, events are processed directly if None
         """
         self.client = client
         self.store = store
         self.config = config
         self.command_prefix = config.command_prefix
         self.plugin_loader: PluginLoader = plugin_loader
+        self.event_queue: WorkQueue or None = event_queue
+
+    async def __schedule(self, room: MatrixRoom, method: Callable[..., Awaitable], *args: Any):
+        """
+        Process an event through the event queue if configured, events of the same room are processed in order
+        while different rooms are processed in parallel. Processes the event directly otherwise.
+        :param room: the room the event came from
+        :param method: the coroutine function processing the event
+        :param args: arguments to the coroutine function
+        :return:
+        """
+
+        if self.event_queue:
+            await self.event_queue.submit(room.room_id, method, *args)
+        else:
+            await method(*args)
 
     async def message(self, room: MatrixRoom, event: RoomMessageText):
         """Callback for when a message event is received
@@ -35,13 +56,24 @@ class Callbacks(object):
             event (nio.events.room_events.RoomMessageText): The event defining the message
 
         """
-        # Extract the message text
-        msg: str = event.body
-
         # Ignore messages from ourselves
         if event.sender == self.client.user:
             return
 
+        await self.__schedule(room, self.__process_message, room, event)
+
+    async def __process_message(self, room: MatrixRoom, event: RoomMessageText):
+        """Run the commands contained in a message or pass it to the hooks
+
+        Args:
+            room (nio.rooms.MatrixRoom): The room the event came from
+
+            event (nio.events.room_events.RoomMessageText): The event defining the message
+
+        """
+        # Extract the message text
+        msg: str = event.body
+
         logger.debug(f"Bot message received for room {room.display_name} | " f"{room.user_name(event.sender)}: {msg}")
 
         # check if the whole message contains a line with a command
@@ -85,7 +117,7 @@ class Callbacks(object):
         logger.debug(f"Bot received for room member event: {event}")
 
         # pass the event to the hooks
-        await self.plugin_loader.run_hooks(self.client, "m.room.member", room, event)
+        await self.__schedule(room, self.plugin_loader.run_hooks, self.client, "m.room.member", room, event)
 
 
     async def event_unknown(self, room: MatrixRoom, event: UnknownEvent):
@@ -101,7 +133,7 @@ class Callbacks(object):
             return
 
         if event.type == "m.reaction":
-            await self.plugin_loader.run_hooks(self.client, event.type, room, event)
+            await self.__schedule(room, self.plugin_loader.run_hooks, self.client, event.type, room, event)
 
     async def invite(self, room: MatrixRoom, event: InviteEvent):
         """Callback for when an invitation is received. Join the room specified in the invite"""
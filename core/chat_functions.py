@@ -1,12 +1,13 @@
+import asyncio
+import functools
+import io
 import logging
 import math
-import os
+import re
 from asyncio import sleep
-from io import StringIO
-from html.parser import HTMLParser
-from typing import Union, Optional
+from html import unescape
+from typing import Union, Optional, Awaitable, Set, List, Dict, Tuple
 
-import aiofiles.os
 from PIL import Image
 import uuid
 import blurhash
@@ -14,36 +15,95 @@ import blurhash
 from nio import SendRetryError, RoomSendResponse, Event, RoomGetEventResponse, RoomGetEventError, UploadResponse, AsyncClient, RoomSendError
 import mistune  # markdown parser: https://github.com/lepture/mistune
 
+from core.executor import run_cpu
+from core.sender import MessageSender, PRIORITY_MESSAGE, PRIORITY_REACTION, PRIORITY_BULK, get_sender
+
 logger = logging.getLogger(__name__)
 
+# number of rendered messages kept by render_message()
+RENDER_CACHE_SIZE: int = 512
+
+# markdown renderer shared by all messages, configured like mistune.html
+_markdown: mistune.Markdown = mistune.create_markdown(escape=False, plugins=["strikethrough", "footnotes", "table", "speedup"])
+
+# HTML comments, declarations, processing instructions and start or end tags, attribute values may contain ">"
+_markup: re.Pattern = re.compile(
+    r"<!--.*?-->|<[!?][^>]*>|</?[a-zA-Z][^>\"']*(?:(?:\"[^\"]*\"|'[^']*')[^>\"']*)*>|</[^a-zA-Z>][^>]*>",
+    re.DOTALL,
+)
+
+# image formats supported by send_image(), by name: format of PIL, mimetype and file extension
+IMAGE_FORMATS: Dict[str, Tuple[str, str, str]] = {
+    "png": ("PNG", "image/png", "png"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp"),
+}
+
+# maximum width and height of the thumbnail the blurhash of an image is computed from
+BLURHASH_THUMBNAIL_SIZE: int = 64
 
-class MLStripper(HTMLParser):
-    def __init__(self):
-        super().__init__()
-        self.reset()
-        self.strict = False
-        self.convert_charrefs = True
-        self.text = StringIO()
+# maximum number of events sent at the same time by broadcast() if the client has no sender
+BROADCAST_CONCURRENCY: int = 8
 
-    def handle_data(self, d):
-        self.text.write(d)
+# events sent in the background without a sender, referenced until they have been sent
+_background_sends: Set[asyncio.Future] = set()
 
-    def get_data(self):
-        return self.text.getvalue()
 
+def strip_tags(html: str) -> str:
+    """
+    Remove HTML tags and comments from a text and convert character references (e.g. &amp;), used to get the plain text of a message
+    :param html: (str) the text containing HTML
+    :return: (str) the plain text
+    """
+
+    if "<" not in html and "&" not in html:
+        # nothing to strip, the case for most messages
+        return html
+    return unescape(_markup.sub("", html))
 
-def strip_tags(html):
-    s = MLStripper()
-    s.feed(html)
-    return s.get_data()
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_markdown(text: str) -> str:
+    """
+    Convert markdown to HTML with the shared renderer, results are cached by the text's content
+    :param text: (str) the markdown text
+    :return: (str) the HTML
+    """
+
+    return _markdown(text)
+
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_message(message: str, markdown_convert: bool = True) -> Tuple[str, str]:
+    """
+    Render the plain text and the HTML body of a message in a single pass. Results are cached by the message's content,
+    so messages sent repeatedly (e.g. help texts or notices of timers) are rendered only once.
+    :param message: (str) The message content
+    :param markdown_convert: (bool) Whether to convert the message content from markdown to HTML
+    :return: (tuple) the plain text and the HTML body of the message
+    """
+
+    if markdown_convert:
+        formatted_message: str = _markdown(message)
+    else:
+        formatted_message: str = message
+    return strip_tags(message), formatted_message
 
 
 async def room_send(
-    client: AsyncClient, room_id: str, message_type: str, content: dict, tx_id: Optional[str] = None, ignore_unverified_devices: bool = False
-) -> RoomSendResponse:
+    client: AsyncClient,
+    room_id: str,
+    message_type: str,
+    content: dict,
+    tx_id: Optional[str] = None,
+    ignore_unverified_devices: bool = False,
+    priority: int = PRIORITY_MESSAGE,
+    wait: bool = True,
+) -> RoomSendResponse or RoomSendError or None:
     """
-    Small wrapper function for client.room_send that implements a simple rate-limit. If more than 8 events are being sent in less than two seconds,
-    all future events are being queued up and sent every two seconds until the queue has cooled down again (e.g. no events sent for more than two seconds)
+    Wrapper function for client.room_send that paces outbound events. If a sender has been set up for the client, the event is queued and sent by the
+    sender, which keeps the bot below the homeserver's rate-limit (see core.sender). Otherwise the event is sent directly and sent again if the
+    server rejected it.
     :param client: (nio.AsyncClient) The client to communicate to matrix with
     :param room_id: (str) The room id of the room where the message should be sent to.
     :param message_type: (str) A string identifying the type of the message.
@@ -51,21 +111,56 @@ async def room_send(
     :param tx_id: (str) The transaction ID of this event used to uniquely identify this message.
     :param ignore_unverified_devices: (bool) If the room is encrypted and contains unverified devices, the devices can be marked as ignored here. Ignored
     devices will still receive encryption keys for messages but they won't be marked as verified.
-    :return: RoomSendResponse
+    :param priority: (int) One of PRIORITY_MESSAGE, PRIORITY_REACTION, PRIORITY_BULK, events of lower values are sent first
+    :param wait: (bool) Whether to wait for the event to be sent. If False, the event is sent in the background and None is returned.
+    :return: RoomSendResponse or RoomSendError, None if not waiting for the event to be sent
+    """
+
+    sender: MessageSender or None = get_sender(client)
+    if sender is None:
+        send: Awaitable = _send_with_retries(client, room_id, message_type, content, tx_id, ignore_unverified_devices)
+        if wait:
+            return await send
+        task: asyncio.Task = asyncio.create_task(send)
+        _background_sends.add(task)
+        task.add_done_callback(_background_send_done)
+        return None
+
+    future: asyncio.Future = sender.submit(room_id, message_type, content, tx_id, ignore_unverified_devices, priority)
+    if wait:
+        return await future
+    future.add_done_callback(_background_send_done)
+    return None
+
+
+def _background_send_done(future: asyncio.Future):
+    _background_sends.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Error sending event in the background: {future.exception()!r}")
+
+
+async def _send_with_retries(
+    client: AsyncClient, room_id: str, message_type: str, content: dict, tx_id: Optional[str], ignore_unverified_devices: bool
+) -> RoomSendResponse or RoomSendError:
+    """
+    Send an event directly, if the server rejects it, wait as long as requested by the server (or three seconds) and try again
     """
 
     send_retries: int = 0
     max_retries: int = 3
+    # reuse the transaction ID for retries, so the server doesn't post the event twice
+    tx_id = tx_id or str(uuid.uuid4())
     send_response: RoomSendResponse or RoomSendError = await client.room_send(room_id, message_type, content, tx_id, ignore_unverified_devices)
-    while isinstance(send_response, RoomSendError) and send_retries <= max_retries:
+    while isinstance(send_response, RoomSendError) and send_retries < max_retries:
         if send_response.status_code == "M_LIMIT_EXCEEDED":
             # we're being rate-limited, try again after the given time
             send_retries += 1
+            retry_after_ms: int = send_response.retry_after_ms or 1000
             logger.warning(
-                f"Ratelimit hit with {message_type} to {room_id}! Server is asking us to wait {send_response.retry_after_ms}ms. "
-                f"Sending again in {math.ceil(send_response.retry_after_ms/1000)}s (Retry: {send_retries}/{max_retries})."
+                f"Ratelimit hit with {message_type} to {room_id}! Server is asking us to wait {retry_after_ms}ms. "
+                f"Sending again in {math.ceil(retry_after_ms/1000)}s (Retry: {send_retries}/{max_retries})."
             )
-            await sleep(math.ceil(send_response.retry_after_ms / 1000))
+            await sleep(math.ceil(retry_after_ms / 1000))
             send_response: RoomSendResponse or RoomSendError = await client.room_send(room_id, message_type, content, tx_id, ignore_unverified_devices)
 
         else:
@@ -75,64 +170,110 @@ async def room_send(
             await sleep(3)
             send_response: RoomSendResponse or RoomSendError = await client.room_send(room_id, message_type, content, tx_id, ignore_unverified_devices)
 
-    if send_retries > max_retries:
+    if isinstance(send_response, RoomSendError):
         # log message if it could not be sent
         logger.warning(f"Could not send {message_type} to {room_id} after {send_retries} retries. Giving up. Message {content.get('body')} is lost!")
     return send_response
 
 
-async def send_text_to_room(client: AsyncClient, room_id: str, message, notice=True, markdown_convert=True) -> RoomSendResponse or None:
+def text_content(message: str, notice: bool = True, markdown_convert: bool = True) -> dict:
     """
-    Send text to a matrix room
-    :param client: (nio.AsyncClient) The client to communicate to matrix with
-    :param room_id: (str) The ID of the room to send the message to
+    Render the content of a text message, e.g. to send the same message to several rooms
     :param message: (str) The message content
     :param notice: (bool) Whether the message should be sent with an "m.notice" message type (will not ping users)
     :param markdown_convert: (bool) Whether to convert the message content to markdown.
                                     Defaults to true.
+    :return: (dict) the content of the m.room.message event
     """
 
     # Determine whether to ping room members or not
     msgtype = "m.notice" if notice else "m.text"
 
-    if markdown_convert:
-        formatted_message: str = mistune.html(message)
-    else:
-        formatted_message: str = message
+    (plain_message, formatted_message) = render_message(message, markdown_convert)
 
     content = {
         "msgtype": msgtype,
 
         # legacy format
-        "body": strip_tags(message),
+        "body": plain_message,
         "format": "org.matrix.custom.html",
         "formatted_body": formatted_message,
 
         # MSC1767
         "m.message": [
-            {"mimetype": "text/plain", "body": strip_tags(message)},
+            {"mimetype": "text/plain", "body": plain_message},
             {"mimetype": "text/html", "body": formatted_message}
         ]
     }
 
+    return content
+
+
+async def send_text_to_room(
+    client: AsyncClient, room_id: str, message, notice=True, markdown_convert=True, priority: int = PRIORITY_MESSAGE
+) -> RoomSendResponse or None:
+    """
+    Send text to a matrix room
+    :param client: (nio.AsyncClient) The client to communicate to matrix with
+    :param room_id: (str) The ID of the room to send the message to
+    :param message: (str) The message content
+    :param notice: (bool) Whether the message should be sent with an "m.notice" message type (will not ping users)
+    :param markdown_convert: (bool) Whether to convert the message content to markdown.
+                                    Defaults to true.
+    :param priority: (int) The priority of the message, e.g. PRIORITY_BULK for posts of timers to many rooms
+    """
+
+    content: dict = text_content(message, notice=notice, markdown_convert=markdown_convert)
+
     response: RoomSendResponse
 
     try:
-        response = await room_send(client, room_id, "m.room.message", content, ignore_unverified_devices=True)
+        response = await room_send(client, room_id, "m.room.message", content, ignore_unverified_devices=True, priority=priority)
         return response
     except SendRetryError:
         logger.exception(f"Unable to send message response to {room_id}")
         return None
 
 
-async def send_reaction(client, room_id, event_id: str, reaction: str):
+async def broadcast(
+    client: AsyncClient, room_ids: List[str], message_type: str, content: dict, priority: int = PRIORITY_BULK
+) -> Dict[str, RoomSendResponse or RoomSendError or Exception]:
+    """
+    Send the same event to several rooms concurrently. The events are sent by the sender, if one has been set up for the client, up to
+    its concurrency at the same time and within its optional rate-limit. Otherwise they are sent by a sender of their own sending at most
+    BROADCAST_CONCURRENCY events at the same time. Either way, sending to all rooms is paused if the homeserver rate-limits the bot.
+    :param client: (nio.AsyncClient) The client to communicate to matrix with
+    :param room_ids: (list) The rooms to send the event to
+    :param message_type: (str) A string identifying the type of the message.
+    :param content: (dict) A dictionary containing the content of the message, shared by all rooms
+    :param priority: (int) The priority of the events, defaults to PRIORITY_BULK
+    :return: (dict) room_id and the RoomSendResponse or RoomSendError or the exception raised while sending the event to the room
+    """
+
+    sender: MessageSender or None = get_sender(client)
+    own_sender: bool = sender is None
+    if own_sender:
+        sender = MessageSender(client, BROADCAST_CONCURRENCY)
+
+    room_ids = list(dict.fromkeys(room_ids))
+    try:
+        futures: List[asyncio.Future] = [sender.submit(room_id, message_type, content, ignore_unverified_devices=True, priority=priority) for room_id in room_ids]
+        responses: List[RoomSendResponse or RoomSendError or Exception] = await asyncio.gather(*futures, return_exceptions=True)
+    finally:
+        if own_sender:
+            await sender.stop()
+    return dict(zip(room_ids, responses))
+
+
+async def send_reaction(client, room_id, event_id: str, reaction: str, wait: bool = True) -> RoomSendResponse or RoomSendError or None:
     """
     Send a reaction to a specific event
     :param client: (nio.AsyncClient) The client to communicate to matrix with
     :param room_id: (str) room_id to send the reaction to (is this actually being used?)
     :param event_id: (str) event_id to react to
     :param reaction: (str) the reaction to send
-    :return:
+    :param wait: (bool) Whether to wait for the reaction to be sent, if False it's sent in the background
+    :return: RoomSendResponse or RoomSendError, None if not waiting for the reaction to be sent
     """
 
     content = {
@@ -143,7 +284,7 @@ async def send_reaction(client, room_id, event_id: str, reaction: str):
         }
     }
 
-    await room_send(client, room_id, "m.reaction", content, ignore_unverified_devices=True)
+    return await room_send(client, room_id, "m.reaction", content, ignore_unverified_devices=True, priority=PRIORITY_REACTION, wait=wait)
 
 
 async def send_replace(client, room_id: str, event_id: str, message: str, message_type: str = "m.text") -> str or None:
@@ -168,78 +309,120 @@ async def send_replace(client, room_id: str, event_id: str, message: str, messag
 
     if isinstance(original_response, RoomGetEventResponse) and original_content != {}:
 
+        (plain_message, formatted_message) = render_message(message)
         new_content = {
             "m.new_content": {
                 "msgtype": message_type,
                 "format": "org.matrix.custom.html",
-                "body": strip_tags(message),
-                "formatted_body": markdown(message),
+                "body": plain_message,
+                "formatted_body": formatted_message,
                 "m.message": [
-                    {"mimetype": "text/plain", "body": strip_tags(message)},
-                    {"mimetype": "text/html", "body": markdown(message)}
+                    {"mimetype": "text/plain", "body": plain_message},
+                    {"mimetype": "text/html", "body": formatted_message}
                 ]
             },
             "m.relates_to": {"rel_type": "m.replace", "event_id": event_id},
             "msgtype": "m.text",
             "format": "org.matrix.custom.html",
-            "body": strip_tags(message),
-            "formatted_body": markdown(message),
+            "body": plain_message,
+            "formatted_body": formatted_message,
             "m.message": [
-                {"mimetype": "text/plain", "body": strip_tags(message)},
-                {"mimetype": "text/html", "body": markdown(message)}
+                {"mimetype": "text/plain", "body": plain_message},
+                {"mimetype": "text/html", "body": formatted_message}
             ]
         }
 
         # check if there are any differences in body or formatted_body before actually sending the m.replace-event
-        if new_content["body"] != original_content["body"] or new_content["formatted_body"] != original_content["formatted_body"]:
-            return await room_send(client, room_id, "m.room.message", new_content, ignore_unverified_devices=True)
+        if new_content["body"] != original_content.get("body") or new_content["formatted_body"] != original_content.get("formatted_body"):
+            response: RoomSendResponse or RoomSendError = await room_send(client, room_id, "m.room.message", new_content, ignore_unverified_devices=True)
+            if isinstance(response, RoomSendResponse):
+                return response.event_id
+            return None
         else:
             return None
     else:
         return None
 
 
-async def send_image(client: AsyncClient, room_id: str, image: Image.Image) -> str or None:
+def encode_image(pixels: bytes, mode: str, size: Tuple[int, int], image_format: str = "png", quality: int = 85) -> Tuple[bytes, str]:
+    """
+    Encode an image in memory and compute its blurhash from a small thumbnail. Runs outside of the event loop via run_cpu,
+    the image is passed as raw pixel data, so only bytes are sent to worker processes instead of the whole image object.
+    :param pixels: the raw pixel data of the image, as returned by Image.tobytes()
+    :param mode: the image's mode, e.g. "RGBA"
+    :param size: the image's width and height
+    :param image_format: one of the names of IMAGE_FORMATS
+    :param quality: quality of lossy formats (jpeg, webp), 1..100
+    :return: (tuple) the encoded image and its blurhash
+    """
+
+    image: Image.Image = Image.frombytes(mode, size, pixels)
+    pil_format: str = IMAGE_FORMATS[image_format][0]
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer: io.BytesIO = io.BytesIO()
+    if pil_format == "PNG":
+        image.save(buffer, pil_format)
+    else:
+        image.save(buffer, pil_format, quality=quality)
+
+    # the blurhash only contains a few components, computing it from a thumbnail is sufficient and much faster
+    (width, height) = image.size
+    scale: float = min(1.0, BLURHASH_THUMBNAIL_SIZE / max(width, height))
+    thumbnail: Image.Image = image.resize((max(1, round(width * scale)), max(1, round(height * scale)))).convert("RGB")
+    image_hash: str = blurhash.encode(thumbnail, x_components=4, y_components=3)
+
+    return buffer.getvalue(), image_hash
+
+
+async def send_image(
+    client: AsyncClient, room_id: str, image: Image.Image, image_format: str = "png", quality: int = 85
+) -> RoomSendResponse or RoomSendError or None:
     """
     Uploads the given Image-Object to the matrix-server and sends a new message including the image.
+    The image is encoded in memory, without writing a temporary file.
     :param client:
     :param room_id:
     :param image:
-    :return:     (str) the event-id of the new room-event
-                None if sending image or message failed
+    :param image_format: one of the names of IMAGE_FORMATS, e.g. "webp" or "jpeg" for smaller uploads of photos
+    :param quality: quality of lossy formats (jpeg, webp), 1..100
+    :return:     RoomSendResponse or RoomSendError of the new room-event
+                None if encoding or uploading the image failed
     """
 
-    # temporarily save the image to a file
-    temp_filename: str = f"{uuid.uuid4().hex}.png"
+    (_, mime_type, extension) = IMAGE_FORMATS[image_format]
+    if image.mode == "P":
+        # the palette is not part of the raw pixel data
+        image = image.convert("RGBA")
+
     try:
-        image.save(temp_filename, "PNG")
-    except OSError:
+        (data, image_hash) = await run_cpu(encode_image, image.tobytes(), image.mode, image.size, image_format, quality)
+    except Exception:
+        # besides errors encoding the image, the executor may fail to run it (e.g. a broken process pool or pickling errors)
+        logger.exception(f"Unable to encode image as {image_format}")
         return None
 
     (width, height) = image.size  # image.size returns (width,height) tuple
-    mime_type: str = "image/png"
+    filename: str = f"{uuid.uuid4().hex}.{extension}"
 
     # first do an upload of image, then send URI of upload to room
-    file_stat = await aiofiles.os.stat(temp_filename)
-    image_hash = blurhash.encode(temp_filename, x_components=4, y_components=3)
-
     try:
-        async with aiofiles.open(temp_filename, "r+b") as f:
-            resp, maybe_keys = await client.upload(
-                f,
-                content_type=mime_type,
-                filename=os.path.basename(temp_filename),
-                filesize=file_stat.st_size,
-            )
-        os.remove(temp_filename)
-    except OSError:
-        logger.warning(f"Failed to remove temporary image file {temp_filename}")
+        resp, maybe_keys = await client.upload(
+            io.BytesIO(data),
+            content_type=mime_type,
+            filename=filename,
+            filesize=len(data),
+        )
+    except Exception:
+        logger.exception(f"Unable to upload image {filename}")
+        return None
 
     if isinstance(resp, UploadResponse):
         content = {
-            "body": os.path.basename(temp_filename),  # descriptive title
+            "body": filename,  # descriptive title
             "info": {
-                "size": file_stat.st_size,
+                "size": len(data),
                 "mimetype": mime_type,
                 "w": width,  # width in pixel
                 "h": height,  # height in pixel
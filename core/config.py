@@ -4,7 +4,11 @@ import os
 import yaml
 import sys
 from typing import List, Any, Optional
+from core.chat_functions import IMAGE_FORMATS
+from core.executor import DEFAULT_WORKERS
 from core.errors import ConfigError
+from core.serializer import serializers
+from core.storage import DATABASE_FILENAME
 
 logger = logging.getLogger()
 
@@ -65,11 +69,18 @@ class Config(object):
         self.plugins_src_dir: str = self._get_cfg(["storage", "plugins_src_dir"], required=True)
         self.plugins_config_dir: str = self._get_cfg(["storage", "plugins_config_dir"], required=True)
 
+        # delay writing plugin data and state to combine several changes into a single write
+        self.data_write_delay: float = self._get_cfg(["storage", "write_delay"], required=False, default=1)
+        # format used to encode plugin data, data stored in a different format is converted on startup
+        self.data_format: str = self._get_cfg(["storage", "data_format"], required=False, default="msgpack")
+        if self.data_format not in serializers:
+            raise ConfigError(f"storage.data_format '{self.data_format}' is not one of: {', '.join(serializers.keys())}")
+
         check_dir_exists(self.plugins_src_dir, "Plugins")
         create_dir_if_not_exists(self.state_dir)
         create_dir_if_not_exists(self.plugins_config_dir)
 
-        self.database_filepath = os.path.join(self.state_dir, "bot.db")
+        self.database_filepath = os.path.join(self.state_dir, DATABASE_FILENAME)
         self.store_filepath = os.path.join(self.state_dir, "store")
         create_dir_if_not_exists(self.store_filepath)
 
@@ -91,6 +102,32 @@ class Config(object):
         self.plugins_allowlist = self._get_cfg(["plugins", "allow_list"], required=False, default=[])
         self.plugins_denylist = self._get_cfg(["plugins", "deny_list"], required=False, default=[])
 
+        # event processing
+        self.event_workers: int = self._get_cfg(["events", "workers"], required=False, default=4)
+        self.event_queue_size: int = self._get_cfg(["events", "queue_size"], required=False, default=100)
+
+        # CPU-bound work
+        self.cpu_workers: int = self._get_cfg(["cpu", "workers"], required=False, default=DEFAULT_WORKERS)
+        self.cpu_use_processes: bool = self._get_cfg(["cpu", "use_processes"], required=False, default=True)
+
+        # images sent by plugins
+        self.image_format: str = self._get_cfg(["images", "format"], required=False, default="png")
+        if self.image_format not in IMAGE_FORMATS:
+            raise ConfigError(f"images.format '{self.image_format}' is not one of: {', '.join(IMAGE_FORMATS.keys())}")
+        self.image_quality: int = self._get_cfg(["images", "quality"], required=False, default=85)
+
+        # sending events
+        self.send_concurrency: int = self._get_cfg(["sending", "concurrency"], required=False, default=8)
+        self.send_rate: float = self._get_cfg(["sending", "rate"], required=False, default=0)
+        self.send_burst: int = self._get_cfg(["sending", "burst"], required=False, default=10)
+        self.send_room_rate: float = self._get_cfg(["sending", "room_rate"], required=False, default=0)
+        self.send_room_burst: int = self._get_cfg(["sending", "room_burst"], required=False, default=5)
+
+        # hooks
+        self.hooks_concurrent: bool = self._get_cfg(["hooks", "concurrent"], required=False, default=False)
+        self.hooks_timeout: float = self._get_cfg(["hooks", "timeout"], required=False, default=0)
+        self.hooks_max_concurrency_per_plugin: int = self._get_cfg(["hooks", "max_concurrency_per_plugin"], required=False, default=4)
+
     def _get_cfg(
         self,
         path: List[str],
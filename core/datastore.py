@@ -0,0 +1,184 @@
+import logging
+from types import MappingProxyType
+from typing import Dict, Any, List, Tuple
+
+from core.storage import Storage, get_storage
+
+logger = logging.getLogger(__name__)
+
+ROOM_DATA_PREFIX: str = "room_data/"
+"""prefix of the names data of a single room is kept by in a plugin's data, followed by <room_id>/<name>"""
+
+
+def read_only_view(data: Any) -> Any:
+    """
+    Wrap data to prevent it from being changed accidentally without copying its contents.
+    dicts are wrapped in a read-only proxy, lists and sets are converted to tuples and frozensets, which only copies references.
+    Any other value is returned as-is: scalars are immutable anyway, objects stored inside the data are shared and must not be changed.
+    :param data: the data to be wrapped
+    :return: a read-only view of the data
+    """
+
+    if isinstance(data, dict):
+        return MappingProxyType(data)
+    elif isinstance(data, list):
+        return tuple(data)
+    elif isinstance(data, set):
+        return frozenset(data)
+    else:
+        return data
+
+
+def room_data_key(room_id: str, name: str) -> str:
+    """
+    Name under which data of a single room is kept in a plugin's data
+    :param room_id: the room the data belongs to
+    :param name: name of the data
+    :return: the name of the room's record
+    """
+
+    return f"{ROOM_DATA_PREFIX}{room_id}/{name}"
+
+
+def split_room_data_key(key: str) -> Tuple[str, str] or None:
+    """
+    Split a name created by room_data_key() into room_id and name
+    :param key: the name of the data
+    :return:    room_id and name, if the data belongs to a single room
+                None, otherwise
+    """
+
+    if key.startswith(ROOM_DATA_PREFIX):
+        (room_id, separator, name) = key[len(ROOM_DATA_PREFIX) :].partition("/")
+        if separator:
+            return room_id, name
+    return None
+
+
+class PluginDataStore:
+    def __init__(self, plugin: str, filename: str):
+        """
+        Persistent key/value store backing a plugin's data, kept in the bot's database shared by all plugins (see core/storage.py).
+        Values are stored already encoded, together with the name of the format they have been encoded in. Every write happens in its own
+        transaction, so storing one key neither rewrites the other keys nor leaves partially written data behind if the bot crashes
+        meanwhile. Data of single rooms (see room_data_key()) is stored in a separate table, indexed by room.
+        :param plugin: name of the plugin, separating its data from the data of other plugins
+        :param filename: path to the database file
+        """
+
+        self.plugin: str = plugin
+        self.filename: str = filename
+
+    @property
+    def __storage(self) -> Storage:
+        return get_storage(self.filename)
+
+    async def exists(self) -> bool:
+        """
+        Check if the plugin has stored any data before
+        :return:
+        """
+
+        return await self.__storage.has_namespace(self.plugin)
+
+    @staticmethod
+    def __split_values(values: Dict[str, str or bytes]) -> Tuple[Dict[str, str or bytes], Dict[Tuple[str, str], str or bytes]]:
+        """
+        Separate the values of single rooms from the plugin's other values
+        :param values: Dict of key and encoded value
+        :return: Dict of key and encoded value, Dict of room_id and key and encoded value
+        """
+
+        plugin_values: Dict[str, str or bytes] = {}
+        room_values: Dict[Tuple[str, str], str or bytes] = {}
+        for key, value in values.items():
+            room_key: Tuple[str, str] or None = split_room_data_key(key)
+            if room_key is None:
+                plugin_values[key] = value
+            else:
+                room_values[room_key] = value
+        return plugin_values, room_values
+
+    async def load(self) -> Dict[str, Tuple[str, str or bytes]]:
+        """
+        Load all stored values
+        :return: Dict of key and a tuple of format and encoded value
+        """
+
+        values: Dict[str, Tuple[str, str or bytes]] = await self.__storage.load_values(self.plugin)
+        for (room_id, key), value in (await self.__storage.load_room_values(self.plugin)).items():
+            values[room_data_key(room_id, key)] = value
+        return values
+
+    async def save(self, key: str, value: str or bytes, value_format: str):
+        """
+        Store a single value, replacing any previous value of the key
+        :param key: name of the value
+        :param value: the encoded value
+        :param value_format: name of the format the value has been encoded in
+        :return:
+        """
+
+        await self.save_all({key: value}, value_format)
+
+    async def save_all(self, values: Dict[str, str or bytes], value_format: str):
+        """
+        Store several values in a single transaction
+        :param values: Dict of key and encoded value
+        :param value_format: name of the format the values have been encoded in
+        :return:
+        """
+
+        (plugin_values, room_values) = self.__split_values(values)
+        await self.__storage.save_values(self.plugin, plugin_values, room_values, value_format)
+
+    async def delete(self, key: str):
+        """
+        Remove a single value
+        :param key: name of the value
+        :return:
+        """
+
+        room_key: Tuple[str, str] or None = split_room_data_key(key)
+        if room_key is None:
+            await self.__storage.delete_value(self.plugin, key)
+        else:
+            await self.__storage.delete_value(self.plugin, room_key[1], room_id=room_key[0])
+
+    async def load_entries(self, collection: str) -> List[Tuple[str, str, str or bytes, float]]:
+        """
+        Load all entries of a collection, oldest first
+        :param collection: name of the collection
+        :return: List of tuples of key, format, encoded value and timestamp
+        """
+
+        return await self.__storage.load_entries(self.plugin, collection)
+
+    async def update_entries(self, collection: str, entries: Dict[str, Tuple[str or bytes, float]], deleted: List[str], value_format: str):
+        """
+        Store and remove entries of a collection in a single transaction
+        :param collection: name of the collection
+        :param entries: Dict of key and a tuple of encoded value and timestamp of the entries to store
+        :param deleted: keys of the entries to remove
+        :param value_format: name of the format the values have been encoded in
+        :return:
+        """
+
+        await self.__storage.update_entries(self.plugin, collection, entries, deleted, value_format)
+
+    async def clear_entries(self, collection: str):
+        """
+        Remove all entries of a collection
+        :param collection: name of the collection
+        :return:
+        """
+
+        await self.__storage.clear_entries(self.plugin, collection)
+
+    async def close(self):
+        """
+        Close the database connection, it is reopened on the next access
+        :return:
+        """
+
+        await self.__storage.close()
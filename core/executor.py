@@ -0,0 +1,78 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS: int = 2
+"""number of workers used if none have been configured, CPU-bound work is rare and should not hold a process per CPU"""
+
+_executor: Executor or None = None
+
+# settings the executor is created with on first use
+_workers: int = DEFAULT_WORKERS
+_use_processes: bool = False
+
+
+def setup_executor(workers: int = DEFAULT_WORKERS, use_processes: bool = True):
+    """
+    Configure the executor shared by all plugins and core functions to run CPU-bound work outside of the event loop.
+    The executor is only created on the first call to run_cpu, so no workers are started if there is no CPU-bound work.
+    :param workers: number of worker processes or threads, 0 to use the number of CPUs
+    :param use_processes: True to use a process pool (work runs in parallel, methods and arguments must be picklable),
+                          False to use a thread pool
+    :return:
+    """
+
+    global _workers
+    global _use_processes
+
+    shutdown_executor()
+    _workers = workers if workers > 0 else os.cpu_count() or 1
+    _use_processes = use_processes
+
+
+def get_executor() -> Executor:
+    """
+    Get the shared executor, create it with the configured settings on first use.
+    If none have been configured (e.g. when running tests), a thread pool is used.
+    :return:
+    """
+
+    global _executor
+
+    if _executor is None:
+        if _use_processes:
+            _executor = ProcessPoolExecutor(max_workers=_workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=_workers, thread_name_prefix="cpu")
+        logger.debug(f"Using {type(_executor).__name__} with {_workers} workers for CPU-bound work")
+    return _executor
+
+
+def shutdown_executor():
+    """
+    Shut down the shared executor, waiting for running work to finish. It's created again on the next call to run_cpu.
+    :return:
+    """
+
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+async def run_cpu(method: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Run CPU-bound work in the shared executor without blocking the event loop
+    :param method: the function to run. If a process pool is used, it has to be defined on module level
+    :param args: arguments to the function, need to be picklable if a process pool is used
+    :param kwargs: keyword arguments to the function, need to be picklable if a process pool is used
+    :return: the function's return value
+    """
+
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), functools.partial(method, *args, **kwargs))
@@ -0,0 +1,82 @@
+from typing import Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    def __init__(self):
+        """
+        Aggregated execution times of a single item, e.g. a hook
+        """
+
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self.errors: int = 0
+        self.timeouts: int = 0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"count={self.count} avg={self.average * 1000:.1f}ms max={self.max * 1000:.1f}ms "
+            f"errors={self.errors} timeouts={self.timeouts}"
+        )
+
+
+class WriteStats:
+    def __init__(self):
+        """
+        Counters of the persistence of a plugin's data and state
+        """
+
+        self.requested: int = 0
+        """number of changes to be persisted"""
+        self.unchanged: int = 0
+        """number of store requests skipped, as the data had not changed"""
+        self.coalesced: int = 0
+        """number of changes merged into a change still waiting to be written"""
+        self.written: int = 0
+        """number of items actually written"""
+
+    def __repr__(self) -> str:
+        return f"requested={self.requested} unchanged={self.unchanged} coalesced={self.coalesced} written={self.written}"
+
+
+class LatencyMetrics:
+    def __init__(self):
+        """
+        Collects execution times per name, e.g. per hook as "<plugin>.<method>"
+        """
+
+        self.__stats: Dict[str, LatencyStats] = {}
+
+    def record(self, name: str, duration: float, error: bool = False, timeout: bool = False):
+        """
+        Record a single execution
+        :param name: name of the executed item
+        :param duration: execution time in seconds
+        :param error: whether the execution raised an exception
+        :param timeout: whether the execution has been cancelled due to a timeout
+        :return:
+        """
+
+        stats: LatencyStats = self.__stats.setdefault(name, LatencyStats())
+        stats.count += 1
+        stats.total += duration
+        stats.max = max(stats.max, duration)
+        if error:
+            stats.errors += 1
+        if timeout:
+            stats.timeouts += 1
+
+    def get_stats(self) -> Dict[str, LatencyStats]:
+        """
+        Get the collected stats
+        :return: Dict of name and LatencyStats
+        """
+
+        return dict(self.__stats)
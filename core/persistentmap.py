@@ -0,0 +1,186 @@
+import logging
+from collections import OrderedDict
+from time import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from core.datastore import PluginDataStore
+from core.serializer import get_serializer
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentMap:
+    def __init__(self, name: str, data_store: PluginDataStore, value_format: str, max_size: int = 0, ttl: float = 0):
+        """
+        A persistent map of entries, optionally limited in size and age. Every change writes only the affected entries.
+        Entries are kept in the order they have been set: if max_size is exceeded, the least recently set entries are removed,
+        entries older than ttl are removed on the next change or by calling expire().
+        Values returned are not copied, changes to a value need to be stored by calling set() again.
+        :param name: name of the map
+        :param data_store: the data store to persist the entries in
+        :param value_format: the format to encode values in
+        :param max_size: maximum number of entries, 0 for no limit
+        :param ttl: maximum age of entries in seconds, 0 for no limit
+        """
+
+        self.name: str = name
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self.__data_store: PluginDataStore = data_store
+        self.__value_format: str = value_format
+        self.__entries: Dict[str, Tuple[float, Any]] = OrderedDict()
+
+    async def _load(self):
+        """
+        Load all stored entries, removing entries exceeding the current limits
+        :return:
+        """
+
+        for key, value_format, value, timestamp in await self.__data_store.load_entries(self.name):
+            try:
+                self.__entries[key] = (timestamp, get_serializer(value_format).decode(value))
+            except Exception as err:
+                logger.critical(f"Could not decode {key} of {self.name}: {err}")
+        await self.expire()
+
+    def __is_expired(self, timestamp: float, now: float) -> bool:
+        return self.ttl > 0 and timestamp <= now - self.ttl
+
+    def __remove_outdated(self, now: float) -> List[str]:
+        """
+        Remove entries exceeding max_size or ttl. As entries are ordered by the time they have been set, these are always the first entries.
+        :param now: the current timestamp
+        :return: keys of the removed entries
+        """
+
+        removed: List[str] = []
+        while self.__entries:
+            key: str = next(iter(self.__entries))
+            if (self.max_size and len(self.__entries) > self.max_size) or self.__is_expired(self.__entries[key][0], now):
+                del self.__entries[key]
+                removed.append(key)
+            else:
+                break
+        return removed
+
+    async def set(self, key: str, value: Any):
+        """
+        Store an entry, replacing any previous value of the key
+        :param key: the key of the entry
+        :param value: the value of the entry
+        :return:
+        """
+
+        now: float = time()
+        self.__entries[key] = (now, value)
+        self.__entries.move_to_end(key)
+        removed: List[str] = self.__remove_outdated(now)
+        if key in removed:
+            # the entry has been removed right away due to max_size or ttl
+            await self.__data_store.update_entries(self.name, {}, removed, self.__value_format)
+        else:
+            encoded: str or bytes = get_serializer(self.__value_format).encode(value)
+            await self.__data_store.update_entries(self.name, {key: (encoded, now)}, removed, self.__value_format)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Get the value of an entry
+        :param key: the key of the entry
+        :param default: the value to return if there is no such entry or it has expired
+        :return: the value of the entry
+        """
+
+        entry: Tuple[float, Any] or None = self.__entries.get(key)
+        if entry is None or self.__is_expired(entry[0], time()):
+            return default
+        return entry[1]
+
+    async def delete(self, key: str) -> bool:
+        """
+        Remove an entry
+        :param key: the key of the entry
+        :return:    True, if the entry has been removed
+                    False, if there was no such entry
+        """
+
+        if key in self.__entries:
+            del self.__entries[key]
+            await self.__data_store.update_entries(self.name, {}, [key], self.__value_format)
+            return True
+        else:
+            return False
+
+    async def clear(self):
+        """
+        Remove all entries
+        :return:
+        """
+
+        self.__entries.clear()
+        await self.__data_store.clear_entries(self.name)
+
+    async def expire(self):
+        """
+        Remove all entries exceeding max_size or ttl
+        :return:
+        """
+
+        removed: List[str] = self.__remove_outdated(time())
+        if removed:
+            await self.__data_store.update_entries(self.name, {}, removed, self.__value_format)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterate over all entries that have not expired, least recently set first
+        :return: key and value of every entry
+        """
+
+        now: float = time()
+        for key, (timestamp, value) in list(self.__entries.items()):
+            if not self.__is_expired(timestamp, now):
+                yield key, value
+
+    def __contains__(self, key: str) -> bool:
+        entry: Tuple[float, Any] or None = self.__entries.get(key)
+        return entry is not None and not self.__is_expired(entry[0], time())
+
+    def __len__(self) -> int:
+        if self.ttl > 0:
+            return sum(1 for _ in self.items())
+        else:
+            return len(self.__entries)
+
+
+class RingBuffer(PersistentMap):
+    def __init__(self, name: str, data_store: PluginDataStore, value_format: str, capacity: int, ttl: float = 0):
+        """
+        A persistent list of the latest capacity values appended, older values are removed automatically.
+        :param name: name of the buffer
+        :param data_store: the data store to persist the values in
+        :param value_format: the format to encode values in
+        :param capacity: maximum number of values
+        :param ttl: maximum age of values in seconds, 0 for no limit
+        """
+
+        super().__init__(name, data_store, value_format, max_size=capacity, ttl=ttl)
+        self.__next_index: int = 0
+
+    async def _load(self):
+        await super()._load()
+        for key, _ in self.items():
+            self.__next_index = max(self.__next_index, int(key) + 1)
+
+    async def append(self, value: Any):
+        """
+        Append a value, removing the oldest value if the buffer is full
+        :param value: the value to append
+        :return:
+        """
+
+        index: int = self.__next_index
+        self.__next_index += 1
+        await self.set(str(index), value)
+
+    def __iter__(self) -> Iterator[Any]:
+        for _, value in self.items():
+            yield value
@@ -1,13 +1,19 @@
+import asyncio
+import hashlib
 import io
 import os.path
-from os import remove, path
-import pickle
-from typing import List, Any, Dict, Callable, Union, Hashable, Tuple
+from os import path
+from typing import List, Any, Dict, Callable, Union, Hashable, Set, Tuple
 import datetime
+from time import perf_counter
 
 import requests
 import yaml
 from core.chat_functions import (
+    BROADCAST_CONCURRENCY,
+    broadcast,
+    render_markdown,
+    text_content,
     send_text_to_room,
     send_reaction,
     send_replace,
@@ -24,14 +30,25 @@ from nio import (
     MatrixRoom,
 )
 from core.timer import Timer
+from core.sender import PRIORITY_MESSAGE, PRIORITY_REACTION, PRIORITY_BULK
+from core.executor import run_cpu
+from core.datastore import PluginDataStore, read_only_view, room_data_key
+from core.persistentmap import PersistentMap, RingBuffer
+from core.registry import CommandRegistry, HookRegistry
+from core.metrics import WriteStats
+from core.schema import decode_json, encode_json, load_pickle, register_data_class, register_function
+from core.serializer import get_serializer
+from core.storage import DATABASE_FILENAME, run_in_storage_thread
+from core.statefile import read_state_file, write_state_file, remove_state_file, state_file_candidates
 from thefuzz import fuzz
 import copy
-import jsonpickle
-import mistune  # markdown parser: https://github.com/lepture/mistune
 from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# immutable values compared cheaply by store_data() to skip writing unchanged data
+_SCALAR_TYPES: Tuple[type, ...] = (bool, int, float, str, bytes, type(None))
+
 
 class Plugin:
     # persist configured directories across all plugins
@@ -39,6 +56,10 @@ class Plugin:
     state_dir: str = "state"
     config_dir: str = "config"
     command_prefix: str = "!s"
+    data_write_delay: float = 0
+    data_format: str = "msgpack"
+    image_format: str = "png"
+    image_quality: int = 85
 
     def __init__(self, name: str, category: str, description: str):
         """
@@ -54,6 +75,8 @@ class Plugin:
         self.timers: List[Timer] = []
         self.rooms: List[str] = []
         self.client: AsyncClient or None = None
+        self.command_registry: CommandRegistry or None = None
+        self.hook_registry: HookRegistry or None = None
 
         # assert self.state_dir, "Plugin.state_dir must be initialized once before plugins can be instantiated"
         # assert self.config_dir, "Plugin.config_dir must be initialized once before plugins can be instantiated"
@@ -65,6 +88,17 @@ class Plugin:
         self.is_directory_based = False  # for backwards compatibility
 
         self.plugin_data: Dict[str, Any] = {}
+        # names of plugin_data changed since they were last written, encoded and written by the next flush
+        self.__dirty_data: Set[str] = set()
+        # digests of plugin_data as it has been encoded when it was last written or loaded, to skip writing data that has not changed
+        self.__data_digests: Dict[str, bytes] = {}
+        self.__pending_state: bool = False
+        self.__state_digest: bytes or None = None
+        self.__flush_task: asyncio.Task or None = None
+        self.__data_loading: asyncio.Task or None = None
+        self.__collections: Dict[str, PersistentMap] = {}
+        self.write_stats: WriteStats = WriteStats()
+        self.data_store: PluginDataStore = PluginDataStore(self.name, os.path.join(self.state_dir, DATABASE_FILENAME))
         self.config_items: Dict[str, Any] = {}
         self.configuration: Union[Dict[Hashable, Any], list, None] = self.__load_config()
         logger.debug(f"{self.name}: Configuration loaded from file: {self.configuration}")
@@ -119,6 +153,8 @@ class Plugin:
         if command not in self.commands.keys():
             self.commands[command] = plugin_command
             self.help_texts[command] = help_text
+            if self.command_registry:
+                self.command_registry.register(self.name, plugin_command)
             # Add rooms from command to the rooms the plugin is valid for
             if room_id:
                 for room in room_id:
@@ -127,6 +163,8 @@ class Plugin:
             logger.debug(f"Added command {command} to rooms {room_id}")
 
             if command_type == "dynamic":
+                # make sure the method can be restored from the state, even if it's not part of a plugin module
+                register_function(method)
                 self._save_state()
         else:
             logger.error(f"Error adding command {command} - command already exists")
@@ -143,6 +181,8 @@ class Plugin:
         if command in self.commands.keys():
             if self.commands.get(command).command_type == "dynamic":
                 del self.commands[command]
+                if self.command_registry:
+                    self.command_registry.unregister(self.name, command)
                 self._save_state()
                 return True
             else:
@@ -203,13 +243,15 @@ class Plugin:
                         PluginHook(
                             event_type,
                             method,
-                            room_id_list=room_id_list,
-                            event_ids=event_ids,
+                            room_id_list=copy.deepcopy(room_id_list),
+                            event_ids=copy.deepcopy(event_ids),
                             hook_type=hook_type,
                         )
                     )
 
+            self.__update_hook_registry(event_type)
             if hook_type == "dynamic":
+                register_function(method)
                 self._save_state()
             logger.debug(f"Added hook for event {event_type}, method {method} to rooms {room_id_list}")
 
@@ -217,6 +259,16 @@ class Plugin:
 
         return self.hooks
 
+    def __update_hook_registry(self, event_type: str):
+        """
+        Push the plugin's current hooks for an event_type to the hook registry, if the plugin is attached to one
+        :param event_type: the event_type whose hooks have changed
+        :return:
+        """
+
+        if self.hook_registry:
+            self.hook_registry.update(self.name, event_type, self.hooks.get(event_type, []))
+
     def del_hook(self, event_type: str, method: Callable, room_id_list: List[str] or None = None) -> bool:
         """
         Remove an active hook for the given event_type and method and an optional list of rooms
@@ -257,6 +309,7 @@ class Plugin:
                         logger.warning(f"Plugin {self.name} tried to remove static hook for {event_type}.")
 
             if hook_removed:
+                self.__update_hook_registry(event_type)
                 self._save_state()
                 logger.debug(f"Removed hook for event {event_type}, method {method}")
                 return True
@@ -324,6 +377,7 @@ class Plugin:
             )
         )
         if timer_type == "dynamic":
+            register_function(method)
             self._save_state()
 
     def _get_timers(self) -> List[Timer]:
@@ -367,31 +421,92 @@ class Plugin:
 
     async def store_data(self, name: str, data: Any) -> bool:
         """
-        Store data in plugins/<pluginname>.dill
+        Store data in the bot's database (<state_dir>/bot.db), only the given name is written.
+        Storing data marks it as changed, scalar values (e.g. numbers or strings) equal to the stored value are skipped right away.
+        Other data is written only if its encoding differs from the one last written, which is checked when the data is written.
+        If storage.write_delay is configured, the data is encoded and written after the delay, once for all changes made in the meantime.
         :param name: Name of the data to store, used as a reference to retrieve it later
         :param data: data to be stored
         :return:    True, if data was successfully stored
                     False, if data could not be stored
         """
 
-        if data != self.plugin_data.get(name):
-            self.plugin_data[name] = data
-            return await self.__save_data_to_file()
-        else:
+        await self.__wait_for_data()
+        stored: Any = self.plugin_data.get(name)
+        if type(data) in _SCALAR_TYPES and type(stored) is type(data) and stored == data and name in self.plugin_data:
+            self.write_stats.unchanged += 1
             return True
 
-    async def read_data(self, name: str) -> Any:
+        self.plugin_data[name] = data
+        return await self.mark_dirty(name)
+
+    async def mark_dirty(self, name: str) -> bool:
+        """
+        Mark data as changed to write it to the bot's database, e.g. after changing data passed to store_data() before in place
+        :param name: Name of the data that has been changed
+        :return:    True, if data was successfully stored
+                    False, if data could not be stored or there is no data of the given name
+        """
+
+        await self.__wait_for_data()
+        if name not in self.plugin_data:
+            return False
+
+        self.write_stats.requested += 1
+        if self.data_write_delay > 0:
+            # write-behind: the data is encoded once by the next flush, combining all changes made in the meantime
+            if name in self.__dirty_data:
+                self.write_stats.coalesced += 1
+            self.__dirty_data.add(name)
+            self.__schedule_flush()
+            return True
+
+        try:
+            encoded: str or bytes = get_serializer(self.data_format).encode(self.plugin_data[name])
+        except Exception as err:
+            logger.critical(f"Could not encode {name} of plugin_data for {self.name}: {err}")
+            return False
+
+        digest: bytes = self.__digest(encoded)
+        if self.__data_digests.get(name) == digest:
+            self.write_stats.unchanged += 1
+            return True
+
+        if await self.__save_data_to_store(name, encoded):
+            self.__data_digests[name] = digest
+            self.write_stats.written += 1
+            return True
+        else:
+            return False
+
+    async def read_data(self, name: str, read_only: bool = False) -> Any:
         """
         Read data from self.plugin_data
         :param name: Name of the data to be retrieved
+        :param read_only: return a read-only view of the data instead of a copy. This avoids copying the whole data on every call, but objects
+                          contained in the data are shared with the plugin's stored data and must not be changed.
+                          Use read_data_for_update() to retrieve data that is going to be changed and stored again.
         :return: the previously stored data
         """
 
+        await self.__wait_for_data()
         if name in self.plugin_data:
-            return copy.deepcopy(self.plugin_data[name])
+            if read_only:
+                return read_only_view(self.plugin_data[name])
+            else:
+                return copy.deepcopy(self.plugin_data[name])
         else:
             return None
 
+    async def read_data_for_update(self, name: str) -> Any:
+        """
+        Read a copy of data from self.plugin_data that may be changed freely and stored again using store_data()
+        :param name: Name of the data to be retrieved
+        :return: a deep copy of the previously stored data
+        """
+
+        return await self.read_data(name)
+
     async def clear_data(self, name: str) -> bool:
         """
         Clear a specific field in self.plugin_data
@@ -400,12 +515,117 @@ class Plugin:
                     False, if name not contained in self.plugin_data or data could not be saved to disk
         """
 
+        await self.__wait_for_data()
         if name in self.plugin_data:
             del self.plugin_data[name]
-            return await self.__save_data_to_file()
+            self.__dirty_data.discard(name)
+            self.__data_digests.pop(name, None)
+            try:
+                await self.data_store.delete(name)
+                return True
+            except Exception as err:
+                logger.critical(f"Could not remove {name} from {self.data_store.filename}: {err}")
+                return False
         else:
             return False
 
+    async def store_room_data(self, room_id: str, name: str, data: Any) -> bool:
+        """
+        Store data belonging to a single room. Every room's data is stored in its own record, so changing the data of one room
+        neither rewrites nor races with the data of other rooms.
+        :param room_id: the room the data belongs to
+        :param name: Name of the data to store, used as a reference to retrieve it later
+        :param data: data to be stored
+        :return:    True, if data was successfully stored
+                    False, if data could not be stored
+        """
+
+        return await self.store_data(room_data_key(room_id, name), data)
+
+    async def read_room_data(self, room_id: str, name: str, read_only: bool = False) -> Any:
+        """
+        Read data belonging to a single room
+        :param room_id: the room the data belongs to
+        :param name: Name of the data to be retrieved
+        :param read_only: return a read-only view of the data instead of a copy, see read_data()
+        :return: the previously stored data, None if there is no data for the room
+        """
+
+        return await self.read_data(room_data_key(room_id, name), read_only=read_only)
+
+    async def clear_room_data(self, room_id: str, name: str) -> bool:
+        """
+        Clear data belonging to a single room
+        :param room_id: the room the data belongs to
+        :param name: name of the data to be cleared
+        :return:    True, if successfully cleared
+                    False, if there was no data for the room or it could not be removed
+        """
+
+        return await self.clear_data(room_data_key(room_id, name))
+
+    async def convert_to_room_data(self, name: str) -> bool:
+        """
+        Split data stored as a single Dict of room_id and data into separate records per room, readable by read_room_data(room_id, name).
+        Meant to convert data stored by previous versions of a plugin, does nothing if there is no such data.
+        :param name: name of the data to convert
+        :return:    True, if the data has been converted
+                    False, if there was no data to convert or it could not be converted
+        """
+
+        rooms_data: Dict[str, Any] or None = await self.read_data(name, read_only=True)
+        if rooms_data is None:
+            return False
+
+        logger.info(f"Converting {name} of {self.name} to data per room for {len(rooms_data)} rooms")
+        for room_id, data in rooms_data.items():
+            if not await self.store_room_data(room_id, name, data):
+                return False
+        return await self.clear_data(name)
+
+    async def open_map(self, name: str, max_size: int = 0, ttl: float = 0) -> PersistentMap:
+        """
+        Open a persistent map, limited in size and/or age of its entries. Unlike store_data(), every change to the map only writes the
+        affected entries, so it's suited for data that changes often, e.g. caches or tracking recent events.
+        Opening a map again returns the same map, the limits of the first call apply.
+        :param name: name of the map, must be unique among the plugin's maps and ring buffers
+        :param max_size: maximum number of entries, the least recently set entries are removed when exceeded. 0 for no limit
+        :param ttl: maximum age of entries in seconds, older entries are removed. 0 for no limit
+        :return: the map
+        """
+
+        if name not in self.__collections:
+            persistent_map: PersistentMap = PersistentMap(name, self.data_store, self.data_format, max_size=max_size, ttl=ttl)
+            await persistent_map._load()
+            self.__collections[name] = self.__collections.get(name, persistent_map)
+        return self.__collections[name]
+
+    async def open_ring_buffer(self, name: str, capacity: int, ttl: float = 0) -> RingBuffer:
+        """
+        Open a persistent ring buffer, holding the latest capacity values appended to it.
+        Opening a ring buffer again returns the same buffer, the limits of the first call apply.
+        :param name: name of the buffer, must be unique among the plugin's maps and ring buffers
+        :param capacity: maximum number of values, the oldest values are removed when exceeded
+        :param ttl: maximum age of values in seconds, older values are removed. 0 for no limit
+        :return: the ring buffer
+        """
+
+        if name not in self.__collections:
+            ring_buffer: RingBuffer = RingBuffer(name, self.data_store, self.data_format, capacity, ttl=ttl)
+            await ring_buffer._load()
+            self.__collections[name] = self.__collections.get(name, ring_buffer)
+        return self.__collections[name]
+
+    def register_data_class(self, cls: type):
+        """
+        Register a class of objects stored by the plugin. Only objects of registered classes can be stored and restored, they are encoded
+        compactly by their attributes and need to be restorable by setting their __dict__.
+        :param cls: the class to register
+        :return:
+        """
+
+        register_data_class(cls)
+
     async def backup_data(self) -> bool:
         """
         Create a backup file of the data currently stored by the plugin. This is not executed automatically and needs to be called by the plugin,
@@ -414,6 +634,7 @@ class Plugin:
                     False, otherwise
         """
 
+        await self.__wait_for_data()
         if self.plugin_data != {}:
             return await self.__save_data_to_json_file(
                 self.plugin_data,
@@ -429,10 +650,8 @@ class Plugin:
         :return: loaded data
         """
 
-        file = open(filename, "rb")
-        data = pickle.load(file)
-        file.close()
-        return data
+        with open(filename, "rb") as file:
+            return load_pickle(file)
 
     async def __load_json_data_from_file(self, filename: str, convert: bool = False) -> Dict[str, Any]:
         """
@@ -449,29 +668,125 @@ class Plugin:
                 f'"py/object": "plugins.{self.name}.',
                 f'"py/object": "plugins.{self.name}.{self.name}.',
             )
-        data = jsonpickle.decode(json_data)
+        data = decode_json(json_data)
 
         return data
 
+    def _start_loading_data(self):
+        """
+        Load plugin_data in the background, accessing the data waits until it has been loaded.
+        Needs to be called from within the running event loop.
+        :return:
+        """
+
+        if self.__data_loading is None:
+            self.__data_loading = asyncio.create_task(self.__load_data(), name=f"load-{self.name}")
+
+    async def __load_data(self):
+        """
+        Load plugin_data, logging the time it took
+        :return:
+        """
+
+        start: float = perf_counter()
+        try:
+            self.plugin_data = await self._load_data_from_file()
+            logger.info(f"Loaded {len(self.plugin_data)} items of data for {self.name} in {(perf_counter() - start) * 1000:.1f}ms")
+        except Exception as err:
+            logger.critical(f"Could not load plugin_data for {self.name}: {err}")
+
+    async def __wait_for_data(self):
+        """
+        Wait for plugin_data to be loaded, if loading has been started
+        :return:
+        """
+
+        if self.__data_loading is not None and not self.__data_loading.done():
+            await self.__data_loading
+
     async def _load_data_from_file(self) -> Dict[str, Any]:
         """
-        Load plugin_data from file
+        Load plugin_data from the plugin's data store. If the plugin hasn't stored any data in it yet, migrate data from json- or
+        pickle-files used by previous versions.
         :return: Data read from file to be loaded into self.plugin_data
         """
 
+        if await self.data_store.exists():
+            return await self.__load_data_from_store()
+
+        plugin_data: Dict[str, Any] = await self.__load_legacy_data_from_file()
+        if plugin_data != {}:
+            logger.warning(f"Converting data for {self.name} to {self.data_store.filename}. This should only happen once.")
+            try:
+                encoded_data: Dict[str, str or bytes] = {name: get_serializer(self.data_format).encode(data) for name, data in plugin_data.items()}
+                await self.data_store.save_all(encoded_data, self.data_format)
+                self.__data_digests = {name: self.__digest(encoded) for name, encoded in encoded_data.items()}
+                for filename in [self.plugin_dataj_filename, self.plugin_data_filename]:
+                    if os.path.isfile(filename):
+                        logger.warning(f"You may remove {filename} now, it is no longer being used.")
+            except Exception as err:
+                logger.critical(f"Could not convert plugin_data for {self.name} to {self.data_store.filename}: {err}")
+
+        return plugin_data
+
+    async def __load_data_from_store(self) -> Dict[str, Any]:
+        """
+        Load and decode all data from the plugin's data store
+        :return: Data read from the store
+        """
+
+        plugin_data: Dict[str, Any] = {}
+        try:
+            encoded_data: Dict[str, Tuple[str, str or bytes]] = await self.data_store.load()
+        except Exception as err:
+            logger.critical(f"Could not load plugin_data for {self.name}: {err}")
+            return {}
+
+        # data stored in a different format than the configured one is converted
+        converted_data: Dict[str, str or bytes] = {}
+        digests: Dict[str, bytes] = {}
+        for name, (value_format, encoded) in encoded_data.items():
+            try:
+                plugin_data[name] = get_serializer(value_format).decode(encoded)
+                if value_format != self.data_format:
+                    encoded = get_serializer(self.data_format).encode(plugin_data[name])
+                    converted_data[name] = encoded
+                else:
+                    digests[name] = self.__digest(encoded)
+            except Exception as err:
+                logger.critical(f"Could not decode {name} of plugin_data for {self.name}: {err}")
+
+        if converted_data:
+            logger.info(f"Converting {', '.join(converted_data.keys())} of plugin_data for {self.name} to {self.data_format}")
+            try:
+                await self.data_store.save_all(converted_data, self.data_format)
+                digests.update({name: self.__digest(encoded) for name, encoded in converted_data.items()})
+            except Exception as err:
+                logger.critical(f"Could not convert plugin_data for {self.name} to {self.data_format}: {err}")
+
+        for filename in [self.plugin_dataj_filename, self.plugin_data_filename]:
+            if os.path.isfile(filename):
+                logger.warning(
+                    f"Data for {self.name} read from {self.data_store.filename}, but {filename} still exists. After "
+                    f"verifying, that {self.name} is running correctly, please remove {filename}"
+                )
+
+        self.__data_digests = digests
+        return plugin_data
+
+    async def __load_legacy_data_from_file(self) -> Dict[str, Any]:
+        """
+        Load plugin_data from json- or pickle-files used by previous versions
+        :return: Data read from file
+        """
+
         plugin_data_from_json: Dict[str, Any] = {}
         plugin_data_from_pickle: Dict[str, Any] = {}
-        abandoned_data: bool = False
 
         try:
             if os.path.isfile(self.plugin_dataj_filename):
                 # local json data found, convert if needed
                 plugin_data_from_json = await self.__load_json_data_from_file(self.plugin_dataj_filename, self.is_directory_based)
-                if os.path.isfile(self.plugin_data_filename):
-                    logger.warning(
-                        f"Data for {self.name} read from {self.plugin_dataj_filename}, but {self.plugin_data_filename} still exists. After "
-                        f"verifying, that {self.name} is running correctly, please remove {self.plugin_data_filename}"
-                    )
 
             elif os.path.isfile(self.plugin_data_filename):
                 # local pickle-data found
@@ -483,24 +798,14 @@ class Plugin:
                 if self.is_directory_based:
                     abandoned_json_file: str = f"plugins/{self.name}.json"
                     if os.path.isfile(abandoned_json_file):
-                        abandoned_data = True
                         logger.warning(f"Loading abandoned data for {self.name} from {abandoned_json_file}. This should only happen once.")
                         plugin_data_from_json = await self.__load_json_data_from_file(abandoned_json_file, convert=True)
+                        logger.warning(f"You may remove {abandoned_json_file} once the data has been converted.")
 
         except Exception as err:
             logger.critical(f"Could not load plugin_data for {self.name}: {err}")
             return {}
 
-        if abandoned_data:
-            if "abandoned_json_file" in locals() and os.path.isfile(abandoned_json_file):
-                logger.warning(f"You may remove {abandoned_json_file} now, it is no longer being used.")
-            await self.__save_data_to_json_file(plugin_data_from_json, self.plugin_dataj_filename)
-
-        if plugin_data_from_pickle != {} and not os.path.isfile(self.plugin_dataj_filename):
-            logger.warning(f"Converting data for {self.name} to {self.plugin_dataj_filename}. This should only happen once.")
-            if os.path.isfile(self.plugin_data_filename):
-                logger.warning(f"You may remove {self.plugin_data_filename} now, it is no longer being used.")
-
         if plugin_data_from_pickle != {}:
             return plugin_data_from_pickle
         elif plugin_data_from_json != {}:
@@ -508,21 +813,6 @@ class Plugin:
         else:
             return {}
 
-    async def __save_data_to_pickle_file(self, data: Dict[str, Any], filename: str):
-        """
-        Save data to a pickle-file
-        :param data: data to save
-        :param filename: filename to save the data to
-        :return:    True, if data stored successfully
-                    False, otherwise
-        """
-        try:
-            pickle.dump(data, open(filename, "wb"))
-            return True
-        except Exception as err:
-            logger.critical(f"Could not write plugin_data to {self.plugin_data_filename}: {err}")
-            return False
-
     async def __save_data_to_json_file(self, data: Dict[str, Any], filename: str):
         """
         Save data to a json file
@@ -533,7 +823,7 @@ class Plugin:
         """
 
         try:
-            json_data = jsonpickle.encode(data)
+            json_data = encode_json(data)
             file = open(filename, "w")
             file.write(json_data)
             file.close()
@@ -542,35 +832,117 @@ class Plugin:
             logger.critical(f"Could not write plugin_data to {self.plugin_data_filename}: {err}")
             return False
 
-    async def __save_data_to_file(self) -> bool:
+    def __schedule_flush(self):
         """
-        Save modified plugin_data to disk
-        :return:    True, if data stored successfully
+        Make sure pending data and state are written after data_write_delay (or right after the current task, if there is no delay),
+        needs to be called from within the running event loop
+        :return:
+        """
+
+        if self.__flush_task is None:
+            self.__flush_task = asyncio.create_task(self.__flush_later())
+
+    async def __flush_later(self):
+        """
+        Wait for data_write_delay, then write all changes made in the meantime
+        :return:
+        """
+
+        await asyncio.sleep(self.data_write_delay)
+        # changes made while writing schedule the next flush
+        self.__flush_task = None
+        await self._flush()
+
+    async def _flush(self) -> bool:
+        """
+        Immediately write all pending data and state, e.g. on shutdown
+        :return:    True, if all pending changes have been written successfully
                     False, otherwise
         """
 
-        if self.plugin_data != {}:
-            """there is actual data to save"""
-            return await self.__save_data_to_json_file(self.plugin_data, self.plugin_dataj_filename)
+        if self.__flush_task is not None:
+            self.__flush_task.cancel()
+            self.__flush_task = None
 
-        else:
-            logger.debug("No data to save, remove datafiles")
-            """no data to save, remove file"""
-            if os.path.isfile(self.plugin_data_filename):
+        success: bool = True
+        if self.__pending_state:
+            # cleared before writing, so changes made while writing mark the state as pending again
+            self.__pending_state = False
+            state_saved: bool = False
+            try:
+                # the state is encoded on the event loop, as it reads the plugin's commands, hooks and timers, but written in the storage thread
+                json_data: str or None = self.__encode_state()
+                written: bool
+                (state_saved, written) = await run_in_storage_thread(self.__write_encoded_state, json_data)
+                if written:
+                    self.write_stats.written += 1
+            except Exception as err:
+                logger.critical(f"Could not save plugin_state of {self.name}: {err}")
+            finally:
+                if not state_saved:
+                    # keep the state pending to retry with the next flush
+                    logger.warning(f"plugin_state of {self.name} has not been written, it is written again by the next flush")
+                    self.__pending_state = True
+                    success = False
+
+        if self.__dirty_data:
+            dirty_data: Set[str] = self.__dirty_data
+            self.__dirty_data = set()
+            pending_data: Dict[str, str or bytes] = {}
+            digests: Dict[str, bytes] = {}
+            for name in dirty_data:
                 try:
-                    remove(self.plugin_data_filename)
-                    return True
+                    encoded: str or bytes = get_serializer(self.data_format).encode(self.plugin_data[name])
                 except Exception as err:
-                    logger.critical(f"Could not remove file {self.plugin_data_filename}: {err}")
-                    return False
+                    logger.critical(f"Could not encode {name} of plugin_data for {self.name}: {err}")
+                    success = False
+                    continue
+                digests[name] = self.__digest(encoded)
+                if self.__data_digests.get(name) == digests[name]:
+                    # changed and changed back, or stored again without changes
+                    self.write_stats.unchanged += 1
+                else:
+                    pending_data[name] = encoded
+            try:
+                if pending_data:
+                    await self.data_store.save_all(pending_data, self.data_format)
+                    self.write_stats.written += len(pending_data)
+                    self.__data_digests.update({name: digests[name] for name in pending_data})
+            except Exception as err:
+                logger.critical(f"Could not write {', '.join(pending_data.keys())} of plugin_data to {self.data_store.filename}: {err}")
+                # keep the data dirty to retry with the next flush
+                self.__dirty_data.update(pending_data.keys())
+                success = False
 
-            if os.path.isfile(self.plugin_dataj_filename):
-                try:
-                    remove(self.plugin_dataj_filename)
-                    return True
-                except Exception as err:
-                    logger.critical(f"Could not remove file {self.plugin_dataj_filename}: {err}")
-                    return False
+        return success
+
+    @staticmethod
+    def __digest(encoded: str or bytes) -> bytes:
+        """
+        Calculate a digest of encoded data to detect changes without comparing the data itself
+        :param encoded: the encoded data
+        :return: the digest
+        """
+
+        if isinstance(encoded, str):
+            encoded = encoded.encode()
+        return hashlib.blake2b(encoded, digest_size=16).digest()
+
+    async def __save_data_to_store(self, name: str, encoded: str or bytes) -> bool:
+        """
+        Save a single item of plugin_data to the plugin's data store
+        :param name: name of the item to save
+        :param encoded: the encoded data
+        :return:    True, if data stored successfully
+                    False, otherwise
+        """
+
+        try:
+            await self.data_store.save(name, encoded, self.data_format)
+            return True
+        except Exception as err:
+            logger.critical(f"Could not write {name} of plugin_data to {self.data_store.filename}: {err}")
+            return False
 
     async def __expandable_message_body(self, header: str, body: str) -> str:
         """
@@ -584,8 +956,8 @@ class Plugin:
         :return: expandable message
         """
 
-        markdown_header: str = mistune.html(header)
-        markdown_body: str = mistune.html(body)
+        markdown_header: str = render_markdown(header)
+        markdown_body: str = render_markdown(body)
         return f"<details><summary>{markdown_header}</summary><br>{markdown_body}</details>"
 
     async def send_message(
@@ -596,6 +968,7 @@ class Plugin:
         expanded_message: str = "",
         delay: int = 0,
         markdown_convert: bool = True,
+        priority: int = PRIORITY_MESSAGE,
     ) -> str or None:
         """
         Send a message to a room, usually utilized by plugins to respond to commands
@@ -605,6 +978,7 @@ class Plugin:
         :param expanded_message: an optional part of the message only visible after expanding the message (at least on Element Web)
         :param delay: optional delay with typing notification, 1..1000ms
         :param markdown_convert: optional flag if content should be converted to markdown, defaults to True
+        :param priority: optional priority of the message, PRIORITY_BULK for messages posted by timers to many rooms
         :return: the event_id of the sent message or None in case of an error
         """
 
@@ -618,7 +992,9 @@ class Plugin:
 
         if expanded_message:
             message = await self.__expandable_message_body(message, expanded_message)
-        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(client, room_id, message, notice=False, markdown_convert=markdown_convert)
+        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(
+            client, room_id, message, notice=False, markdown_convert=markdown_convert, priority=priority
+        )
 
         if isinstance(event_response, RoomSendResponse):
             return event_response.event_id
@@ -674,6 +1050,7 @@ class Plugin:
         message: str,
         expanded_message: str = "",
         markdown_convert: bool = True,
+        priority: int = PRIORITY_MESSAGE,
     ) -> str or None:
         """
         Send a notice to a room, usually utilized by plugins to post errors, help texts or other messages not warranting pinging users
@@ -682,12 +1059,15 @@ class Plugin:
         :param message: the actual message
         :param expanded_message: an optional part of the message only visible after expanding the message (at least on Element Web)
         :param markdown_convert: optional flag if content should be converted to markdown, defaults to True
+        :param priority: optional priority of the notice, PRIORITY_BULK for notices posted by timers to many rooms
         :return: the event_id of the sent message or None in case of an error
         """
 
         if expanded_message:
             message = await self.__expandable_message_body(message, expanded_message)
-        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(client, room_id, message, notice=True, markdown_convert=markdown_convert)
+        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(
+            client, room_id, message, notice=True, markdown_convert=markdown_convert, priority=priority
+        )
 
         if isinstance(event_response, RoomSendResponse):
             return event_response.event_id
@@ -719,6 +1099,42 @@ class Plugin:
             markdown_convert=markdown_convert,
         )
 
+    async def broadcast_message(
+        self,
+        client,
+        room_ids: List[str],
+        message: str,
+        expanded_message: str = "",
+        notice: bool = True,
+        markdown_convert: bool = True,
+        priority: int = PRIORITY_BULK,
+    ) -> Dict[str, str or RoomSendError or Exception]:
+        """
+        Send the same message to several rooms at once, e.g. to announce something by a timer. The message is rendered only once and sent to all rooms
+        concurrently, several rooms at the same time.
+        :param client: AsyncClient used to send the message
+        :param room_ids: the rooms to send the message to
+        :param message: the actual message
+        :param expanded_message: an optional part of the message only visible after expanding the message (at least on Element Web)
+        :param notice: optional flag if the message should be sent as notice, defaults to True
+        :param markdown_convert: optional flag if content should be converted to markdown, defaults to True
+        :param priority: optional priority of the messages, defaults to PRIORITY_BULK
+        :return: Dict of room_id and the event_id of the message sent to the room or the error (RoomSendError or exception) preventing it
+        """
+
+        if expanded_message:
+            message = await self.__expandable_message_body(message, expanded_message)
+        content: dict = text_content(message, notice=notice, markdown_convert=markdown_convert)
+
+        results: Dict[str, str or RoomSendError or Exception] = {}
+        for room_id, response in (await broadcast(client, room_ids, "m.room.message", content, priority=priority)).items():
+            if isinstance(response, RoomSendResponse):
+                results[room_id] = response.event_id
+            else:
+                logger.warning(f"Error sending {message} to {room_id}: {response!r}")
+                results[room_id] = response
+        return results
+
     async def notice(self, client, room_id: str, message: str) -> str or None:
         """
         ** DEPRECATED ** Alias for send_notice
@@ -756,17 +1172,18 @@ class Plugin:
             message = await self.__expandable_message_body(message, expanded_message)
         return await send_replace(client, room_id, event_id, message, message_type="m.notice")
 
-    async def send_reaction(self, client, room_id: str, event_id: str, reaction: str):
+    async def send_reaction(self, client, room_id: str, event_id: str, reaction: str, wait: bool = True):
         """
         React to a specific event
         :param client: (nio.AsyncClient) The client to communicate to matrix with
         :param room_id: (str) room_id to send the reaction to (is this actually being used?)
         :param event_id: (str) event_id to react to
         :param reaction: (str) the reaction to send
+        :param wait: (bool) whether to wait for the reaction to be sent, if False it's sent in the background
         :return:
         """
 
-        await send_reaction(client, room_id, event_id, reaction)
+        await send_reaction(client, room_id, event_id, reaction, wait=wait)
 
     async def respond_reaction(self, command, reaction: str):
         return await self.send_reaction(
@@ -834,7 +1251,7 @@ class Plugin:
 
     async def send_image(self, client: AsyncClient, room_id: str, image: Image):
         """
-        Posts an image to the given room
+        Posts an image to the given room, encoded in the format and quality configured in the images-section of the bot's config
         :param client:
         :param room_id:
         :param image:
@@ -842,7 +1259,7 @@ class Plugin:
         """
 
         if image is not None:
-            event_response: RoomSendResponse or RoomSendError = await send_image(client, room_id, image)
+            event_response: RoomSendResponse or RoomSendError = await send_image(client, room_id, image, self.image_format, self.image_quality)
 
             if isinstance(event_response, RoomSendResponse):
                 return event_response.event_id
@@ -852,6 +1269,19 @@ class Plugin:
             logger.warning(f"send_image called without valid image")
             return None
 
+    async def run_cpu(self, method: Callable, *args: Any, **kwargs: Any) -> Any:
+        """
+        Run CPU-bound work (e.g. large computations, image processing) outside of the event loop, so the bot stays responsive meanwhile.
+        Depending on the configuration, the work is executed in a separate process: the method has to be defined on module level and
+        arguments and return value need to be picklable.
+        :param method: the function to run
+        :param args: arguments to the function
+        :param kwargs: keyword arguments to the function
+        :return: the function's return value
+        """
+
+        return await run_cpu(method, *args, **kwargs)
+
     async def is_user_in_room(
         self,
         client: AsyncClient,
@@ -1065,10 +1495,50 @@ class Plugin:
 
     def _save_state(self) -> bool:
         """
-        Save dynamic commands, dynamic hooks and all timers to state file
+        Save dynamic commands, dynamic hooks and all timers to state file.
+        The state is written in the storage thread, after data_write_delay if it is set, combining all changes made in the meantime.
         :return:
         """
 
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # no event loop running (e.g. while setting up the plugin), write immediately
+            return self.__write_state()
+
+        self.write_stats.requested += 1
+        if self.__pending_state:
+            self.write_stats.coalesced += 1
+        self.__pending_state = True
+        self.__schedule_flush()
+        return True
+
+    def __write_state(self) -> bool:
+        """
+        Write dynamic commands, dynamic hooks and all timers to state file
+        :return:    True, if the state has been written successfully
+                    False, otherwise
+        """
+
+        try:
+            json_data: str or None = self.__encode_state()
+        except Exception as err:
+            logger.critical(f"Could not encode plugin_state of {self.name}: {err}")
+            return False
+
+        success: bool
+        written: bool
+        (success, written) = self.__write_encoded_state(json_data)
+        if written:
+            self.write_stats.written += 1
+        return success
+
+    def __encode_state(self) -> str or None:
+        """
+        Encode dynamic commands, dynamic hooks and all timers to be written to the state file
+        :return: the encoded state, None if there is no state to save
+        """
+
         dynamic_commands: Dict[str, PluginCommand] = {}
         dynamic_hooks: Dict[str, List[PluginHook]] = {}
 
@@ -1093,26 +1563,53 @@ class Plugin:
             self._get_timers(),
         )
 
-        if plugin_state != ({}, {}, []):
-            # we have an actual state to save
-            try:
-                json_data = jsonpickle.encode(plugin_state)
-                file = open(self.plugin_state_filename, "w")
-                file.write(json_data)
-                file.close()
-                return True
-            except Exception as err:
-                logger.critical(f"Could not write plugin_state to {self.plugin_state_filename}: {err}")
-                return False
+        if plugin_state == ({}, {}, []):
+            return None
+        return encode_json(plugin_state)
+
+    def __write_encoded_state(self, json_data: str or None) -> Tuple[bool, bool]:
+        """
+        Write the encoded state to the state file, or remove the file if there is no state. Does blocking file IO.
+        :param json_data: the encoded state, None if there is no state to save
+        :return: (tuple) True, if the state has been saved successfully, False, otherwise
+                 and True, if the file has actually been written, False, if it was unchanged or could not be written
+        """
+
+        if json_data is not None:
+            # skip writing the state if nothing has changed, e.g. no timer has been executed since the last write
+            digest: bytes = self.__digest(json_data)
+            if digest == self.__state_digest:
+                return True, False
+            if write_state_file(self.plugin_state_filename, json_data):
+                self.__state_digest = digest
+                return True, True
+            else:
+                return False, False
         else:
             # state is empty, remove file if it exists
-            if os.path.isfile(self.plugin_state_filename):
-                try:
-                    remove(self.plugin_state_filename)
-                    return True
-                except Exception as err:
-                    logger.critical(f"Could not remove file {self.plugin_state_filename}: {err}")
-                    return False
+            self.__state_digest = None
+            existed: bool = path.isfile(self.plugin_state_filename)
+            success: bool = remove_state_file(self.plugin_state_filename)
+            return success, success and existed
+
+    @staticmethod
+    def __validate_state(plugin_state: Any) -> Tuple[Dict, Dict, List]:
+        """
+        Make sure a decoded state has the structure written by _save_state
+        :param plugin_state: the decoded state
+        :return: the state, if it is valid
+        """
+
+        if not isinstance(plugin_state, (tuple, list)) or len(plugin_state) != 3:
+            raise ValueError("plugin_state is not a tuple of commands, hooks and timers")
+        (dynamic_commands, dynamic_hooks, timers) = plugin_state
+        if not all(isinstance(command, PluginCommand) for command in dynamic_commands.values()):
+            raise ValueError("invalid dynamic commands")
+        if not all(isinstance(hook, PluginHook) for hooks_list in dynamic_hooks.values() for hook in hooks_list):
+            raise ValueError("invalid dynamic hooks")
+        if not all(isinstance(timer, Timer) for timer in timers):
+            raise ValueError("invalid timers")
+        return dynamic_commands, dynamic_hooks, timers
 
     def _load_state(self):
         """
@@ -1120,21 +1617,34 @@ class Plugin:
         :return:
         """
 
-        try:
-            file = open(self.plugin_state_filename, "r")
-            json_data: str = file.read()
-            file.close()
-        except Exception as err:
-            logger.debug(f"Could not load plugin_state from {self.plugin_state_filename}: {err}")
-            return
-
         dynamic_commands: Dict[str, PluginCommand]
-        dynamic_hooks: Dict[str, PluginHook]
+        dynamic_hooks: Dict[str, List[PluginHook]]
         timers: List[Timer]
-        (dynamic_commands, dynamic_hooks, timers) = jsonpickle.decode(json_data)
+
+        # fall back to the last valid snapshot if the state file is missing or damaged
+        for filename in state_file_candidates(self.plugin_state_filename):
+            json_data: str or None = read_state_file(filename)
+            if json_data is None:
+                continue
+            try:
+                (dynamic_commands, dynamic_hooks, timers) = self.__validate_state(decode_json(json_data))
+            except Exception as err:
+                logger.warning(f"Could not load plugin_state from {filename}: {err}")
+                continue
+            if filename != self.plugin_state_filename:
+                logger.warning(f"Loaded plugin_state of {self.name} from the last valid snapshot {filename}")
+            else:
+                self.__state_digest = self.__digest(json_data)
+            break
+        else:
+            logger.debug(f"No plugin_state found for {self.name}")
+            return
 
         # add dynamic commands
         self.commands.update(dynamic_commands)
+        if self.command_registry:
+            for plugin_command in dynamic_commands.values():
+                self.command_registry.register(self.name, plugin_command)
 
         # add dynamic hooks
         event: str
@@ -1144,6 +1654,7 @@ class Plugin:
                 self._get_hooks()[event] += hooks_list
             else:
                 self.hooks[event] = hooks_list
+            self.__update_hook_registry(event)
 
         # add last execution for static timers and all dynamic timers
         state_timer: Timer
@@ -1254,6 +1765,30 @@ class Plugin:
         """
         self.client = client
 
+    def _set_command_registry(self, command_registry: CommandRegistry) -> None:
+        """
+        Attach the plugin to the bot's command registry and register all commands added so far
+        :param command_registry:
+        :return:
+        """
+
+        self.command_registry = command_registry
+        plugin_command: PluginCommand
+        for plugin_command in self.commands.values():
+            self.command_registry.register(self.name, plugin_command)
+
+    def _set_hook_registry(self, hook_registry: HookRegistry) -> None:
+        """
+        Attach the plugin to the bot's hook registry and register all hooks added so far
+        :param hook_registry:
+        :return:
+        """
+
+        self.hook_registry = hook_registry
+        event_type: str
+        for event_type in self.hooks.keys():
+            self.__update_hook_registry(event_type)
+
     async def get_client(self) -> AsyncClient:
         """
         Get the bot's client instance
@@ -1263,6 +1798,7 @@ class Plugin:
         return self.client
 
 
+@register_data_class
 class PluginCommand:
     def __init__(
             self,
@@ -1301,6 +1837,7 @@ class PluginCommand:
         return not self.room_id or room_id in self.room_id
 
 
+@register_data_class
 class PluginHook:
     def __init__(
         self,
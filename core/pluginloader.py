@@ -1,20 +1,21 @@
-import copy
-
+import asyncio
 from nio import UnknownEvent, RoomMessageText, AsyncClient
 
 from core.chat_functions import send_text_to_room
 from core.plugin import Plugin, PluginCommand, PluginHook
 from core.timer import Timer
+from core.registry import CommandRegistry, HookRegistry, FuzzyCommandIndex
+from core.metrics import LatencyMetrics
+from core.workqueue import WorkQueue
 from core.config import Config
+from core.executor import setup_executor
 from sys import modules
 from re import match
-from time import time
-import operator
-from typing import List, Dict
+from time import time, perf_counter
+from typing import List, Dict, Tuple, Set
 import glob
 from os.path import basename, isdir
 import importlib
-from thefuzz import fuzz
 import logging
 import traceback
 
@@ -44,6 +45,11 @@ class PluginLoader:
         Plugin.state_dir = self.config.state_dir
         Plugin.config_dir = self.config.plugins_config_dir
         Plugin.command_prefix = self.config.command_prefix
+        Plugin.data_write_delay = self.config.data_write_delay
+        Plugin.data_format = self.config.data_format
+        Plugin.image_format = self.config.image_format
+        Plugin.image_quality = self.config.image_quality
+        setup_executor(self.config.cpu_workers, self.config.cpu_use_processes)
 
         for module in module_dirs:
             if self.is_allowed_plugin(module):
@@ -60,6 +66,14 @@ class PluginLoader:
 
         # get all loaded plugins from sys.modules and make them available as plugin_list
         self.__plugin_list: Dict[str, Plugin] = {}
+        self.command_registry: CommandRegistry = CommandRegistry()
+        self.fuzzy_command_index: FuzzyCommandIndex = FuzzyCommandIndex(self.command_registry)
+        self.hook_registry: HookRegistry = HookRegistry()
+        self.hook_metrics: LatencyMetrics = LatencyMetrics()
+        self.__hook_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.__hook_tasks: Set[asyncio.Task] = set()
+        self.event_queue: WorkQueue or None = None
+        """the queue processing events outside of the sync loop, if configured"""
 
         for key in modules.keys():
             if match(r"^plugins\.\w*(\.\w*)?", key):
@@ -69,6 +83,8 @@ class PluginLoader:
         for plugin in self.__plugin_list.values():
             """Set the bot's client instance"""
             plugin._set_client(client)
+            plugin._set_command_registry(self.command_registry)
+            plugin._set_hook_registry(self.hook_registry)
 
             """Display details about the loaded plugins, this does nothing else"""
             logger.info(f"Loaded plugin {plugin.name}:")
@@ -94,9 +110,44 @@ class PluginLoader:
             return not self.config.plugins_allowlist or plugin in self.config.plugins_allowlist
 
     async def load_plugin_data(self):
+        """
+        Start loading the data of all plugins concurrently in the background, so startup does not depend on the size of the stored data.
+        Plugins accessing their data wait until their own data has been loaded.
+        :return:
+        """
 
         for plugin in self.__plugin_list.values():
-            plugin.plugin_data = await plugin._load_data_from_file()
+            plugin._start_loading_data()
+
+    async def stop_hooks(self, timeout: float = 5):
+        """
+        Wait for hooks running in the background to finish, e.g. on shutdown before writing the plugins' data.
+        Hooks still running after the timeout are cancelled.
+        :param timeout: maximum number of seconds to wait for running hooks
+        :return:
+        """
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        deadline: float = loop.time() + timeout
+        # hooks may be started while waiting, e.g. by events processed in the meantime
+        while self.__hook_tasks and loop.time() < deadline:
+            await asyncio.wait(list(self.__hook_tasks), timeout=deadline - loop.time())
+
+        if self.__hook_tasks:
+            logger.warning(f"Cancelling {len(self.__hook_tasks)} hooks that did not finish within {timeout}s")
+            tasks: List[asyncio.Task] = list(self.__hook_tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def flush_plugin_data(self):
+        """
+        Write all pending plugin data and state, e.g. on shutdown
+        :return:
+        """
+
+        for plugin in self.get_plugins().values():
+            await plugin._flush()
 
     async def load_plugin_state(self):
         """
@@ -120,24 +171,13 @@ class PluginLoader:
         except KeyError:
             return None
 
-    def get_hooks(self) -> Dict[str, List[PluginHook]]:
+    def get_hooks(self) -> Dict[str, Tuple[PluginHook, ...]]:
         """
         Get all hooks currently registered by all plugins
-        :return: Dict of event_type and list of PluginHooks for the event_type
+        :return: Dict of event_type and an immutable snapshot of PluginHooks for the event_type
         """
 
-        all_plugin_hooks: Dict[str, List[PluginHook]] = {}
-        plugin: Plugin
-
-        for plugin in self.get_plugins().values():
-            for event_type, current_plugin_hooks in plugin._get_hooks().items():
-                if event_type in all_plugin_hooks.keys():
-                    for plugin_hook in current_plugin_hooks:
-                        all_plugin_hooks[event_type].append(plugin_hook)
-                else:
-                    all_plugin_hooks[event_type] = copy.deepcopy(current_plugin_hooks)
-
-        return all_plugin_hooks
+        return self.hook_registry.get_hooks()
 
     def get_commands(self) -> Dict[str, PluginCommand]:
         """
@@ -145,13 +185,7 @@ class PluginLoader:
         :return: Dict of command-string and the corresponding PluginCommand
         """
 
-        plugin_commands: Dict[str, PluginCommand] = {}
-        plugin: Plugin
-
-        for plugin in self.get_plugins().values():
-            plugin_commands.update(plugin._get_commands())
-
-        return plugin_commands
+        return self.command_registry.get_commands()
 
     def get_timers(self) -> List[Timer]:
         """
@@ -181,30 +215,24 @@ class PluginLoader:
         command_start = command.command.split()[0].lower()
         run_command: str = ""
 
-        if command_start in self.get_commands().keys():
+        if command_start in self.command_registry:
             run_command = command_start
 
         # Command not found, try fuzzy matching
         else:
-            ratios: Dict[str, int] = {}
-            for key in self.get_commands().keys():
-                if fuzz.ratio(command_start, key) > 60:
-                    ratios[key] = fuzz.ratio(command_start, key)
-
-            # Sort matching commands by match percentage and get the highest match
-            if ratios != {}:
-                run_command = sorted(ratios.items(), key=operator.itemgetter(1), reverse=True)[0][0]
+            run_command = self.fuzzy_command_index.match(command_start) or ""
 
         # check if we did actually find a matching command
         if run_command != "":
-            if not self.get_commands()[run_command].room_id or command.room.room_id in self.get_commands()[run_command].room_id:
+            plugin_command: PluginCommand = self.command_registry.get(run_command)
+            if not plugin_command.room_id or command.room.room_id in plugin_command.room_id:
 
                 # check if the user's power_level matches the command's requirement
-                if command.room.power_levels.get_user_level(command.event.sender) >= self.get_commands()[run_command].power_level:
+                if command.room.power_levels.get_user_level(command.event.sender) >= plugin_command.power_level:
 
                     # Make sure, exceptions raised by plugins do not kill the bot
                     try:
-                        await self.get_commands()[run_command].method(command)
+                        await plugin_command.method(command)
                     except Exception:
                         logger.critical(f"Plugin failed to catch exception caused by {command_start}:")
                         traceback.print_exc()
@@ -229,24 +257,70 @@ class PluginLoader:
         :return:
         """
 
-        if event_type in self.get_hooks().keys():
+        related_event_id: str or None = event.source.get("content", {}).get("m.relates_to", {}).get("event_id")
 
-            plugin_hooks: List[PluginHook] = self.get_hooks()[event_type]
-            plugin_hook: PluginHook
+        # only hooks valid for the room of the current event and, if limited to specific event_ids, the event it relates to
+        plugin_hooks: Tuple[PluginHook, ...] = self.hook_registry.get_for_room(event_type, room.room_id, related_event_id)
+        plugin_hook: PluginHook
 
-            for plugin_hook in plugin_hooks:
-                if (not plugin_hook.room_id_list or room.room_id in plugin_hook.room_id_list) and (
-                    not plugin_hook.event_ids or event.source["content"]["m.relates_to"]["event_id"] in plugin_hook.event_ids
-                ):
-                    # plugin_hook is valid for room of the current event and
-                    # event relates to a specified event_id
+        for plugin_hook in plugin_hooks:
+            if self.config.hooks_concurrent:
+                # run the hook in the background, so slow hooks do not delay other hooks or the sync loop
+                task: asyncio.Task = asyncio.create_task(self.__run_hook_concurrently(client, plugin_hook, room, event))
+                self.__hook_tasks.add(task)
+                task.add_done_callback(self.__hook_tasks.discard)
+            else:
+                await self.__run_hook(client, plugin_hook, room, event)
 
-                    # Make sure, exceptions raised by plugins do not kill the bot
-                    try:
-                        await plugin_hook.method(client, room.room_id, event)
-                    except Exception as err:
-                        logger.critical(f"Plugin failed to catch exception caused by hook {plugin_hook.method} on {room} for {event}:")
-                        traceback.print_exc()
+    async def __run_hook_concurrently(self, client, plugin_hook: PluginHook, room, event: UnknownEvent or RoomMessageText):
+        """
+        Run a single hook, limiting the number of hooks running at the same time per plugin
+        :param client:
+        :param plugin_hook:
+        :param room:
+        :param event:
+        :return:
+        """
+
+        plugin_name: str = self.hook_registry.get_plugin_name(plugin_hook) or ""
+        semaphore: asyncio.Semaphore or None = self.__hook_semaphores.get(plugin_name)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(max(1, self.config.hooks_max_concurrency_per_plugin))
+            self.__hook_semaphores[plugin_name] = semaphore
+
+        async with semaphore:
+            await self.__run_hook(client, plugin_hook, room, event)
+
+    async def __run_hook(self, client, plugin_hook: PluginHook, room, event: UnknownEvent or RoomMessageText):
+        """
+        Run a single hook, applying the configured timeout and recording its execution time
+        :param client:
+        :param plugin_hook:
+        :param room:
+        :param event:
+        :return:
+        """
+
+        hook_name: str = f"{self.hook_registry.get_plugin_name(plugin_hook)}.{plugin_hook.method.__name__}"
+        error: bool = False
+        timeout: bool = False
+        start: float = perf_counter()
+
+        # Make sure, exceptions raised by plugins do not kill the bot
+        try:
+            if self.config.hooks_timeout:
+                await asyncio.wait_for(plugin_hook.method(client, room.room_id, event), self.config.hooks_timeout)
+            else:
+                await plugin_hook.method(client, room.room_id, event)
+        except asyncio.TimeoutError:
+            timeout = True
+            logger.error(f"Hook {hook_name} on {room.room_id} cancelled after exceeding the timeout of {self.config.hooks_timeout}s")
+        except Exception:
+            error = True
+            logger.critical(f"Plugin failed to catch exception caused by hook {plugin_hook.method} on {room} for {event}:")
+            traceback.print_exc()
+        finally:
+            self.hook_metrics.record(hook_name, perf_counter() - start, error=error, timeout=timeout)
 
     async def run_timers(self, client, timestamp: float) -> float:
         """
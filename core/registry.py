@@ -0,0 +1,381 @@
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Set, FrozenSet, Iterable
+import logging
+
+from rapidfuzz import fuzz, process
+
+logger = logging.getLogger(__name__)
+
+
+class CommandRegistry:
+    def __init__(self):
+        """
+        Incrementally maintained lookup table of all commands registered by all plugins.
+        Plugins update the registry whenever they add or remove a command, so dispatching a command is a single dict lookup instead of
+        rebuilding the table for every message.
+        If several plugins register the same command, the plugin registered last wins (same as merging the plugins' commands in load order).
+        """
+
+        # command -> list of (plugin_name, PluginCommand) in registration order
+        self.__entries: Dict[str, List[Tuple[str, "PluginCommand"]]] = {}
+        # command -> currently active PluginCommand
+        self.__commands: Dict[str, "PluginCommand"] = {}
+        self.version: int = 0
+        """incremented on every change, allows derived indexes to detect they're stale"""
+
+    def register(self, plugin_name: str, plugin_command: "PluginCommand"):
+        """
+        Add a command to the registry or replace an existing entry of the same plugin
+        :param plugin_name: name of the plugin providing the command
+        :param plugin_command: the PluginCommand to register
+        :return:
+        """
+
+        entries: List[Tuple[str, "PluginCommand"]] = self.__entries.setdefault(plugin_command.command, [])
+        for index, (entry_plugin_name, entry_command) in enumerate(entries):
+            if entry_plugin_name == plugin_name:
+                entries[index] = (plugin_name, plugin_command)
+                break
+        else:
+            entries.append((plugin_name, plugin_command))
+
+        self.__commands[plugin_command.command] = entries[-1][1]
+        self.version += 1
+
+    def unregister(self, plugin_name: str, command: str) -> bool:
+        """
+        Remove a plugin's command from the registry. A command of the same name registered by another plugin becomes active again.
+        :param plugin_name: name of the plugin providing the command
+        :param command: the command to remove
+        :return:    True, if the command has been found and removed
+                    False, otherwise
+        """
+
+        entries: List[Tuple[str, "PluginCommand"]] = self.__entries.get(command, [])
+        for index, (entry_plugin_name, entry_command) in enumerate(entries):
+            if entry_plugin_name == plugin_name:
+                del entries[index]
+                break
+        else:
+            return False
+
+        if entries:
+            self.__commands[command] = entries[-1][1]
+        else:
+            del self.__entries[command]
+            del self.__commands[command]
+        self.version += 1
+        return True
+
+    def get(self, command: str) -> "PluginCommand" or None:
+        """
+        Look up a single command
+        :param command: the command to look for
+        :return:    the active PluginCommand, if found
+                    None, otherwise
+        """
+
+        return self.__commands.get(command)
+
+    def get_commands(self) -> Dict[str, "PluginCommand"]:
+        """
+        Get a copy of all currently active commands
+        :return: Dict of command-string and the corresponding PluginCommand
+        """
+
+        return dict(self.__commands)
+
+    def __contains__(self, command: str) -> bool:
+        return command in self.__commands
+
+    def __len__(self) -> int:
+        return len(self.__commands)
+
+
+class FuzzyCommandIndex:
+    def __init__(self, command_registry: CommandRegistry, threshold: int = 60, cache_size: int = 256):
+        """
+        Finds the best matching command for a misspelled command, e.g. "qoute" for "quote".
+        Only commands whose length allows a ratio above the threshold are scored at all, the remaining commands are scored in a single batch.
+        Results are memoized per misspelling until the commands in the registry change, so repeated typos are resolved by a single lookup.
+        :param command_registry: the registry to match commands from
+        :param threshold: a command matches if its (rounded) fuzz.ratio is above the threshold
+        :param cache_size: number of misspellings to remember
+        """
+
+        self.command_registry: CommandRegistry = command_registry
+        self.threshold: int = threshold
+        self.cache_size: int = cache_size
+        self.__version: int = -1
+        # command length -> commands of that length, in registration order
+        self.__commands_by_length: Dict[int, List[str]] = {}
+        # command -> position in registration order, used to prefer earlier commands on equal ratios
+        self.__order: Dict[str, int] = {}
+        self.__cache: OrderedDict[str, str or None] = OrderedDict()
+
+    def __rebuild(self):
+        """
+        Rebuild the index from the command registry
+        :return:
+        """
+
+        self.__commands_by_length = {}
+        self.__order = {}
+        self.__cache.clear()
+
+        command: str
+        for command in self.command_registry.get_commands().keys():
+            self.__order[command] = len(self.__order)
+            self.__commands_by_length.setdefault(len(command), []).append(command)
+        self.__version = self.command_registry.version
+
+    def match(self, word: str) -> str or None:
+        """
+        Find the best matching command
+        :param word: the (misspelled) command
+        :return:    the matching command with the highest ratio, the first registered one if several commands share the highest ratio
+                    None, if no command matches
+        """
+
+        if self.__version != self.command_registry.version:
+            self.__rebuild()
+
+        if word in self.__cache:
+            self.__cache.move_to_end(word)
+            return self.__cache[word]
+
+        # the ratio can't exceed 200 * min(len_a, len_b) / (len_a + len_b), skip commands too short or too long to match
+        candidates: List[str] = []
+        length: int
+        for length, commands in self.__commands_by_length.items():
+            if round(200 * min(length, len(word)) / (length + len(word))) > self.threshold:
+                candidates += commands
+        candidates.sort(key=self.__order.__getitem__)
+
+        best_command: str or None = None
+        best_ratio: int = self.threshold
+        command: str
+        ratio: float
+        for command, ratio, index in process.extract(word, candidates, scorer=fuzz.ratio, processor=None, limit=None, score_cutoff=self.threshold + 0.5):
+            if round(ratio) > best_ratio or (round(ratio) == best_ratio and best_command and self.__order[command] < self.__order[best_command]):
+                best_command = command
+                best_ratio = round(ratio)
+
+        self.__cache[word] = best_command
+        if len(self.__cache) > self.cache_size:
+            self.__cache.popitem(last=False)
+        return best_command
+
+
+class HookRegistry:
+    def __init__(self):
+        """
+        Index of all hooks registered by all plugins, keyed by event_type.
+        Plugins push the current hooks of an event_type whenever they change, the index keeps an immutable snapshot per event_type that can be
+        iterated during dispatch without copying, even if plugins add or remove hooks while the event is being processed.
+        Hooks are additionally indexed by room_id (hooks without a room_id_list go to a global bucket) and by the event_ids they are limited
+        to, so an event only touches the hooks relevant to its room and, for reactions, the event it relates to.
+        """
+
+        # plugin_name -> event_type -> hooks of the plugin, plugins in registration order
+        self.__plugin_hooks: Dict[str, Dict[str, Tuple["PluginHook", ...]]] = {}
+        # event_type -> hooks of all plugins
+        self.__hooks: Dict[str, Tuple["PluginHook", ...]] = {}
+        # event_type -> room_id -> hooks active on the room
+        self.__room_hooks: Dict[str, Dict[str, Set["PluginHook"]]] = {}
+        # event_type -> hooks active on all rooms
+        self.__global_hooks: Dict[str, Set["PluginHook"]] = {}
+        # hook -> room_ids the hook is currently indexed for, empty for global hooks
+        self.__indexed_rooms: Dict["PluginHook", FrozenSet[str]] = {}
+        # event_type -> event_id -> hooks limited to events relating to the event_id
+        self.__event_id_hooks: Dict[str, Dict[str, Set["PluginHook"]]] = {}
+        # hook -> event_ids the hook is currently indexed for, empty for hooks valid for all events
+        self.__indexed_event_ids: Dict["PluginHook", FrozenSet[str]] = {}
+        # hook -> name of the plugin that registered the hook
+        self.__hook_plugins: Dict["PluginHook", str] = {}
+        # hook -> registration order, used to run hooks in the same order they were registered
+        self.__order: Dict["PluginHook", int] = {}
+        self.__next_order: int = 0
+        self.version: int = 0
+        """incremented on every change, allows derived indexes to detect they're stale"""
+
+    def update(self, plugin_name: str, event_type: str, plugin_hooks: List["PluginHook"]):
+        """
+        Replace the hooks a plugin has registered for an event_type
+        :param plugin_name: name of the plugin providing the hooks
+        :param event_type: the event_type the hooks are registered for
+        :param plugin_hooks: all current hooks of the plugin for the event_type, empty to remove them
+        :return:
+        """
+
+        event_hooks: Dict[str, Tuple["PluginHook", ...]] = self.__plugin_hooks.setdefault(plugin_name, {})
+        previous_hooks: Tuple["PluginHook", ...] = event_hooks.get(event_type, ())
+        if plugin_hooks:
+            event_hooks[event_type] = tuple(plugin_hooks)
+        else:
+            event_hooks.pop(event_type, None)
+
+        hook: "PluginHook"
+        for hook in previous_hooks:
+            if hook not in plugin_hooks:
+                self.__unindex_hook(event_type, hook)
+                self.__hook_plugins.pop(hook, None)
+        for hook in plugin_hooks:
+            self.__index_hook(event_type, hook)
+            self.__hook_plugins[hook] = plugin_name
+
+        all_hooks: Tuple["PluginHook", ...] = ()
+        for hooks in self.__plugin_hooks.values():
+            all_hooks += hooks.get(event_type, ())
+
+        if all_hooks:
+            self.__hooks[event_type] = all_hooks
+        else:
+            self.__hooks.pop(event_type, None)
+        self.version += 1
+
+    def __index_hook(self, event_type: str, hook: "PluginHook"):
+        """
+        Add a hook to the room and event_id indexes or adjust the rooms and event_ids it is indexed for
+        :param event_type:
+        :param hook:
+        :return:
+        """
+
+        if hook not in self.__order:
+            self.__order[hook] = self.__next_order
+            self.__next_order += 1
+
+        self.__reindex(
+            self.__room_hooks.setdefault(event_type, {}), self.__indexed_rooms, hook, hook.room_id_list, self.__global_hooks.setdefault(event_type, set())
+        )
+        self.__reindex(self.__event_id_hooks.setdefault(event_type, {}), self.__indexed_event_ids, hook, hook.event_ids)
+
+    def __unindex_hook(self, event_type: str, hook: "PluginHook"):
+        """
+        Remove a hook from the room and event_id indexes, pruning rooms and event_ids no other hook is registered for
+        :param event_type:
+        :param hook:
+        :return:
+        """
+
+        self.__order.pop(hook, None)
+        self.__unindex(self.__room_hooks.get(event_type, {}), self.__indexed_rooms, hook, self.__global_hooks.get(event_type, set()))
+        self.__unindex(self.__event_id_hooks.get(event_type, {}), self.__indexed_event_ids, hook)
+
+    def __reindex(
+        self,
+        index: Dict[str, Set["PluginHook"]],
+        indexed_keys: Dict["PluginHook", FrozenSet[str]],
+        hook: "PluginHook",
+        keys: List[str] or None,
+        unfiltered: Set["PluginHook"] or None = None,
+    ):
+        """
+        Bring the entries of a hook in one of the indexes up to date, only touching keys that have actually changed
+        :param index: key -> hooks, e.g. room_id -> hooks
+        :param indexed_keys: hook -> keys the hook is currently indexed for
+        :param hook: the hook to index
+        :param keys: the keys the hook should be indexed for
+        :param unfiltered: optional bucket for hooks without any keys
+        :return:
+        """
+
+        new_keys: FrozenSet[str] = frozenset(keys or ())
+        old_keys: FrozenSet[str] or None = indexed_keys.get(hook)
+        if new_keys == old_keys:
+            return
+
+        if old_keys:
+            self.__remove_from_index(index, hook, old_keys - new_keys)
+        elif old_keys is not None and unfiltered is not None:
+            unfiltered.discard(hook)
+
+        indexed_keys[hook] = new_keys
+        if new_keys:
+            key: str
+            for key in new_keys - (old_keys or frozenset()):
+                index.setdefault(key, set()).add(hook)
+        elif unfiltered is not None:
+            unfiltered.add(hook)
+
+    def __unindex(
+        self,
+        index: Dict[str, Set["PluginHook"]],
+        indexed_keys: Dict["PluginHook", FrozenSet[str]],
+        hook: "PluginHook",
+        unfiltered: Set["PluginHook"] or None = None,
+    ):
+        old_keys: FrozenSet[str] or None = indexed_keys.pop(hook, None)
+        if old_keys:
+            self.__remove_from_index(index, hook, old_keys)
+        elif old_keys is not None and unfiltered is not None:
+            unfiltered.discard(hook)
+
+    @staticmethod
+    def __remove_from_index(index: Dict[str, Set["PluginHook"]], hook: "PluginHook", keys: Iterable[str]):
+        key: str
+        for key in keys:
+            hooks: Set["PluginHook"] or None = index.get(key)
+            if hooks is not None:
+                hooks.discard(hook)
+                if not hooks:
+                    del index[key]
+
+    def get(self, event_type: str) -> Tuple["PluginHook", ...]:
+        """
+        Get all hooks for an event_type
+        :param event_type: the event_type to look for
+        :return: immutable snapshot of the hooks, empty if there are none
+        """
+
+        return self.__hooks.get(event_type, ())
+
+    def get_for_room(self, event_type: str, room_id: str, related_event_id: str or None = None) -> Tuple["PluginHook", ...]:
+        """
+        Get the hooks for an event_type that are active on the given room, in registration order.
+        Hooks limited to specific event_ids are only included if the event relates to one of them.
+        :param event_type: the event_type to look for
+        :param room_id: the room the event has been received in
+        :param related_event_id: optional event_id the event relates to, e.g. the event a reaction has been sent for
+        :return: immutable snapshot of the hooks, empty if there are none
+        """
+
+        global_hooks: Set["PluginHook"] = self.__global_hooks.get(event_type, set())
+        room_hooks: Set["PluginHook"] = self.__room_hooks.get(event_type, {}).get(room_id, set())
+        if not room_hooks:
+            hooks: Set["PluginHook"] = global_hooks
+        elif not global_hooks:
+            hooks = room_hooks
+        else:
+            hooks = global_hooks | room_hooks
+
+        event_id_hooks: Set["PluginHook"] = set()
+        if related_event_id:
+            event_id_hooks = self.__event_id_hooks.get(event_type, {}).get(related_event_id, set())
+
+        hook: "PluginHook"
+        return tuple(
+            sorted(
+                (hook for hook in hooks if not self.__indexed_event_ids[hook] or hook in event_id_hooks),
+                key=self.__order.__getitem__,
+            )
+        )
+
+    def get_plugin_name(self, hook: "PluginHook") -> str or None:
+        """
+        Get the name of the plugin a hook has been registered by
+        :param hook:
+        :return:    name of the plugin
+                    None, if the hook is not registered
+        """
+
+        return self.__hook_plugins.get(hook)
+
+    def get_hooks(self) -> Dict[str, Tuple["PluginHook", ...]]:
+        """
+        Get all currently registered hooks
+        :return: Dict of event_type and the snapshot of PluginHooks for the event_type
+        """
+
+        return dict(self.__hooks)
@@ -0,0 +1,338 @@
+import base64
+import codecs
+import copyreg
+import datetime
+import inspect
+import json
+import pickle
+import sys
+from collections import OrderedDict
+from typing import Any, BinaryIO, Callable, Dict, List, Set
+
+# classes whose objects may be stored and restored, by "<module>.<qualname>"
+_data_classes: Dict[str, type] = {}
+
+# functions referenced by commands, hooks and timers, by "<module>.<qualname>"
+_functions: Dict[str, Callable] = {}
+
+FUNCTION_MODULE_PREFIX: str = "plugins."
+"""functions of modules with this prefix can be restored without being registered, as long as the module has been imported already"""
+
+# standard library types restored from their constructor arguments
+_value_types: Dict[str, type] = {
+    f"datetime.{cls.__name__}": cls for cls in [datetime.datetime, datetime.date, datetime.time, datetime.timedelta, datetime.timezone]
+}
+
+# tags used by jsonpickle, dicts without any of them are restored as they are
+_tags: Set[str] = {
+    "py/b64", "py/b85", "py/bytes", "py/function", "py/id", "py/initargs", "py/iterator", "py/module", "py/newargs", "py/newargsex",
+    "py/newobj", "py/object", "py/property", "py/reduce", "py/ref", "py/repr", "py/seq", "py/set", "py/state", "py/tuple", "py/type",
+}
+_object_tags: Set[str] = _tags - {"py/object"}
+
+# JSON types restored as they are
+_scalar_types: Set[type] = {str, int, float, bool, type(None)}
+
+# additional globals needed to restore registered classes from pickle-files, protocols before 3 use the names of Python 2
+_pickle_globals: Dict[str, Any] = {
+    "copyreg._reconstructor": copyreg._reconstructor,
+    "copy_reg._reconstructor": copyreg._reconstructor,
+    "builtins.object": object,
+    "__builtin__.object": object,
+    "builtins.set": set,
+    "__builtin__.set": set,
+    "builtins.frozenset": frozenset,
+    "__builtin__.frozenset": frozenset,
+    "collections.OrderedDict": OrderedDict,
+    "_codecs.encode": codecs.encode,
+}
+
+
+def _qualified_name(obj: Any) -> str:
+    return f"{obj.__module__}.{obj.__qualname__}"
+
+
+def register_data_class(cls: type) -> type:
+    """
+    Register a class whose objects may be stored and restored, can be used as a class decorator.
+    Objects are stored by their attributes and restored by setting their __dict__, without calling __init__.
+    :param cls: the class to register
+    :return: the class
+    """
+
+    _data_classes[_qualified_name(cls)] = cls
+    return cls
+
+
+def get_data_class(class_name: str) -> type:
+    """
+    Get a registered class by its name
+    :param class_name: "<module>.<qualname>" of the class
+    :return: the class
+    """
+
+    try:
+        return _data_classes[class_name]
+    except KeyError:
+        raise TypeError(f"{class_name} has not been registered as data class")
+
+
+def is_data_class(cls: type) -> bool:
+    """
+    Check whether a class has been registered
+    :param cls: the class to check
+    :return:    True, if the class has been registered
+                False, otherwise
+    """
+
+    return _data_classes.get(_qualified_name(cls)) is cls
+
+
+def register_function(function: Callable) -> Callable:
+    """
+    Register a function that may be referenced by stored commands, hooks and timers
+    :param function: the function to register
+    :return: the function
+    """
+
+    _functions[function_name(function)] = function
+    return function
+
+
+def function_name(function: Callable) -> str:
+    """
+    Get the name a function is stored by
+    :param function: the function
+    :return: "<module>.<qualname>" of the function
+    """
+
+    if not inspect.isfunction(function) or "<" in function.__qualname__:
+        raise TypeError(f"{function!r} can't be stored, only functions defined at the top level of a module or class can be")
+    return _qualified_name(function)
+
+
+def resolve_function(name: str) -> Callable:
+    """
+    Get a function by the name it has been stored by. Only registered functions and functions of plugin modules that have already
+    been imported are returned, no module is imported.
+    :param name: "<module>.<qualname>" of the function
+    :return: the function
+    """
+
+    if name in _functions:
+        return _functions[name]
+
+    parts: List[str] = name.split(".")
+    for index in range(len(parts) - 1, 0, -1):
+        module_name: str = ".".join(parts[:index])
+        if module_name not in sys.modules:
+            continue
+        if not module_name.startswith(FUNCTION_MODULE_PREFIX):
+            break
+        function: Any = sys.modules[module_name]
+        for part in parts[index:]:
+            function = getattr(function, part, None)
+        if inspect.isfunction(function):
+            _functions[name] = function
+            return function
+        break
+    raise TypeError(f"{name} is neither a registered function nor a function of a loaded plugin")
+
+
+def encode_json(data: Any) -> str:
+    """
+    Encode data to JSON, using the tags of jsonpickle, so files can still be read by previous versions.
+    Supports builtin types, dates and times, registered classes and functions.
+    :param data: the data to encode
+    :return: the encoded data
+    """
+
+    return json.dumps(_flatten(data))
+
+
+def _flatten(obj: Any) -> Any:
+    """
+    Convert data to a structure of JSON types
+    :param obj: the data to convert
+    :return: the converted data
+    """
+
+    obj_type: type = type(obj)
+    if obj is None or obj_type in (str, int, float, bool):
+        return obj
+    elif isinstance(obj, dict):
+        return {key: _flatten(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [_flatten(value) for value in obj]
+    elif isinstance(obj, tuple):
+        return {"py/tuple": [_flatten(value) for value in obj]}
+    elif isinstance(obj, (set, frozenset)):
+        return {"py/set": [_flatten(value) for value in obj]}
+    elif isinstance(obj, bytes):
+        return {"py/b64": base64.b64encode(obj).decode()}
+    elif inspect.isfunction(obj):
+        return {"py/function": function_name(obj)}
+
+    class_name: str = _qualified_name(obj_type)
+    if class_name in _value_types:
+        args: tuple = obj.__reduce__()[1]
+        if isinstance(obj, (datetime.date, datetime.time)):
+            # dates and times are reduced to their pickled bytes and an optional timezone
+            return {
+                "py/object": class_name,
+                "__reduce__": [{"py/type": class_name}, [base64.b64encode(args[0]).decode()] + [_flatten(arg) for arg in args[1:]]],
+            }
+        else:
+            return {"py/reduce": [{"py/type": class_name}, {"py/tuple": [_flatten(arg) for arg in args]}]}
+    elif class_name in _data_classes:
+        flattened: Dict[str, Any] = {"py/object": class_name}
+        for key, value in obj.__dict__.items():
+            flattened[key] = _flatten(value)
+        return flattened
+    else:
+        raise TypeError(f"Objects of {class_name} can't be stored, the class needs to be registered as data class")
+
+
+def decode_json(encoded: str or bytes) -> Any:
+    """
+    Decode data encoded by encode_json() or by jsonpickle. Unlike jsonpickle, only registered classes are instantiated and only functions
+    returned by resolve_function() are referenced, so decoding untrusted data can't execute code.
+    :param encoded: the encoded data
+    :return: the decoded data
+    """
+
+    return _JsonDecoder().decode(json.loads(encoded))
+
+
+class _JsonDecoder:
+    def __init__(self):
+        # objects in the order jsonpickle assigns their ids for "py/id" references
+        self.__references: List[Any] = []
+
+    def decode(self, obj: Any) -> Any:
+        """
+        Restore an object from its JSON structure
+        :param obj: the JSON structure
+        :return: the restored object
+        """
+
+        obj_type: type = type(obj)
+        if obj_type is list:
+            restored_list: List[Any] = []
+            self.__references.append(restored_list)
+            restored_list.extend([value if type(value) in _scalar_types else self.decode(value) for value in obj])
+            return restored_list
+        elif obj_type is not dict:
+            return obj
+        elif _tags.isdisjoint(obj):
+            restored_dict: Dict[Any, Any] = {}
+            self.__references.append(restored_dict)
+            for key, value in obj.items():
+                restored_dict[key] = value if type(value) in _scalar_types else self.decode(value)
+            return restored_dict
+
+        # tags are checked in the same order as jsonpickle does
+        if "py/tuple" in obj:
+            return tuple([self.decode(value) for value in obj["py/tuple"]])
+        elif "py/set" in obj:
+            return {self.decode(value) for value in obj["py/set"]}
+        elif "py/b64" in obj:
+            return base64.b64decode(obj["py/b64"])
+        elif "py/b85" in obj:
+            return base64.b85decode(obj["py/b85"])
+        elif "py/id" in obj:
+            return self.__restore_reference(obj["py/id"])
+        elif "py/object" in obj:
+            return self.__restore_object(obj)
+        elif "py/type" in obj:
+            return self.__restore_type(obj["py/type"])
+        elif "py/reduce" in obj:
+            return self.__restore_reduce(obj["py/reduce"])
+        elif "py/function" in obj:
+            return resolve_function(obj["py/function"])
+        else:
+            raise TypeError(f"Unsupported tags {', '.join(_tags.intersection(obj))}")
+
+    def __restore_reference(self, index: int) -> Any:
+        if not isinstance(index, int) or not 0 <= index < len(self.__references):
+            raise ValueError(f"Invalid reference {index}")
+        return self.__references[index]
+
+    @staticmethod
+    def __restore_type(class_name: str) -> type:
+        try:
+            return _value_types[class_name]
+        except KeyError:
+            raise TypeError(f"Unsupported type {class_name}")
+
+    def __restore_object(self, obj: Dict[str, Any]) -> Any:
+        """
+        Restore a registered object from its attributes or a date or time from its pickled bytes
+        :param obj: the JSON structure
+        :return: the restored object
+        """
+
+        class_name: str = obj["py/object"]
+        index: int = len(self.__references)
+        self.__references.append(None)
+
+        if class_name in _value_types:
+            cls: type = self.decode(obj["__reduce__"][0])
+            if cls is not _value_types[class_name] or not issubclass(cls, (datetime.date, datetime.time)):
+                raise TypeError(f"Unsupported reduction of {class_name}")
+            args: List[Any] = obj["__reduce__"][1]
+            restored: Any = cls(base64.b64decode(args[0]), *[self.decode(arg) for arg in args[1:]])
+            self.__references[index] = restored
+            return restored
+
+        if not _object_tags.isdisjoint(obj):
+            raise TypeError(f"Unsupported tags {', '.join(_object_tags.intersection(obj))} for {class_name}")
+        cls: type = get_data_class(class_name)
+        instance: Any = cls.__new__(cls)
+        self.__references[index] = instance
+        attributes: Dict[str, Any] = instance.__dict__
+        for key, value in obj.items():
+            attributes[key] = value if type(value) in _scalar_types else self.decode(value)
+        del attributes["py/object"]
+        return instance
+
+    def __restore_reduce(self, reduce_value: List[Any]) -> Any:
+        """
+        Restore a standard library value from its type and constructor arguments
+        :param reduce_value: the type, the arguments and optional state
+        :return: the restored value
+        """
+
+        index: int = len(self.__references)
+        self.__references.append(None)
+
+        if any(value is not None for value in reduce_value[2:]):
+            raise TypeError("Unsupported reduction with state")
+        cls: Any = self.decode(reduce_value[0])
+        args: Any = self.decode(reduce_value[1])
+        if cls not in _value_types.values() or not isinstance(args, tuple):
+            raise TypeError("Unsupported reduction")
+        restored: Any = cls(*args)
+        self.__references[index] = restored
+        return restored
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str) -> Any:
+        class_name: str = f"{module}.{name}"
+        if class_name in _value_types:
+            return _value_types[class_name]
+        elif class_name in _pickle_globals:
+            return _pickle_globals[class_name]
+        else:
+            return get_data_class(class_name)
+
+
+def load_pickle(file: BinaryIO) -> Any:
+    """
+    Load data from a pickle-file, only restoring registered classes and standard library values, so loading untrusted files can't execute code
+    :param file: the file opened in binary mode
+    :return: the loaded data
+    """
+
+    return _RestrictedUnpickler(file).load()
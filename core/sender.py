@@ -0,0 +1,434 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import uuid
+from time import monotonic
+from typing import Dict, List, Tuple, Iterator
+
+from nio import AsyncClient, RoomSendResponse, RoomSendError
+
+logger = logging.getLogger(__name__)
+
+# priorities of outbound events, lower values are sent first
+PRIORITY_MESSAGE: int = 0
+"""messages and notices, e.g. responses to commands"""
+PRIORITY_REACTION: int = 1
+"""reactions to events"""
+PRIORITY_BULK: int = 2
+"""bulk posts, e.g. messages of timers to many rooms"""
+
+_sender: "MessageSender" or None = None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """
+        Token bucket limiting the rate of an action: every action takes a token, tokens are refilled at a constant rate up to the capacity,
+        allowing bursts of up to capacity actions
+        :param rate: number of tokens refilled per second, 0 or less for no limit
+        :param capacity: maximum number of tokens in the bucket
+        """
+
+        self.rate: float = rate
+        self.capacity: float = max(1.0, capacity)
+        self.__tokens: float = self.capacity
+        self.__updated: float = monotonic()
+        # no tokens are handed out before this point in time, e.g. after the server asked us to slow down, even without a rate
+        self.__paused_until: float = 0.0
+
+    def __refill(self, now: float):
+        if now > self.__updated:
+            self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+
+    def delay(self) -> float:
+        """
+        Get the time until a token is available
+        :return: seconds to wait, 0 if a token is available now
+        """
+
+        now: float = monotonic()
+        if now < self.__paused_until:
+            return self.__paused_until - now
+        if self.rate <= 0:
+            return 0.0
+
+        self.__refill(now)
+        if self.__tokens >= 1:
+            return 0.0
+        return max(0.0, self.__updated - now) + (1 - self.__tokens) / self.rate
+
+    def take(self):
+        """
+        Take a token, callers need to check delay() first
+        :return:
+        """
+
+        if self.rate > 0:
+            self.__tokens -= 1
+
+    def pause(self, seconds: float):
+        """
+        Don't hand out tokens for the given time and empty the bucket, e.g. after the server asked us to slow down. The pause applies even if the
+        bucket has no rate.
+        :param seconds: time to wait before handing out tokens again
+        :return:
+        """
+
+        self.__paused_until = max(self.__paused_until, monotonic() + seconds)
+        self.__tokens = min(self.__tokens, 0.0)
+        self.__updated = max(self.__updated, self.__paused_until)
+
+    def is_full(self) -> bool:
+        """
+        Check whether the bucket has been refilled completely, i.e. the limit currently has no effect
+        :return:    True, if the bucket is full
+                    False, otherwise
+        """
+
+        now: float = monotonic()
+        self.__refill(now)
+        return now >= self.__paused_until and self.__tokens >= self.capacity
+
+
+class SendJob:
+    __slots__ = ["room_id", "message_type", "content", "tx_id", "ignore_unverified_devices", "future", "retries"]
+
+    def __init__(self, room_id: str, message_type: str, content: dict, tx_id: str, ignore_unverified_devices: bool, future: asyncio.Future):
+        """
+        An event waiting to be sent
+        """
+
+        self.room_id: str = room_id
+        self.message_type: str = message_type
+        self.content: dict = content
+        self.tx_id: str = tx_id
+        self.ignore_unverified_devices: bool = ignore_unverified_devices
+        self.future: asyncio.Future = future
+        self.retries: int = 0
+
+
+class MessageSender:
+    def __init__(
+        self,
+        client: AsyncClient,
+        concurrency: int = 8,
+        rate: float = 0,
+        burst: int = 10,
+        room_rate: float = 0,
+        room_burst: int = 5,
+        max_retries: int = 3,
+    ):
+        """
+        Outbound pipeline for the events sent by the bot. Events are queued by priority and sent by a sender task, events of different rooms
+        concurrently, events of the same room one after another in order. If the homeserver rate-limits us, sending is paused for the time
+        requested by the server and the event is sent again, without blocking the caller.
+        Optionally, events are paced by a global and a per-room token bucket to stay below the homeserver's rate-limit proactively. Events of a
+        room that has reached its limit are held back without delaying the events of other rooms.
+        :param client: the client to send events with
+        :param concurrency: maximum number of events sent at the same time
+        :param rate: average number of events sent per second to all rooms, 0 for no limit
+        :param burst: number of events that may be sent at once before pacing starts
+        :param room_rate: average number of events sent per second to the same room, 0 for no limit
+        :param room_burst: number of events that may be sent at once to the same room before pacing starts
+        :param max_retries: number of times an event is sent again after it has been rejected by the server
+        """
+
+        self.client: AsyncClient = client
+        self.concurrency: int = max(1, concurrency)
+        self.room_rate: float = room_rate
+        self.room_burst: int = room_burst
+        self.max_retries: int = max_retries
+        self.__bucket: TokenBucket = TokenBucket(rate, burst)
+        self.__room_buckets: Dict[str, TokenBucket] = {}
+        self.__queue: List[Tuple[int, int, SendJob]] = []
+        self.__sequence: Iterator[int] = itertools.count()
+        # jobs of rooms waiting for their bucket to refill, for a retry or for the room's previous event to be sent, by room_id
+        self.__held: Dict[str, List[Tuple[int, int, SendJob]]] = {}
+        # rooms held back until a point in time, by room_id
+        self.__timers: Dict[str, asyncio.TimerHandle] = {}
+        # rooms an event is currently being sent to, and the tasks sending them
+        self.__sending: Dict[str, asyncio.Task] = {}
+        self.__slots: asyncio.Semaphore or None = None
+        self.__pending: int = 0
+        self.__wakeup: asyncio.Event or None = None
+        self.__idle: asyncio.Event or None = None
+        self.__task: asyncio.Task or None = None
+
+    def start(self):
+        """
+        Start the sender task, needs to be called from within the running event loop
+        :return:
+        """
+
+        if self.__task is None:
+            self.__wakeup = asyncio.Event()
+            self.__idle = asyncio.Event()
+            self.__slots = asyncio.Semaphore(self.concurrency)
+            if self.__pending == 0:
+                self.__idle.set()
+            self.__task = asyncio.create_task(self.__send_loop(), name="sender")
+            logger.debug(
+                f"Started sender sending up to {self.concurrency} events at once, limited to {self.__bucket.rate or 'unlimited'} events/s "
+                f"({self.room_rate or 'unlimited'} events/s per room)"
+            )
+
+    async def stop(self, timeout: float = 5):
+        """
+        Wait for pending events to be sent and stop the sender task. Events that could not be sent within the timeout are discarded.
+        :param timeout: maximum number of seconds to wait for pending events
+        :return:
+        """
+
+        if self.__task is None:
+            return
+
+        try:
+            await asyncio.wait_for(self.__idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Discarding {self.__pending} events that could not be sent within {timeout}s")
+
+        tasks: List[asyncio.Task] = [self.__task] + list(self.__sending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.__task = None
+
+        for timer in self.__timers.values():
+            timer.cancel()
+        for (_, _, job) in self.__queue + [entry for entries in self.__held.values() for entry in entries]:
+            job.future.cancel()
+        self.__queue.clear()
+        self.__held.clear()
+        self.__timers.clear()
+        self.__sending.clear()
+        self.__pending = 0
+
+    def submit(
+        self,
+        room_id: str,
+        message_type: str,
+        content: dict,
+        tx_id: str or None = None,
+        ignore_unverified_devices: bool = False,
+        priority: int = PRIORITY_MESSAGE,
+    ) -> asyncio.Future:
+        """
+        Queue an event to be sent
+        :param room_id: the room to send the event to
+        :param message_type: the type of the event
+        :param content: the content of the event
+        :param tx_id: the transaction ID of the event, a new one is generated if not given. It's reused when the event is sent again,
+                      so the server doesn't post the event twice.
+        :param ignore_unverified_devices: mark unverified devices in encrypted rooms as ignored
+        :param priority: one of PRIORITY_MESSAGE, PRIORITY_REACTION, PRIORITY_BULK, events of lower values are sent first
+        :return: a future resolving to the RoomSendResponse or RoomSendError, if the event has been sent or could not be sent
+        """
+
+        self.start()
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        job: SendJob = SendJob(room_id, message_type, content, tx_id or str(uuid.uuid4()), ignore_unverified_devices, future)
+        self.__pending += 1
+        self.__idle.clear()
+        future.add_done_callback(self.__job_done)
+        self.__push((priority, next(self.__sequence), job))
+        return future
+
+    def get_queue_depth(self) -> int:
+        """
+        Get the number of events waiting to be sent, including events held back by a room's limit or waiting for a retry
+        :return: number of pending events
+        """
+
+        return self.__pending
+
+    def __job_done(self, future: asyncio.Future):
+        self.__pending -= 1
+        if self.__pending <= 0:
+            self.__pending = 0
+            self.__idle.set()
+
+    def __push(self, entry: Tuple[int, int, SendJob]):
+        room_id: str = entry[2].room_id
+        if room_id in self.__held:
+            # keep the order of a room's events while it's held back
+            self.__held[room_id].append(entry)
+        else:
+            heapq.heappush(self.__queue, entry)
+            self.__wakeup.set()
+
+    def __hold(self, entry: Tuple[int, int, SendJob], seconds: float or None = None):
+        """
+        Hold back the events of a room, without delaying the events of other rooms
+        :param entry: the queue entry of the event to hold back
+        :param seconds: time to hold back the room's events, None to hold them back until the event currently sent to the room has been sent
+        :return:
+        """
+
+        room_id: str = entry[2].room_id
+        self.__held.setdefault(room_id, []).append(entry)
+        if seconds is not None and room_id not in self.__timers:
+            self.__timers[room_id] = asyncio.get_running_loop().call_later(seconds, self.__release, room_id)
+
+    def __release(self, room_id: str):
+        self.__timers.pop(room_id, None)
+        for entry in self.__held.pop(room_id, []):
+            heapq.heappush(self.__queue, entry)
+        self.__wakeup.set()
+
+    def __room_bucket(self, room_id: str) -> TokenBucket:
+        bucket: TokenBucket or None = self.__room_buckets.get(room_id)
+        if bucket is None:
+            if len(self.__room_buckets) >= 1000:
+                # forget rooms whose limit has no effect anymore
+                self.__room_buckets = {key: value for key, value in self.__room_buckets.items() if not value.is_full()}
+            bucket = TokenBucket(self.room_rate, self.room_burst)
+            self.__room_buckets[room_id] = bucket
+        return bucket
+
+    async def __send_loop(self):
+        while True:
+            while not self.__queue:
+                self.__wakeup.clear()
+                await self.__wakeup.wait()
+
+            # wait for one of the events currently being sent, if the maximum number of events is sent already
+            await self.__slots.acquire()
+            if not self.__queue:
+                self.__slots.release()
+                continue
+
+            # check the limit after getting a slot, sending may have been paused while waiting for it
+            delay: float = self.__bucket.delay()
+            if delay > 0:
+                self.__slots.release()
+                # check the queue again afterwards, events of higher priority may have been queued in the meantime
+                await asyncio.sleep(delay)
+                continue
+
+            entry: Tuple[int, int, SendJob] = heapq.heappop(self.__queue)
+            job: SendJob = entry[2]
+            if job.future.done():
+                # the caller has cancelled the event
+                self.__slots.release()
+                continue
+
+            if job.room_id in self.__sending:
+                # keep the order of the room's events, send the event after the current one has been sent
+                self.__slots.release()
+                self.__hold(entry)
+                continue
+
+            room_bucket: TokenBucket = self.__room_bucket(job.room_id)
+            room_delay: float = room_bucket.delay()
+            if room_delay > 0:
+                self.__slots.release()
+                self.__hold(entry, room_delay)
+                continue
+
+            self.__bucket.take()
+            room_bucket.take()
+            self.__sending[job.room_id] = asyncio.create_task(self.__send(entry), name=f"sender-{job.room_id}")
+
+    async def __send(self, entry: Tuple[int, int, SendJob]):
+        """
+        Send an event in the background and resolve its future, or queue it again if it has been rejected by the server
+        :param entry: the queue entry of the event to send
+        :return:
+        """
+
+        room_id: str = entry[2].room_id
+        try:
+            await self.__send_event(entry)
+        finally:
+            del self.__sending[room_id]
+            self.__slots.release()
+            if room_id not in self.__timers:
+                self.__release(room_id)
+
+    async def __send_event(self, entry: Tuple[int, int, SendJob]):
+        job: SendJob = entry[2]
+        try:
+            response: RoomSendResponse or RoomSendError = await self.client.room_send(
+                job.room_id, job.message_type, job.content, job.tx_id, job.ignore_unverified_devices
+            )
+        except Exception as err:
+            if not job.future.done():
+                job.future.set_exception(err)
+            return
+
+        if isinstance(response, RoomSendError) and job.retries < self.max_retries:
+            job.retries += 1
+            if response.status_code == "M_LIMIT_EXCEEDED":
+                # we're being rate-limited anyway, pause sending to all rooms for the given time
+                retry_after: float = (response.retry_after_ms or 1000) / 1000
+                logger.warning(
+                    f"Ratelimit hit with {job.message_type} to {job.room_id}! Server is asking us to wait {retry_after}s "
+                    f"(Retry: {job.retries}/{self.max_retries})."
+                )
+                self.__bucket.pause(retry_after)
+                self.__push(entry)
+            else:
+                # unknown error, try again after three seconds
+                logger.warning(f"Unknown error sending {job.message_type} to {job.room_id}. Retrying in 3 sec ({job.retries}/{self.max_retries}).")
+                self.__hold(entry, 3)
+            return
+
+        if isinstance(response, RoomSendError):
+            logger.warning(
+                f"Could not send {job.message_type} to {job.room_id} after {job.retries} retries. Giving up. Message {job.content.get('body')} is lost!"
+            )
+        if not job.future.done():
+            job.future.set_result(response)
+
+
+def setup_sender(
+    client: AsyncClient, concurrency: int = 8, rate: float = 0, burst: int = 10, room_rate: float = 0, room_burst: int = 5
+) -> MessageSender or None:
+    """
+    Set up the sender for all events sent by the client
+    :param client: the client to send events with
+    :param concurrency: maximum number of events sent at the same time, 0 to send events directly without a sender
+    :param rate: average number of events sent per second to all rooms, 0 for no limit
+    :param burst: number of events that may be sent at once before pacing starts
+    :param room_rate: average number of events sent per second to the same room, 0 for no limit
+    :param room_burst: number of events that may be sent at once to the same room before pacing starts
+    :return: the new sender, None if sending events directly
+    """
+
+    global _sender
+
+    if concurrency <= 0:
+        _sender = None
+        logger.debug("Sending events directly, without a sender")
+    else:
+        _sender = MessageSender(client, concurrency, rate, burst, room_rate, room_burst)
+    return _sender
+
+
+def get_sender(client: AsyncClient) -> MessageSender or None:
+    """
+    Get the sender of a client
+    :param client: the client sending the events
+    :return: the sender, None if no sender has been set up for the client
+    """
+
+    if _sender is not None and _sender.client is client:
+        return _sender
+    return None
+
+
+async def shutdown_sender(timeout: float = 5):
+    """
+    Send pending events and stop the sender
+    :param timeout: maximum number of seconds to wait for pending events
+    :return:
+    """
+
+    global _sender
+
+    if _sender is not None:
+        await _sender.stop(timeout)
+        _sender = None
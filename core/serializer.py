@@ -0,0 +1,138 @@
+import abc
+import datetime
+import logging
+from typing import Any, Dict
+
+import msgpack
+
+from core.schema import decode_json, encode_json, get_data_class, is_data_class, register_data_class
+
+logger = logging.getLogger(__name__)
+
+
+class Serializer(abc.ABC):
+    name: str = ""
+    """name of the format, stored with every encoded value"""
+
+    @abc.abstractmethod
+    def encode(self, data: Any) -> str or bytes:
+        """
+        Encode data to be stored
+        :param data: the data to encode
+        :return: the encoded data
+        """
+
+    @abc.abstractmethod
+    def decode(self, encoded: str or bytes) -> Any:
+        """
+        Decode data previously encoded by encode()
+        :param encoded: the encoded data
+        :return: the decoded data
+        """
+
+
+class JsonPickleSerializer(Serializer):
+    """
+    JSON compatible with jsonpickle, as used by previous versions, restricted to registered classes
+    """
+
+    name: str = "jsonpickle"
+
+    def encode(self, data: Any) -> str:
+        return encode_json(data)
+
+    def decode(self, encoded: str or bytes) -> Any:
+        return decode_json(encoded)
+
+
+class MsgpackSerializer(Serializer):
+    name: str = "msgpack"
+
+    EXT_OBJECT: int = 1
+    EXT_DATETIME: int = 2
+    EXT_DATE: int = 3
+    EXT_SET: int = 4
+    EXT_TUPLE: int = 5
+    EXT_TIMEDELTA: int = 7
+
+    def encode(self, data: Any) -> bytes:
+        return msgpack.packb(data, default=self.__default, strict_types=True)
+
+    def decode(self, encoded: str or bytes) -> Any:
+        return msgpack.unpackb(encoded, ext_hook=self.__ext_hook, strict_map_key=False)
+
+    def __default(self, obj: Any) -> Any:
+        """
+        Encode everything msgpack does not support natively
+        :param obj: the object to encode
+        :return: a msgpack-compatible representation of the object
+        """
+
+        if isinstance(obj, datetime.datetime):
+            return msgpack.ExtType(self.EXT_DATETIME, obj.isoformat().encode())
+        elif isinstance(obj, datetime.date):
+            return msgpack.ExtType(self.EXT_DATE, obj.isoformat().encode())
+        elif isinstance(obj, datetime.timedelta):
+            return msgpack.ExtType(self.EXT_TIMEDELTA, self.encode([obj.days, obj.seconds, obj.microseconds]))
+        elif isinstance(obj, (set, frozenset)):
+            return msgpack.ExtType(self.EXT_SET, self.encode(list(obj)))
+        elif isinstance(obj, tuple):
+            return msgpack.ExtType(self.EXT_TUPLE, self.encode(list(obj)))
+        elif isinstance(obj, dict):
+            # subclasses (e.g. OrderedDict, defaultdict) are passed here because of strict_types, they're stored and restored as dict
+            return dict(obj)
+        elif isinstance(obj, list):
+            return list(obj)
+
+        class_name: str = f"{type(obj).__module__}.{type(obj).__qualname__}"
+        if is_data_class(type(obj)):
+            return msgpack.ExtType(self.EXT_OBJECT, self.encode([class_name, obj.__dict__]))
+        for base in (bool, int, float, str, bytes):
+            if isinstance(obj, base):
+                raise TypeError(f"Objects of {class_name} can't be stored, convert them to {base.__name__} or register the class as data class")
+        raise TypeError(f"Objects of {class_name} can't be stored, the class needs to be registered as data class")
+
+    def __ext_hook(self, code: int, data: bytes) -> Any:
+        """
+        Decode everything encoded by __default()
+        :param code: the extension type
+        :param data: the encoded object
+        :return: the decoded object
+        """
+
+        if code == self.EXT_OBJECT:
+            class_name: str
+            attributes: Dict[str, Any]
+            (class_name, attributes) = self.decode(data)
+            cls: type = get_data_class(class_name)
+            obj: Any = cls.__new__(cls)
+            obj.__dict__.update(attributes)
+            return obj
+        elif code == self.EXT_DATETIME:
+            return datetime.datetime.fromisoformat(data.decode())
+        elif code == self.EXT_DATE:
+            return datetime.date.fromisoformat(data.decode())
+        elif code == self.EXT_SET:
+            return set(self.decode(data))
+        elif code == self.EXT_TUPLE:
+            return tuple(self.decode(data))
+        elif code == self.EXT_TIMEDELTA:
+            return datetime.timedelta(*self.decode(data))
+        else:
+            return msgpack.ExtType(code, data)
+
+
+serializers: Dict[str, Serializer] = {serializer.name: serializer for serializer in [JsonPickleSerializer(), MsgpackSerializer()]}
+
+
+def get_serializer(name: str) -> Serializer:
+    """
+    Get a serializer by the name of its format
+    :param name: name of the format
+    :return: the serializer
+    """
+
+    try:
+        return serializers[name]
+    except KeyError:
+        raise ValueError(f"Unknown data format {name}, valid formats are: {', '.join(serializers.keys())}")
@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import os
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+CHECKSUM_PREFIX: str = "sha256:"
+
+
+def _checksum(data: str) -> str:
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def read_state_file(filename: str) -> str or None:
+    """
+    Read a state file written by write_state_file, verifying its checksum.
+    Files written by previous versions don't have a checksum and are returned unverified.
+    :param filename: the file to read
+    :return:    the content of the file, if it could be read and is valid
+                None, otherwise
+    """
+
+    try:
+        with open(filename, "r", encoding="utf-8") as file:
+            content: str = file.read()
+    except OSError as err:
+        logger.debug(f"Could not read {filename}: {err}")
+        return None
+
+    if not content.startswith(CHECKSUM_PREFIX):
+        return content
+
+    header: str
+    data: str
+    (header, _, data) = content.partition("\n")
+    if header[len(CHECKSUM_PREFIX) :] != _checksum(data):
+        logger.warning(f"Checksum of {filename} does not match its content, the file is damaged")
+        return None
+    return data
+
+
+def write_state_file(filename: str, data: str) -> bool:
+    """
+    Atomically replace a state file, keeping the previous valid version as <filename>.bak.
+    The data is written to a temporary file first, synced to disk and then renamed, so the state file is never partially written.
+    :param filename: the file to write
+    :param data: the content to write
+    :return:    True, if the file has been written successfully
+                False, otherwise
+    """
+
+    temp_filename: str = f"{filename}.tmp"
+    try:
+        with open(temp_filename, "w", encoding="utf-8") as file:
+            file.write(f"{CHECKSUM_PREFIX}{_checksum(data)}\n{data}")
+            file.flush()
+            os.fsync(file.fileno())
+
+        # keep the last valid state as a snapshot to fall back to
+        if os.path.isfile(filename) and read_state_file(filename) is not None:
+            os.replace(filename, f"{filename}.bak")
+        os.replace(temp_filename, filename)
+        _sync_directory(filename)
+        return True
+    except OSError as err:
+        logger.critical(f"Could not write {filename}: {err}")
+        return False
+
+
+def remove_state_file(filename: str) -> bool:
+    """
+    Remove a state file and its snapshot
+    :param filename: the file to remove
+    :return:    True, if the files have been removed or did not exist
+                False, otherwise
+    """
+
+    try:
+        for existing_filename in [filename, f"{filename}.bak"]:
+            if os.path.isfile(existing_filename):
+                os.remove(existing_filename)
+        return True
+    except OSError as err:
+        logger.critical(f"Could not remove {filename}: {err}")
+        return False
+
+
+def state_file_candidates(filename: str) -> List[str]:
+    """
+    Files to try loading a state from, the state file first, its snapshot as fallback
+    :param filename: the state file
+    :return: list of filenames
+    """
+
+    return [filename, f"{filename}.bak"]
+
+
+def _sync_directory(filename: str):
+    """
+    Sync the directory containing the file to disk, making sure a rename survives a crash
+    :param filename:
+    :return:
+    """
+
+    directory: int = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
@@ -1,45 +1,321 @@
+import asyncio
+import functools
 import sqlite3
 import os.path
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
 
-latest_db_version = 0
+latest_db_version = 1
+
+DATABASE_FILENAME = "bot.db"
 
 logger = logging.getLogger(__name__)
 
+# all database access happens in a single thread, which keeps writes in order and off the event loop
+_io_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+
+# storages opened by get_storage(), by path of their database file
+_storages: Dict[str, "Storage"] = {}
+
+
+def get_storage(db_path: str) -> "Storage":
+    """Get the storage of a database file, shared by the bot and all plugins
+
+    Args:
+        db_path (str): The name of the database file
+
+    Returns:
+        Storage: the storage, set up on the first call for the file
+    """
+    key: str = os.path.abspath(db_path)
+    if key not in _storages:
+        _storages[key] = Storage(db_path)
+    return _storages[key]
+
+
+async def run_in_storage_thread(method: Callable, *args: Any) -> Any:
+    """Run blocking file IO (e.g. writing state files) in the storage thread, in order with all database operations
+
+    Args:
+        method (Callable): The blocking function
+
+        *args: Arguments of the function
+
+    Returns:
+        The result of the function
+    """
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, functools.partial(method, *args))
+
 
 class Storage(object):
     def __init__(self, db_path):
         """Setup the database
 
         Runs an initial setup or migrations depending on whether a database file has already
-        been created
+        been created. The connection is kept open and reused by all operations, which run
+        in a single thread outside of the event loop.
 
         Args:
             db_path (str): The name of the database file
         """
         self.db_path = db_path
+        self.conn: sqlite3.Connection or None = None
 
         # Check if a database has already been connected
         if os.path.isfile(self.db_path):
-            self._run_migrations()
+            self._connect()
         else:
             self._initial_setup()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Connect to the database, if not connected already, and bring its schema up to date"""
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # readers don't block the writer and vice versa
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # make sure every committed transaction has been synced to disk
+            self.conn.execute("PRAGMA synchronous=FULL")
+            # wait for other connections to the database (e.g. tools inspecting it) instead of failing
+            self.conn.execute("PRAGMA busy_timeout=5000")
+            self._run_migrations()
+        return self.conn
+
     def _initial_setup(self):
         """Initial setup of the database"""
         logger.info("Performing initial database setup...")
+        self._connect()
+        logger.info("Database setup complete")
 
-        # Initialize a connection to the database
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
+    def _run_migrations(self):
+        """Execute database migrations
 
-        # Sync token table
-        self.cursor.execute("CREATE TABLE sync_token (" "dedupe_id INTEGER PRIMARY KEY, " "token TEXT NOT NULL" ")")
+        Every migration brings the schema from the previous version to the next one, the
+        current version is stored in the database's user_version.
+        """
+        version: int = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        with self.conn:
+            if version < 1:
+                # Sync token table
+                self.conn.execute("CREATE TABLE IF NOT EXISTS sync_token (dedupe_id INTEGER PRIMARY KEY, token TEXT NOT NULL)")
+                # Plugin data, values are stored already encoded, together with the name of their format
+                self.conn.execute("CREATE TABLE plugin_namespaces (plugin TEXT PRIMARY KEY)")
+                self.conn.execute(
+                    "CREATE TABLE plugin_data (plugin TEXT NOT NULL, key TEXT NOT NULL, format TEXT NOT NULL, value BLOB NOT NULL, "
+                    "PRIMARY KEY (plugin, key))"
+                )
+                self.conn.execute(
+                    "CREATE TABLE plugin_room_data (plugin TEXT NOT NULL, room_id TEXT NOT NULL, key TEXT NOT NULL, format TEXT NOT NULL, "
+                    "value BLOB NOT NULL, PRIMARY KEY (plugin, room_id, key))"
+                )
+                self.conn.execute("CREATE INDEX plugin_room_data_room_id ON plugin_room_data (room_id)")
+                # entries of bounded collections (PersistentMap, RingBuffer), stored one row per entry
+                self.conn.execute(
+                    "CREATE TABLE plugin_collections (plugin TEXT NOT NULL, collection TEXT NOT NULL, key TEXT NOT NULL, "
+                    "format TEXT NOT NULL, value BLOB NOT NULL, timestamp REAL NOT NULL, PRIMARY KEY (plugin, collection, key))"
+                )
+                self.conn.execute("CREATE INDEX plugin_collections_timestamp ON plugin_collections (plugin, collection, timestamp)")
+            if version < latest_db_version:
+                self.conn.execute(f"PRAGMA user_version = {latest_db_version}")
+                logger.info(f"Migrated database from version {version} to {latest_db_version}")
 
-        logger.info("Database setup complete")
+    async def _run(self, method: Callable, *args: Any) -> Any:
+        """Run a database operation in the storage thread
 
-    def _run_migrations(self):
-        """Execute database migrations"""
-        # Initialize a connection to the database
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
+        Args:
+            method (Callable): The operation, receiving the connection as first argument
+
+            *args: Further arguments of the operation
+
+        Returns:
+            The result of the operation
+        """
+        return await asyncio.get_running_loop().run_in_executor(_io_executor, functools.partial(self.__execute, method, *args))
+
+    def __execute(self, method: Callable, *args: Any) -> Any:
+        return method(self._connect(), *args)
+
+    @staticmethod
+    def __register_namespace(connection: sqlite3.Connection, plugin: str):
+        connection.execute("INSERT OR IGNORE INTO plugin_namespaces (plugin) VALUES (?)", (plugin,))
+
+    async def has_namespace(self, plugin: str) -> bool:
+        """Check whether a plugin has stored anything before
+
+        Args:
+            plugin (str): Name of the plugin
+
+        Returns:
+            bool: True, if the plugin has written to the storage before
+        """
+
+        def has_namespace(connection: sqlite3.Connection) -> bool:
+            return connection.execute("SELECT 1 FROM plugin_namespaces WHERE plugin = ?", (plugin,)).fetchone() is not None
+
+        return await self._run(has_namespace)
+
+    async def load_values(self, plugin: str) -> Dict[str, Tuple[str, str or bytes]]:
+        """Load all key/value data of a plugin
+
+        Args:
+            plugin (str): Name of the plugin
+
+        Returns:
+            Dict of key and a tuple of format and encoded value
+        """
+
+        def load_values(connection: sqlite3.Connection) -> Dict[str, Tuple[str, str or bytes]]:
+            rows = connection.execute("SELECT key, format, value FROM plugin_data WHERE plugin = ?", (plugin,))
+            return {key: (value_format, value) for key, value_format, value in rows}
+
+        return await self._run(load_values)
+
+    async def load_room_values(self, plugin: str) -> Dict[Tuple[str, str], Tuple[str, str or bytes]]:
+        """Load the data of all rooms of a plugin
+
+        Args:
+            plugin (str): Name of the plugin
+
+        Returns:
+            Dict of room_id and key and a tuple of format and encoded value
+        """
+
+        def load_room_values(connection: sqlite3.Connection) -> Dict[Tuple[str, str], Tuple[str, str or bytes]]:
+            rows = connection.execute("SELECT room_id, key, format, value FROM plugin_room_data WHERE plugin = ?", (plugin,))
+            return {(room_id, key): (value_format, value) for room_id, key, value_format, value in rows}
+
+        return await self._run(load_room_values)
+
+    async def save_values(
+        self,
+        plugin: str,
+        values: Dict[str, str or bytes],
+        room_values: Dict[Tuple[str, str], str or bytes],
+        value_format: str,
+    ):
+        """Store key/value data and data of rooms of a plugin in a single transaction
+
+        Args:
+            plugin (str): Name of the plugin
+
+            values (dict): Key and encoded value of the data to store
+
+            room_values (dict): Room_id and key and encoded value of the rooms' data to store
+
+            value_format (str): Name of the format the values have been encoded in
+        """
+
+        def save_values(connection: sqlite3.Connection):
+            with connection:
+                self.__register_namespace(connection, plugin)
+                connection.executemany(
+                    "INSERT OR REPLACE INTO plugin_data (plugin, key, format, value) VALUES (?, ?, ?, ?)",
+                    [(plugin, key, value_format, value) for key, value in values.items()],
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO plugin_room_data (plugin, room_id, key, format, value) VALUES (?, ?, ?, ?, ?)",
+                    [(plugin, room_id, key, value_format, value) for (room_id, key), value in room_values.items()],
+                )
+
+        await self._run(save_values)
+
+    async def delete_value(self, plugin: str, key: str, room_id: str or None = None):
+        """Remove a single value of a plugin
+
+        Args:
+            plugin (str): Name of the plugin
+
+            key (str): Key of the value
+
+            room_id (str): The room the value belongs to, None for key/value data
+        """
+
+        def delete_value(connection: sqlite3.Connection):
+            with connection:
+                if room_id is None:
+                    connection.execute("DELETE FROM plugin_data WHERE plugin = ? AND key = ?", (plugin, key))
+                else:
+                    connection.execute("DELETE FROM plugin_room_data WHERE plugin = ? AND room_id = ? AND key = ?", (plugin, room_id, key))
+
+        await self._run(delete_value)
+
+    async def load_entries(self, plugin: str, collection: str) -> List[Tuple[str, str, str or bytes, float]]:
+        """Load all entries of a plugin's collection, oldest first
+
+        Args:
+            plugin (str): Name of the plugin
+
+            collection (str): Name of the collection
+
+        Returns:
+            List of tuples of key, format, encoded value and timestamp
+        """
+
+        def load_entries(connection: sqlite3.Connection) -> List[Tuple[str, str, str or bytes, float]]:
+            return connection.execute(
+                "SELECT key, format, value, timestamp FROM plugin_collections WHERE plugin = ? AND collection = ? ORDER BY timestamp, rowid",
+                (plugin, collection),
+            ).fetchall()
+
+        return await self._run(load_entries)
+
+    async def update_entries(
+        self,
+        plugin: str,
+        collection: str,
+        entries: Dict[str, Tuple[str or bytes, float]],
+        deleted: List[str],
+        value_format: str,
+    ):
+        """Store and remove entries of a plugin's collection in a single transaction
+
+        Args:
+            plugin (str): Name of the plugin
+
+            collection (str): Name of the collection
+
+            entries (dict): Key and a tuple of encoded value and timestamp of the entries to store
+
+            deleted (list): Keys of the entries to remove
+
+            value_format (str): Name of the format the values have been encoded in
+        """
+
+        def update_entries(connection: sqlite3.Connection):
+            with connection:
+                self.__register_namespace(connection, plugin)
+                connection.executemany(
+                    "DELETE FROM plugin_collections WHERE plugin = ? AND collection = ? AND key = ?",
+                    [(plugin, collection, key) for key in deleted],
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO plugin_collections (plugin, collection, key, format, value, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(plugin, collection, key, value_format, value, timestamp) for key, (value, timestamp) in entries.items()],
+                )
+
+        await self._run(update_entries)
+
+    async def clear_entries(self, plugin: str, collection: str):
+        """Remove all entries of a plugin's collection
+
+        Args:
+            plugin (str): Name of the plugin
+
+            collection (str): Name of the collection
+        """
+
+        def clear_entries(connection: sqlite3.Connection):
+            with connection:
+                connection.execute("DELETE FROM plugin_collections WHERE plugin = ? AND collection = ?", (plugin, collection))
+
+        await self._run(clear_entries)
+
+    async def close(self):
+        """Close the database connection, it is reopened on the next access"""
+
+        def close():
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+        await asyncio.get_running_loop().run_in_executor(_io_executor, close)
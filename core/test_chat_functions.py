@@ -0,0 +1,92 @@
+import asyncio
+import io
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from PIL import Image
+from nio import RoomGetEventResponse, RoomSendResponse, UploadResponse
+
+from core.chat_functions import render_message, send_image, send_replace, strip_tags, text_content
+
+
+def test_render_message_is_cached():
+    render_message.cache_clear()
+    first_content = text_content("**bold** <b>text</b>")
+    second_content = text_content("**bold** <b>text</b>", notice=False)
+
+    assert first_content["body"] == first_content["m.message"][0]["body"] == "**bold** text"
+    assert first_content["formatted_body"] == second_content["formatted_body"] == "<p><strong>bold</strong> <b>text</b></p>\n"
+    assert second_content["msgtype"] == "m.text"
+    assert render_message.cache_info().hits == 1
+
+
+@pytest.mark.parametrize(
+    "html, text",
+    [
+        ("plain text", "plain text"),
+        ("**Quote 1** <nick1> first  \n<nick2> second", "**Quote 1**  first  \n second"),
+        ('<a href="https://example.com/?a=1&amp;b=>">link</a><br/>&lt;3 &#128512;<!-- comment -->', "link<3 😀"),
+        ("a < b, c<3 and AT&T", "a < b, c<3 and AT&T"),
+    ],
+)
+def test_strip_tags(html, text):
+    assert strip_tags(html) == text
+
+
+@pytest.mark.asyncio
+async def test_send_replace_only_sends_changed_content(mocker):
+    client = mocker.Mock()
+    original_response = mocker.Mock(spec=RoomGetEventResponse)
+    original_response.event.source = {"content": text_content("old message")}
+    client.room_get_event = mocker.AsyncMock(return_value=original_response)
+    client.room_send = mocker.AsyncMock(return_value=RoomSendResponse("$edit", "!room"))
+
+    assert await send_replace(client, "!room", "$original", "old message") is None
+    assert await send_replace(client, "!room", "$original", "**new** message") == "$edit"
+    content = client.room_send.call_args.args[2]
+    assert content["m.new_content"]["formatted_body"] == "<p><strong>new</strong> message</p>\n"
+    assert content["m.relates_to"] == {"rel_type": "m.replace", "event_id": "$original"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("image_format, mime_type", [("png", "image/png"), ("jpeg", "image/jpeg"), ("webp", "image/webp")])
+async def test_send_image_uploads_from_memory(mocker, tmp_path, monkeypatch, image_format, mime_type):
+    monkeypatch.chdir(tmp_path)
+    client = mocker.Mock()
+    uploads = []
+
+    async def upload(data_provider, content_type, filename, filesize):
+        uploads.append(data_provider.read())
+        return UploadResponse("mxc://example.com/image"), None
+
+    client.upload = upload
+    client.room_send = mocker.AsyncMock(return_value=RoomSendResponse("$image", "!room"))
+    image = Image.new("RGBA", (300, 200), (255, 0, 0, 128))
+
+    response = await send_image(client, "!room", image, image_format, quality=50)
+
+    assert response.event_id == "$image"
+    assert os.listdir(tmp_path) == []
+    content = client.room_send.call_args.args[2]
+    assert content["info"]["mimetype"] == mime_type
+    assert (content["info"]["w"], content["info"]["h"], content["info"]["size"]) == (300, 200, len(uploads[0]))
+    assert content["info"]["xyz.amorgan.blurhash"]
+    assert Image.open(io.BytesIO(uploads[0])).size == (300, 200)
+
+
+@pytest.mark.asyncio
+async def test_send_image_returns_none_on_failure(mocker):
+    client = mocker.Mock()
+    client.upload = mocker.AsyncMock(side_effect=asyncio.TimeoutError())
+    client.room_send = mocker.AsyncMock()
+    # palette images are converted, as the palette is not part of the raw pixel data sent to the executor
+    image = Image.new("P", (30, 20))
+
+    assert await send_image(client, "!room", image) is None
+    assert client.upload.await_count == 1
+
+    mocker.patch("core.chat_functions.run_cpu", side_effect=BrokenProcessPool("worker died"))
+    assert await send_image(client, "!room", image) is None
+    assert client.upload.await_count == 1
+    client.room_send.assert_not_called()
@@ -0,0 +1,149 @@
+import asyncio
+
+import jsonpickle
+import pytest
+
+from core.serializer import get_serializer, register_data_class
+
+
+@pytest.mark.asyncio
+async def test_store_data_persists_single_keys(make_plugin):
+    plugin = make_plugin("datastore_test")
+
+    assert await plugin.store_data("first", {"a": 1})
+    assert await plugin.store_data("second", [1, 2, 3])
+    assert await plugin.clear_data("second")
+    await plugin.data_store.close()
+
+    assert await make_plugin("datastore_test")._load_data_from_file() == {"first": {"a": 1}}
+
+
+@pytest.mark.asyncio
+async def test_json_data_is_migrated(make_plugin):
+    plugin = make_plugin("datastore_migration_test")
+    with open(plugin.plugin_dataj_filename, "w") as file:
+        file.write(jsonpickle.encode({"quotes": {"1": "a quote"}, "nick_links": True}))
+
+    migrated_data = await plugin._load_data_from_file()
+    await plugin.data_store.close()
+    stored_data = await plugin.data_store.load()
+
+    assert migrated_data == {"quotes": {"1": "a quote"}, "nick_links": True}
+    assert set(stored_data.keys()) == {"quotes", "nick_links"}
+
+
+@pytest.mark.asyncio
+async def test_read_data_views_are_read_only(make_plugin):
+    plugin = make_plugin("datastore_view_test")
+    plugin.plugin_data = {"quotes": {"1": ["a quote"]}, "ids": [1, 2]}
+
+    quotes_view = await plugin.read_data("quotes", read_only=True)
+    ids_view = await plugin.read_data("ids", read_only=True)
+    quotes_copy = await plugin.read_data_for_update("quotes")
+
+    assert quotes_view == {"1": ["a quote"]} and ids_view == (1, 2)
+    with pytest.raises(TypeError):
+        quotes_view["2"] = "another quote"
+
+    quotes_copy["1"].append("changed")
+    assert plugin.plugin_data["quotes"] == {"1": ["a quote"]}
+
+
+@register_data_class
+class StoredObject:
+    def __init__(self, value: int):
+        self.value = value
+
+
+@pytest.mark.asyncio
+async def test_store_data_tracks_changes(make_plugin, mocker):
+    plugin = make_plugin("datastore_change_test")
+    save = mocker.spy(plugin.data_store, "save")
+
+    # unchanged scalar values are skipped without encoding them
+    assert await plugin.store_data("counter", 1)
+    assert await plugin.store_data("counter", 1)
+    assert await plugin.store_data("counter", True)
+
+    # unchanged containers are skipped when they are written, as their encoding equals the stored one
+    assert await plugin.store_data("quotes", {"1": "a quote"})
+    quotes = await plugin.read_data_for_update("quotes")
+    assert await plugin.store_data("quotes", quotes)
+
+    # storing an object marks it as changed, objects changed in place are marked explicitly
+    stored_object = StoredObject(1)
+    assert await plugin.store_data("object", stored_object)
+    stored_object.value = 2
+    assert await plugin.mark_dirty("object")
+    assert not await plugin.mark_dirty("missing")
+    await plugin.data_store.close()
+    stored_data = await plugin.data_store.load()
+
+    assert save.call_count == 5
+    assert plugin.write_stats.unchanged == 2
+    assert get_serializer("msgpack").decode(stored_data["object"][1]).value == 2
+
+
+@pytest.mark.asyncio
+async def test_store_data_coalesces_delayed_writes(make_plugin, mocker):
+    plugin = make_plugin("datastore_delay_test")
+    plugin.data_write_delay = 0.05
+    save_all = mocker.spy(plugin.data_store, "save_all")
+    encode = mocker.spy(get_serializer("msgpack"), "encode")
+
+    for value in range(5):
+        assert await plugin.store_data("counter", value)
+    assert save_all.call_count == 0
+    await asyncio.sleep(0.1)
+    assert save_all.call_count == 1
+
+    # pending changes are written immediately on flush
+    assert await plugin.store_data("counter", 5)
+    assert await plugin._flush()
+    assert save_all.call_count == 2
+    # the data is only encoded when it is written
+    assert encode.call_count == 2
+
+    # data changed and changed back before the flush is not written again
+    assert await plugin.store_data("counter", 6)
+    assert await plugin.store_data("counter", 5)
+    assert await plugin._flush()
+    assert save_all.call_count == 2
+    await plugin.data_store.close()
+
+    assert await plugin.data_store.load() == {"counter": ("msgpack", get_serializer("msgpack").encode(5))}
+    assert plugin.write_stats.coalesced == 5
+    assert plugin.write_stats.written == 2
+    assert plugin.write_stats.unchanged == 1
+
+
+@pytest.mark.asyncio
+async def test_data_is_loaded_in_background(make_plugin):
+    plugin = make_plugin("datastore_loading_test")
+    assert await plugin.store_data("quotes", {"1": "a quote"})
+    await plugin.data_store.close()
+
+    plugin = make_plugin("datastore_loading_test")
+    plugin._start_loading_data()
+    # reading waits for the data to be loaded
+    assert await plugin.read_data("quotes") == {"1": "a quote"}
+    # data stored again unchanged after loading it is not written
+    assert await plugin.store_data("quotes", {"1": "a quote"})
+    assert (plugin.write_stats.unchanged, plugin.write_stats.written) == (1, 0)
+
+
+@pytest.mark.asyncio
+async def test_room_data_is_stored_per_room(make_plugin, mocker):
+    plugin = make_plugin("datastore_room_test")
+
+    assert await plugin.store_data("rooms_db", {"!room1:example.com": {"members": 2}, "!room2:example.com": {"members": 3}})
+    assert await plugin.convert_to_room_data("rooms_db")
+    assert await plugin.read_data("rooms_db") is None
+
+    save = mocker.spy(plugin.data_store, "save")
+    assert await plugin.store_room_data("!room1:example.com", "rooms_db", {"members": 4})
+    # only the changed room is written
+    assert save.call_count == 1 and save.call_args.args[0].endswith("!room1:example.com/rooms_db")
+
+    assert await plugin.clear_room_data("!room2:example.com", "rooms_db")
+    assert [await plugin.read_room_data(room_id, "rooms_db") for room_id in ["!room1:example.com", "!room2:example.com"]] == [{"members": 4}, None]
@@ -0,0 +1,24 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from core.executor import run_cpu, setup_executor, shutdown_executor
+
+
+def current_thread_name() -> str:
+    return threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_executor_is_created_on_first_use(mocker):
+    create_executor = mocker.patch("core.executor.ThreadPoolExecutor", wraps=ThreadPoolExecutor)
+    setup_executor(workers=1, use_processes=False)
+    # configuring the executor doesn't start any workers
+    assert create_executor.call_count == 0
+
+    thread_names = [await run_cpu(current_thread_name) for _ in range(2)]
+    shutdown_executor()
+
+    assert all(thread_name.startswith("cpu") for thread_name in thread_names)
+    assert create_executor.call_count == 1
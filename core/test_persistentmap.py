@@ -0,0 +1,48 @@
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_map_evicts_least_recently_set_entries(make_plugin):
+    plugin = make_plugin("persistentmap_test")
+    tracked = await plugin.open_map("tracked", max_size=3)
+    for event_id in ["a", "b", "c", "d"]:
+        await tracked.set(event_id, event_id.upper())
+    await tracked.set("b", "B2")
+    await tracked.set("e", "E")
+    assert await plugin.open_map("tracked") is tracked
+    await plugin.data_store.close()
+
+    # only the remaining entries are stored
+    reopened = await make_plugin("persistentmap_test").open_map("tracked", max_size=3)
+    assert list(tracked.items()) == list(reopened.items()) == [("d", "D"), ("b", "B2"), ("e", "E")]
+
+
+@pytest.mark.asyncio
+async def test_map_expires_entries(make_plugin, mocker):
+    now = mocker.patch("core.persistentmap.time", return_value=1000.0)
+    plugin = make_plugin("persistentmap_ttl_test")
+    last_seen = await plugin.open_map("last_seen", ttl=60)
+    await last_seen.set("!room1:example.com", True)
+    now.return_value = 1030.0
+    await last_seen.set("!room2:example.com", True)
+
+    now.return_value = 1070.0
+    assert "!room1:example.com" not in last_seen and last_seen.get("!room1:example.com") is None
+    assert "!room2:example.com" in last_seen and len(last_seen) == 1
+    await last_seen.expire()
+    await plugin.data_store.close()
+
+    assert [entry[0] for entry in await plugin.data_store.load_entries("last_seen")] == ["!room2:example.com"]
+
+
+@pytest.mark.asyncio
+async def test_ring_buffer_keeps_latest_values(make_plugin):
+    plugin = make_plugin("ringbuffer_test")
+    buffer = await plugin.open_ring_buffer("recent", 3)
+    for value in range(5):
+        await buffer.append(value)
+    await plugin.data_store.close()
+
+    reopened = await make_plugin("ringbuffer_test").open_ring_buffer("recent", 3)
+    await reopened.append(5)
+    assert (list(buffer), list(reopened)) == ([2, 3, 4], [3, 4, 5])
@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core.pluginloader import PluginLoader
+
+
+def make_plugin_loader(tmp_path, **config_items) -> PluginLoader:
+    config = SimpleNamespace(
+        plugins_src_dir=str(tmp_path),
+        plugins_allowlist=[],
+        plugins_denylist=[],
+        state_dir=str(tmp_path),
+        plugins_config_dir=str(tmp_path),
+        command_prefix="!c",
+        cpu_workers=1,
+        cpu_use_processes=False,
+        data_write_delay=0,
+        data_format="msgpack",
+        image_format="png",
+        image_quality=85,
+        hooks_concurrent=False,
+        hooks_timeout=0,
+        hooks_max_concurrency_per_plugin=4,
+    )
+    config.__dict__.update(config_items)
+    return PluginLoader(config, None)
+
+
+def make_event(body: str = "hello") -> SimpleNamespace:
+    return SimpleNamespace(source={"content": {"body": body}})
+
+
+@pytest.mark.asyncio
+async def test_concurrent_hooks_are_isolated_and_timed_out(tmp_path, make_plugin):
+    plugin_loader: PluginLoader = make_plugin_loader(tmp_path, hooks_concurrent=True, hooks_timeout=0.05)
+    plugin = make_plugin("concurrent_hooks_test")
+    plugin._set_hook_registry(plugin_loader.hook_registry)
+    calls = []
+
+    async def slow_hook(client, room_id, event):
+        await asyncio.sleep(1)
+        calls.append("slow")
+
+    async def failing_hook(client, room_id, event):
+        raise ValueError
+
+    async def fast_hook(client, room_id, event):
+        calls.append("fast")
+
+    plugin.add_hook("m.room.message", slow_hook)
+    plugin.add_hook("m.room.message", failing_hook)
+    plugin.add_hook("m.room.message", fast_hook)
+
+    await plugin_loader.run_hooks(None, "m.room.message", SimpleNamespace(room_id="!room:example.com"), make_event())
+    await asyncio.sleep(0.2)
+
+    assert calls == ["fast"]
+    stats = plugin_loader.hook_metrics.get_stats()
+    assert stats["concurrent_hooks_test.slow_hook"].timeouts == 1
+    assert stats["concurrent_hooks_test.failing_hook"].errors == 1
+    assert stats["concurrent_hooks_test.fast_hook"].count == 1
+
+
+@pytest.mark.asyncio
+async def test_stop_hooks_waits_for_running_hooks(tmp_path, make_plugin):
+    plugin_loader: PluginLoader = make_plugin_loader(tmp_path, hooks_concurrent=True)
+    plugin = make_plugin("stop_hooks_test")
+    plugin._set_hook_registry(plugin_loader.hook_registry)
+    cancelled = []
+
+    async def storing_hook(client, room_id, event):
+        await asyncio.sleep(0.05)
+        await plugin.store_data("last_event", event.source["content"]["body"])
+
+    async def stuck_hook(client, room_id, event):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(room_id)
+            raise
+
+    plugin.add_hook("m.room.message", storing_hook)
+    plugin.add_hook("m.room.message", stuck_hook)
+
+    await plugin_loader.run_hooks(None, "m.room.message", SimpleNamespace(room_id="!room:example.com"), make_event())
+    await plugin_loader.stop_hooks(timeout=0.2)
+
+    # the data stored by the finished hook is written, the hook still running after the timeout is cancelled
+    assert await plugin.read_data("last_event") == "hello"
+    assert cancelled == ["!room:example.com"]
@@ -0,0 +1,117 @@
+from thefuzz import fuzz
+
+from core.plugin import PluginCommand
+from core.registry import CommandRegistry, HookRegistry, FuzzyCommandIndex
+
+
+async def command_method(command):
+    pass
+
+
+def test_command_registry_tracks_plugin_commands(make_plugin):
+    registry = CommandRegistry()
+    plugin = make_plugin("registry_test")
+    plugin.add_command("static_command", command_method, "static")
+    plugin._set_command_registry(registry)
+
+    plugin.add_command("dynamic_command", command_method, "dynamic", command_type="dynamic")
+    assert "static_command" in registry
+    assert registry.get("dynamic_command").command_type == "dynamic"
+
+    version: int = registry.version
+    assert plugin.del_command("dynamic_command")
+    assert registry.get("dynamic_command") is None
+    assert registry.version > version
+
+
+def test_command_registry_restores_shadowed_command():
+    registry = CommandRegistry()
+    first = PluginCommand("shared", command_method, "first", power_level=0, room_id=None)
+    second = PluginCommand("shared", command_method, "second", power_level=0, room_id=None)
+
+    registry.register("first_plugin", first)
+    registry.register("second_plugin", second)
+    assert registry.get("shared") is second
+
+    assert registry.unregister("second_plugin", "shared")
+    assert registry.get("shared") is first
+    assert not registry.unregister("second_plugin", "shared")
+
+
+async def hook_method(client, room_id, event):
+    pass
+
+
+async def other_hook_method(client, room_id, event):
+    pass
+
+
+def test_hook_registry_tracks_plugin_hooks(make_plugin):
+    registry = HookRegistry()
+    plugin = make_plugin("hook_registry_test")
+    plugin.add_hook("m.room.message", hook_method)
+    plugin._set_hook_registry(registry)
+
+    plugin.add_hook("m.room.message", other_hook_method, room_id_list=["!room:example.com"], hook_type="dynamic")
+    snapshot = registry.get("m.room.message")
+    assert isinstance(snapshot, tuple)
+    assert [hook.method for hook in snapshot] == [hook_method, other_hook_method]
+
+    assert plugin.del_hook("m.room.message", other_hook_method)
+    assert [hook.method for hook in registry.get("m.room.message")] == [hook_method]
+    # snapshots taken before a change stay untouched
+    assert len(snapshot) == 2
+    assert registry.get("m.reaction") == ()
+
+
+def test_hook_registry_routes_by_room(make_plugin):
+    registry = HookRegistry()
+    plugin = make_plugin("hook_room_test")
+    plugin._set_hook_registry(registry)
+
+    plugin.add_hook("m.room.message", hook_method)
+    plugin.add_hook("m.room.message", other_hook_method, room_id_list=["!a:example.com"], hook_type="dynamic")
+    plugin.add_hook("m.room.message", other_hook_method, room_id_list=["!b:example.com"], hook_type="dynamic")
+
+    assert [hook.method for hook in registry.get_for_room("m.room.message", "!a:example.com")] == [hook_method, other_hook_method]
+    assert [hook.method for hook in registry.get_for_room("m.room.message", "!b:example.com")] == [hook_method, other_hook_method]
+    assert [hook.method for hook in registry.get_for_room("m.room.message", "!c:example.com")] == [hook_method]
+
+    plugin.del_hook("m.room.message", other_hook_method, room_id_list=["!a:example.com"])
+    assert [hook.method for hook in registry.get_for_room("m.room.message", "!a:example.com")] == [hook_method]
+    assert [hook.method for hook in registry.get_for_room("m.room.message", "!b:example.com")] == [hook_method, other_hook_method]
+
+
+def test_hook_registry_routes_reactions_by_event_id(make_plugin):
+    registry = HookRegistry()
+    plugin = make_plugin("hook_event_test")
+    plugin._set_hook_registry(registry)
+
+    plugin.add_hook("m.reaction", hook_method)
+    plugin.add_hook("m.reaction", other_hook_method, event_ids=["$event1", "$event2"], hook_type="dynamic")
+
+    assert [hook.method for hook in registry.get_for_room("m.reaction", "!a:example.com", "$event2")] == [hook_method, other_hook_method]
+    assert [hook.method for hook in registry.get_for_room("m.reaction", "!a:example.com", "$event3")] == [hook_method]
+    assert [hook.method for hook in registry.get_for_room("m.reaction", "!a:example.com")] == [hook_method]
+
+    plugin.del_hook("m.reaction", other_hook_method)
+    for event_id in ["$event1", "$event2"]:
+        assert [hook.method for hook in registry.get_for_room("m.reaction", "!a:example.com", event_id)] == [hook_method]
+    assert [hook.method for hook in registry.get("m.reaction")] == [hook_method]
+
+
+def test_fuzzy_command_index_matches_like_plain_fuzzy_matching():
+    registry = CommandRegistry()
+    for command in ["quote", "quote_add", "quote_links", "roll", "help", "xkcd", "wiki", "translate", "dates", "pick"]:
+        registry.register("test", PluginCommand(command, command_method, "", power_level=0, room_id=None))
+    index = FuzzyCommandIndex(registry)
+
+    for word in ["qoute", "quote_ad", "rol", "hlep", "xkdc", "transalte", "zzzzzz", "q", "datse"]:
+        ratios = {key: fuzz.ratio(word, key) for key in registry.get_commands() if fuzz.ratio(word, key) > 60}
+        expected = sorted(ratios.items(), key=lambda item: item[1], reverse=True)[0][0] if ratios else None
+        assert index.match(word) == expected
+        # memoized result
+        assert index.match(word) == expected
+
+    registry.register("test", PluginCommand("zzzzz", command_method, "", power_level=0, room_id=None))
+    assert index.match("zzzzzz") == "zzzzz"
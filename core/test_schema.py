@@ -0,0 +1,81 @@
+import datetime
+import io
+import pickle
+
+import jsonpickle
+import pytest
+
+from core.plugin import PluginCommand, PluginHook
+from core.schema import decode_json, encode_json, load_pickle, register_data_class, register_function
+from core.timer import Timer
+
+
+@register_function
+async def stored_method(command):
+    pass
+
+
+@register_data_class
+class StoredItem:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class UnregisteredItem:
+    def __reduce__(self):
+        return print, ("executed",)
+
+
+def make_state():
+    timezone = datetime.timezone(datetime.timedelta(hours=2))
+    first_hook = PluginHook("m.reaction", stored_method, hook_type="dynamic")
+    second_hook = PluginHook("m.reaction", stored_method, hook_type="dynamic")
+    timers = [
+        Timer("test.stored_method", stored_method, datetime.timedelta(minutes=36), datetime.datetime(2023, 5, 1, 12, 30, tzinfo=timezone)),
+        Timer("test.daily", stored_method, "daily", datetime.datetime(2023, 5, 1), timer_type="dynamic"),
+    ]
+    return {"cmd": PluginCommand("cmd", stored_method, "help", 0, ["!room"], "dynamic")}, {"m.reaction": [first_hook, second_hook]}, timers
+
+
+def test_decodes_state_written_by_jsonpickle():
+    # jsonpickle references the default lists shared by both hooks by "py/id"
+    legacy_json = jsonpickle.encode(make_state())
+    assert '"py/id"' in legacy_json
+
+    for encoded in [legacy_json, encode_json(make_state())]:
+        (commands, hooks, timers) = decode_json(encoded)
+        assert vars(commands["cmd"]) == vars(make_state()[0]["cmd"])
+        assert [vars(hook) for hook in hooks["m.reaction"]] == [vars(hook) for hook in make_state()[1]["m.reaction"]]
+        assert [vars(timer) for timer in timers] == [vars(timer) for timer in make_state()[2]]
+
+    # files written now can still be read by previous versions
+    assert [vars(timer) for timer in jsonpickle.decode(encode_json(make_state()))[2]] == [vars(timer) for timer in make_state()[2]]
+
+
+@pytest.mark.parametrize(
+    "encoded",
+    [
+        '{"py/reduce": [{"py/function": "os.system"}, {"py/tuple": ["echo executed"]}]}',
+        '{"py/reduce": [{"py/type": "subprocess.Popen"}, {"py/tuple": [["echo", "executed"]]}]}',
+        '{"py/object": "subprocess.Popen", "py/newargs": {"py/tuple": [["echo", "executed"]]}}',
+        '{"py/object": "%s.StoredItem", "py/state": {"name": "executed"}}' % StoredItem.__module__,
+        '{"py/function": "os.system"}',
+        '{"py/repr": "os/os.system(\'echo executed\')"}',
+        '[{"py/id": 5}]',
+    ],
+)
+def test_untrusted_json_is_rejected(encoded, capfd):
+    with pytest.raises((TypeError, ValueError)):
+        decode_json(encoded)
+    assert "executed" not in capfd.readouterr().out
+
+
+def test_untrusted_pickle_is_rejected(capfd):
+    data = {"items": [StoredItem("first")], "date": datetime.date(2023, 5, 1), "tags": {"a"}}
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        loaded = load_pickle(io.BytesIO(pickle.dumps(data, protocol=protocol)))
+        assert (loaded["items"][0].name, loaded["date"], loaded["tags"]) == ("first", datetime.date(2023, 5, 1), {"a"})
+
+    with pytest.raises(TypeError):
+        load_pickle(io.BytesIO(pickle.dumps({"item": UnregisteredItem()})))
+    assert "executed" not in capfd.readouterr().out
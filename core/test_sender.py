@@ -0,0 +1,203 @@
+import asyncio
+from time import monotonic
+
+import pytest
+from nio import RoomSendResponse, RoomSendError
+
+from core.chat_functions import room_send, send_reaction
+from core.sender import PRIORITY_BULK, PRIORITY_MESSAGE, PRIORITY_REACTION, MessageSender, get_sender, setup_sender, shutdown_sender
+
+
+class FakeClient:
+    def __init__(self, errors=None, latency=0):
+        self.sent = []
+        self.errors = list(errors or [])
+        self.latency = latency
+        self.sending = 0
+        self.max_sending = 0
+
+    async def room_send(self, room_id, message_type, content, tx_id=None, ignore_unverified_devices=False):
+        self.sent.append((monotonic(), room_id, content.get("body"), tx_id))
+        self.sending += 1
+        self.max_sending = max(self.max_sending, self.sending)
+        await asyncio.sleep(self.latency)
+        self.sending -= 1
+        if self.errors:
+            return self.errors.pop(0)
+        return RoomSendResponse(f"$event{len(self.sent)}", room_id)
+
+
+@pytest.mark.asyncio
+async def test_sender_sends_by_priority_and_paces_events():
+    client = FakeClient()
+    sender = MessageSender(client, rate=20, burst=1, room_rate=0, room_burst=1)
+
+    futures = [
+        sender.submit("!a", "m.room.message", {"body": "bulk"}, priority=PRIORITY_BULK),
+        sender.submit("!a", "m.reaction", {"body": "reaction"}, priority=PRIORITY_REACTION),
+        sender.submit("!a", "m.room.message", {"body": "message"}, priority=PRIORITY_MESSAGE),
+    ]
+    responses = await asyncio.gather(*futures)
+    await sender.stop()
+
+    assert [body for (_, _, body, _) in client.sent] == ["message", "reaction", "bulk"]
+    assert [response.event_id for response in responses] == ["$event3", "$event2", "$event1"]
+    times = [timestamp for (timestamp, _, _, _) in client.sent]
+    assert all(later - earlier >= 0.04 for earlier, later in zip(times, times[1:]))
+
+
+@pytest.mark.asyncio
+async def test_sender_sends_rooms_concurrently_in_order():
+    client = FakeClient(latency=0.05)
+    sender = MessageSender(client, concurrency=4)
+
+    futures = [sender.submit(f"!room{index % 8}", "m.room.message", {"body": str(index)}) for index in range(32)]
+    start = monotonic()
+    await asyncio.gather(*futures)
+    duration = monotonic() - start
+    await sender.stop()
+
+    # 32 events sent 4 at a time instead of one after another, events of the same room in the order they have been submitted
+    assert duration < 32 * 0.05 / 2
+    assert client.max_sending == 4
+    for room in range(8):
+        assert [int(body) for (_, room_id, body, _) in client.sent if room_id == f"!room{room}"] == list(range(room, 32, 8))
+
+
+@pytest.mark.asyncio
+async def test_sender_does_not_delay_other_rooms():
+    client = FakeClient()
+    sender = MessageSender(client, rate=1000, burst=10, room_rate=10, room_burst=1)
+
+    futures = [sender.submit(room_id, "m.room.message", {"body": body}) for room_id, body in [("!a", "a1"), ("!a", "a2"), ("!b", "b1")]]
+    await asyncio.gather(*futures)
+    await sender.stop()
+
+    assert [body for (_, _, body, _) in client.sent] == ["a1", "b1", "a2"]
+
+
+@pytest.mark.asyncio
+async def test_sender_waits_when_rate_limited():
+    client = FakeClient(errors=[RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", 100)])
+    sender = MessageSender(client, rate=1000, burst=10, room_rate=0, room_burst=1)
+
+    response = await sender.submit("!a", "m.room.message", {"body": "message"})
+    await sender.stop()
+
+    assert isinstance(response, RoomSendResponse)
+    ((first_time, _, _, first_tx_id), (second_time, _, _, second_tx_id)) = client.sent
+    assert second_time - first_time >= 0.09
+    # the event is sent again with the same transaction id, so it is not posted twice
+    assert first_tx_id == second_tx_id
+
+
+@pytest.mark.asyncio
+async def test_sender_waits_when_rate_limited_without_pacing():
+    client = FakeClient(errors=[RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", 300)])
+    sender = MessageSender(client)
+
+    futures = [sender.submit(room_id, "m.room.message", {"body": room_id}) for room_id in ["!a", "!b"]]
+    responses = await asyncio.gather(*futures)
+    await sender.stop()
+
+    # the pause requested by the server applies to all rooms, even if pacing is disabled
+    assert all(isinstance(response, RoomSendResponse) for response in responses)
+    ((first_time, first_room, _, first_tx_id), _, (retry_time, retry_room, _, retry_tx_id)) = client.sent
+    assert (retry_room, retry_tx_id) == (first_room, first_tx_id)
+    assert retry_time - first_time >= 0.3
+
+
+@pytest.mark.asyncio
+async def test_sender_does_not_send_waiting_events_while_paused():
+    client = FakeClient(errors=[RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", 200)], latency=0.01)
+    sender = MessageSender(client, concurrency=2)
+
+    futures = [sender.submit(f"!room{index}", "m.room.message", {"body": str(index)}) for index in range(4)]
+    start = monotonic()
+    await asyncio.gather(*futures)
+    await sender.stop()
+
+    # the events waiting for a free slot are sent after the pause
+    assert len(client.sent) == 5
+    assert len([timestamp for (timestamp, _, _, _) in client.sent if timestamp - start < 0.2]) == 2
+
+
+@pytest.mark.asyncio
+async def test_room_send_uses_sender_of_client():
+    client = FakeClient()
+
+    setup_sender(client, rate=1000, burst=10, room_rate=0, room_burst=1)
+    response = await room_send(client, "!a", "m.room.message", {"body": "message"})
+    assert isinstance(response, RoomSendResponse)
+    assert await send_reaction(client, "!a", response.event_id, "👍", wait=False) is None
+    await shutdown_sender()
+
+    # without a sender, events are sent directly
+    assert isinstance(await room_send(client, "!a", "m.room.message", {"body": "direct"}), RoomSendResponse)
+    assert [body for (_, _, body, _) in client.sent] == ["message", None, "direct"]
+
+
+@pytest.mark.asyncio
+async def test_broadcast_message_returns_result_per_room(make_plugin):
+    client = FakeClient()
+    plugin = make_plugin("broadcast_test")
+    contents = []
+
+    async def room_send(room_id, message_type, content, tx_id=None, ignore_unverified_devices=False):
+        contents.append(content)
+        if room_id == "!forbidden":
+            return RoomSendError("Forbidden", "M_FORBIDDEN")
+        return await FakeClient.room_send(client, room_id, message_type, content, tx_id, ignore_unverified_devices)
+
+    client.room_send = room_send
+
+    setup_sender(client, rate=1000, burst=10, room_rate=0, room_burst=1)
+    get_sender(client).max_retries = 0
+    results = await plugin.broadcast_message(client, ["!forbidden", "!a", "!b", "!a"], "**announcement**")
+    await shutdown_sender()
+
+    # the message is rendered once and sent once to every room
+    assert len(contents) == 3 and all(content is contents[0] for content in contents)
+    assert contents[0]["formatted_body"] == "<p><strong>announcement</strong></p>\n"
+    assert isinstance(results.pop("!forbidden"), RoomSendError)
+    assert sorted(results) == ["!a", "!b"] and all(event_id.startswith("$event") for event_id in results.values())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("with_sender", [True, False])
+async def test_broadcast_message_sends_rooms_concurrently(make_plugin, with_sender):
+    client = FakeClient(latency=0.02)
+    plugin = make_plugin("broadcast_test")
+    room_ids = [f"!room{index}" for index in range(200)]
+
+    if with_sender:
+        setup_sender(client)
+    start = monotonic()
+    results = await plugin.broadcast_message(client, room_ids, "announcement")
+    duration = monotonic() - start
+    await shutdown_sender()
+
+    # sending one room after another would take 4s
+    assert len(results) == 200 and all(event_id.startswith("$event") for event_id in results.values())
+    assert duration < 200 * 0.02 / 4
+    assert client.max_sending <= 8
+
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("with_sender", [True, False])
+async def test_broadcast_message_pauses_all_rooms_when_rate_limited(make_plugin, with_sender):
+    client = FakeClient(errors=[RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", 200)], latency=0.01)
+    plugin = make_plugin("broadcast_test")
+    room_ids = [f"!room{index}" for index in range(20)]
+
+    if with_sender:
+        setup_sender(client)
+    start = monotonic()
+    results = await plugin.broadcast_message(client, room_ids, "announcement")
+    await shutdown_sender()
+
+    # no event is lost and only the events sent before the server asked us to slow down are sent within the pause
+    assert sorted(results) == sorted(room_ids) and all(event_id.startswith("$event") for event_id in results.values())
+    assert len(client.sent) == 21
+    assert len([timestamp for (timestamp, _, _, _) in client.sent if timestamp - start < 0.2]) == 8
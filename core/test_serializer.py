@@ -0,0 +1,81 @@
+import collections
+import datetime
+import enum
+
+import jsonpickle
+import pytest
+
+from core.serializer import Serializer, get_serializer, register_data_class
+
+
+@register_data_class
+class RegisteredItem:
+    def __init__(self, name: str, date: datetime.datetime):
+        self.name = name
+        self.date = date
+        self.tags = {"a", "b"}
+        self.position = (1, 2)
+
+
+class Level(str, enum.Enum):
+    HIGH = "high"
+
+
+class UnregisteredItem:
+    def __init__(self, value: int):
+        self.value = value
+
+
+def test_msgpack_round_trip():
+    serializer = get_serializer("msgpack")
+    data = {
+        "items": {"1": RegisteredItem("first", datetime.datetime(2023, 5, 1, 12, 30)), 2: datetime.timedelta(minutes=36)},
+        "list": [1, 2.5, "three", None, True],
+    }
+
+    decoded = serializer.decode(serializer.encode(data))
+    item = decoded["items"]["1"]
+    assert isinstance(item, RegisteredItem)
+    assert (item.name, item.date, item.tags, item.position) == ("first", datetime.datetime(2023, 5, 1, 12, 30), {"a", "b"}, (1, 2))
+    assert decoded["items"][2] == datetime.timedelta(minutes=36)
+    assert decoded["list"] == [1, 2.5, "three", None, True]
+
+    # objects of classes not registered can't be restored, so they aren't stored either
+    with pytest.raises(TypeError):
+        serializer.encode({"item": UnregisteredItem(3)})
+
+
+def test_msgpack_normalises_subclasses_of_builtins():
+    serializer = get_serializer("msgpack")
+    counts = collections.defaultdict(int, {"a": 1})
+
+    decoded = serializer.decode(serializer.encode({"ordered": collections.OrderedDict([("b", 2), ("a", 1)]), "counts": counts}))
+    assert decoded == {"ordered": {"b": 2, "a": 1}, "counts": {"a": 1}}
+    assert list(decoded["ordered"]) == ["b", "a"] and type(decoded["counts"]) is dict
+
+    with pytest.raises(TypeError, match="convert them to str"):
+        serializer.encode({"level": Level.HIGH})
+
+
+def test_serializer_requires_encode_and_decode():
+    class EncodeOnlySerializer(Serializer):
+        def encode(self, data):
+            return data
+
+    with pytest.raises(TypeError):
+        EncodeOnlySerializer()
+
+
+@pytest.mark.asyncio
+async def test_jsonpickle_store_is_converted(make_plugin):
+    plugin = make_plugin("serializer_migration_test")
+
+    # data stored in the jsonpickle format is converted to the configured format when loaded
+    await plugin.data_store.save_all({"items": jsonpickle.encode([RegisteredItem("first", datetime.datetime(2023, 5, 1))])}, "jsonpickle")
+    data = await plugin._load_data_from_file()
+    stored_data = await plugin.data_store.load()
+    await plugin.data_store.close()
+
+    assert data["items"][0].name == "first"
+    assert stored_data["items"][0] == "msgpack"
+    assert get_serializer("msgpack").decode(stored_data["items"][1])[0].date == datetime.datetime(2023, 5, 1)
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from core.statefile import read_state_file, write_state_file
+
+
+async def first_timer(client):
+    pass
+
+
+async def second_timer(client):
+    pass
+
+
+def test_damaged_state_file_is_detected(tmp_path):
+    filename = os.path.join(tmp_path, "test_state.json")
+    assert write_state_file(filename, '{"state": 1}')
+    assert read_state_file(filename) == '{"state": 1}'
+    assert not os.path.isfile(f"{filename}.tmp")
+
+    with open(filename, "r+") as file:
+        file.seek(file.read().index("1"))
+        file.write("2")
+    assert read_state_file(filename) is None
+
+
+def test_state_falls_back_to_last_valid_snapshot(make_plugin):
+    plugin = make_plugin("statefile_test")
+    plugin.add_timer(first_timer, timer_type="dynamic")
+    plugin.add_timer(second_timer, timer_type="dynamic")
+
+    # simulate a crash damaging the state file
+    with open(plugin.plugin_state_filename, "w") as file:
+        file.write("sha256:0\n[")
+
+    restored_plugin = make_plugin("statefile_test")
+    restored_plugin._load_state()
+    assert [timer.name for timer in restored_plugin._get_timers()] == ["statefile_test.first_timer"]
+
+
+@pytest.mark.asyncio
+async def test_delayed_state_is_written_in_storage_thread(make_plugin, mocker):
+    plugin = make_plugin("statefile_delay_test")
+    plugin.data_write_delay = 10
+    threads = []
+    mocker.patch("core.plugin.write_state_file", side_effect=lambda filename, json_data: threads.append(threading.current_thread().name) or True)
+
+    plugin.add_timer(first_timer, timer_type="dynamic")
+    assert await plugin._flush()
+    # the state has not changed since it was written
+    plugin._save_state()
+    assert await plugin._flush()
+
+    assert len(threads) == 1 and threads[0].startswith("storage")
+    assert plugin.write_stats.requested == 2
+    assert plugin.write_stats.written == 1
+
+
+@pytest.mark.asyncio
+async def test_state_is_written_in_storage_thread_without_delay(make_plugin, mocker):
+    plugin = make_plugin("statefile_nodelay_test")
+    plugin.data_write_delay = 0
+    threads = []
+    results = [False, True]
+    mocker.patch("core.plugin.write_state_file", side_effect=lambda filename, json_data: threads.append(threading.current_thread().name) or results.pop(0))
+
+    plugin.add_timer(first_timer, timer_type="dynamic")
+    await asyncio.sleep(0.1)
+    # the failed write is kept pending and written by the next flush
+    assert await plugin._flush()
+    assert await plugin._flush()
+
+    assert len(threads) == 2 and all(thread.startswith("storage") for thread in threads)
+    assert plugin.write_stats.written == 1
+
@@ -0,0 +1,28 @@
+import os
+import sqlite3
+
+import pytest
+
+from core.plugin import Plugin
+from core.serializer import get_serializer
+from core.storage import DATABASE_FILENAME, get_storage
+
+
+@pytest.mark.asyncio
+async def test_plugins_share_one_database(make_plugin):
+    first_plugin = make_plugin("storage_first_test")
+    second_plugin = make_plugin("storage_second_test")
+
+    assert await first_plugin.store_data("counter", 1)
+    assert await second_plugin.store_data("counter", 2)
+    assert await second_plugin.store_room_data("!room:example.com", "counter", 3)
+    await get_storage(first_plugin.data_store.filename).close()
+
+    assert await first_plugin.data_store.load() == {"counter": ("msgpack", get_serializer("msgpack").encode(1))}
+    assert await second_plugin._load_data_from_file() == {"counter": 2, "room_data/!room:example.com/counter": 3}
+    assert not any(filename.endswith("_data.db") for filename in os.listdir(Plugin.state_dir))
+
+    connection = sqlite3.connect(os.path.join(Plugin.state_dir, DATABASE_FILENAME))
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert connection.execute("SELECT plugin, room_id, key FROM plugin_room_data").fetchall() == [("storage_second_test", "!room:example.com", "counter")]
+    connection.close()
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from core.workqueue import WorkQueue
+
+
+@pytest.mark.asyncio
+async def test_work_queue_keeps_order_per_key():
+    work_queue = WorkQueue("test", workers=2, queue_size=1)
+    results = {"!a": [], "!b": []}
+
+    async def work(key: str, value: int):
+        await asyncio.sleep(0.001 * (value % 3))
+        results[key].append(value)
+
+    for value in range(10):
+        await work_queue.submit("!a", work, "!a", value)
+        await work_queue.submit("!b", work, "!b", value)
+    await work_queue.stop()
+
+    assert results["!a"] == list(range(10))
+    assert results["!b"] == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_work_queue_runs_keys_in_parallel():
+    work_queue = WorkQueue("test", workers=2, queue_size=10)
+
+    async def work(event: asyncio.Event):
+        await asyncio.wait_for(event.wait(), 1)
+
+    async def release(event: asyncio.Event):
+        event.set()
+
+    first = asyncio.Event()
+    await work_queue.submit("!a", work, first)
+    await work_queue.submit("!a", work, first)
+    # !b is not blocked by the pending items of !a
+    await work_queue.submit("!b", release, first)
+    assert work_queue.get_queue_depths() == {"!a": 2, "!b": 1}
+    await work_queue.stop()
+    assert work_queue.get_queue_depths() == {}
+
+
+@pytest.mark.asyncio
+async def test_work_queue_stop_cancels_items_after_timeout():
+    work_queue = WorkQueue("test", workers=2, queue_size=10)
+    results = []
+
+    async def work(seconds: float):
+        await asyncio.sleep(seconds)
+        results.append(seconds)
+
+    await work_queue.submit("!a", work, 0.01)
+    await work_queue.submit("!b", work, 10)
+    await work_queue.stop(timeout=0.1)
+
+    assert results == [0.01]
+    assert work_queue.get_queue_depths() == {}
@@ -1,7 +1,10 @@
 import datetime
 from typing import List, Callable
 
+from core.schema import register_data_class
 
+
+@register_data_class
 class Timer:
     def __init__(
         self,
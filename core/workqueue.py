@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import traceback
+from typing import Dict, Callable, Awaitable, List, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    def __init__(self, name: str, workers: int, queue_size: int):
+        """
+        Bounded queue of work items executed outside of the sync loop, sharded by a key (e.g. the room_id).
+        Every key gets its own shard: all items of the same key are executed one after another in the order they have been submitted, while
+        items of different keys are executed in parallel, up to the given number of workers at the same time.
+        Shards are created on demand and removed as soon as they are idle.
+        :param name: name of the queue, used for logging
+        :param workers: maximum number of work items executed at the same time
+        :param queue_size: maximum number of pending items per shard, submitting to a full shard waits until there is space again
+        """
+
+        self.name: str = name
+        self.workers: int = max(1, workers)
+        self.queue_size: int = max(0, queue_size)
+        self.__shards: Dict[str, asyncio.Queue] = {}
+        self.__shard_tasks: Dict[str, asyncio.Task] = {}
+        self.__pending: Dict[str, int] = {}
+        self.__semaphore: asyncio.Semaphore or None = None
+
+    def start(self):
+        """
+        Prepare the queue, needs to be called from within the running event loop
+        :return:
+        """
+
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.workers)
+            logger.debug(f"Started {self.name}-queue with {self.workers} workers")
+
+    async def stop(self, timeout: float = 5):
+        """
+        Wait for all pending work items to be processed and stop the queue. Items that could not be processed within the timeout are cancelled.
+        :param timeout: maximum number of seconds to wait for pending items
+        :return:
+        """
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        deadline: float = loop.time() + timeout
+        while self.__shard_tasks and loop.time() < deadline:
+            await asyncio.wait(list(self.__shard_tasks.values()), timeout=deadline - loop.time())
+
+        if self.__shard_tasks:
+            logger.warning(f"Cancelling {sum(self.__pending.values())} items of the {self.name}-queue that could not be processed within {timeout}s")
+            tasks: List[asyncio.Task] = list(self.__shard_tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.__shards.clear()
+            self.__shard_tasks.clear()
+            self.__pending.clear()
+
+    async def submit(self, key: str, method: Callable[..., Awaitable], *args: Any):
+        """
+        Submit a work item. Waits for space in the queue if the shard of the key already holds queue_size items.
+        :param key: the key to shard work items by, items of the same key are executed in order
+        :param method: the coroutine function to run
+        :param args: arguments to the coroutine function
+        :return:
+        """
+
+        self.start()
+
+        queue: asyncio.Queue or None = self.__shards.get(key)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self.__shards[key] = queue
+            self.__shard_tasks[key] = asyncio.create_task(self.__work(key, queue), name=f"{self.name}-{key}")
+
+        # count the item as pending before waiting for space, so the shard is not removed in the meantime
+        self.__pending[key] = self.__pending.get(key, 0) + 1
+        if queue.full():
+            logger.warning(f"{self.name}-queue for {key} is full ({queue.qsize()} items), waiting for pending items to be processed")
+        await queue.put((method, args))
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        """
+        Get the number of pending work items per shard, including items currently being executed
+        :return: Dict of key and number of pending items, only containing shards with pending items
+        """
+
+        return dict(self.__pending)
+
+    async def __work(self, key: str, queue: asyncio.Queue):
+        """
+        Process the work items of a single shard one after another, remove the shard once all items have been processed
+        :param key: the key of the shard
+        :param queue: the shard's queue
+        :return:
+        """
+
+        while self.__pending.get(key, 0) > 0:
+            method: Callable[..., Awaitable]
+            args: Tuple[Any, ...]
+            (method, args) = await queue.get()
+
+            # Make sure, exceptions raised by work items do not kill the shard
+            try:
+                async with self.__semaphore:
+                    await method(*args)
+            except Exception:
+                logger.critical(f"{self.name}-queue failed to run {method} for {key}:")
+                traceback.print_exc()
+            finally:
+                queue.task_done()
+                self.__pending[key] -= 1
+
+        del self.__pending[key]
+        del self.__shards[key]
+        del self.__shard_tasks[key]
@@ -3,6 +3,7 @@
 import logging
 import asyncio
 import os
+import signal
 import sys
 import traceback
 from time import time
@@ -19,7 +20,10 @@ from nio import (
 )
 from core.callbacks import Callbacks
 from core.config import Config
-from core.storage import Storage
+from core.executor import shutdown_executor
+from core.sender import setup_sender, shutdown_sender
+from core.storage import get_storage
+from core.workqueue import WorkQueue
 from aiohttp.client_exceptions import ServerDisconnectedError, ClientConnectionError, ClientConnectorError
 
 from core.pluginloader import PluginLoader
@@ -34,6 +38,7 @@ except ModuleNotFoundError:
 
 client: AsyncClient
 plugin_loader: PluginLoader
+event_queue: WorkQueue or None = None
 timestamp: float = time()
 
 
@@ -52,6 +57,8 @@ async def main():
     # probably using https://docs.python.org/3.8/library/functools.html#functools.partial
     global client
     global plugin_loader
+    global store
+    global event_queue
 
     # Read user-configured options from a config file.
     # A different config file path can be specified as the first command line argument
@@ -75,8 +82,8 @@ async def main():
     # Read config file
     config = Config(config_path)
 
-    # Configure the database
-    store = Storage(config.database_filepath)
+    # Configure the database, shared with the plugins' data
+    store = get_storage(config.database_filepath)
 
     # Configuration options for the AsyncClient
     client_config = AsyncClientConfig(
@@ -95,13 +102,26 @@ async def main():
         config=client_config,
     )
 
+    # Set up the pipeline sending outbound events
+    sender = setup_sender(
+        client, config.send_concurrency, config.send_rate, config.send_burst, config.send_room_rate, config.send_room_burst
+    )
+    if sender is not None:
+        sender.start()
+
     # instantiate the pluginLoader
     plugin_loader = PluginLoader(config, client)
     await plugin_loader.load_plugin_data()
     await plugin_loader.load_plugin_state()
 
+    # Set up the queue processing events outside of the sync loop
+    if config.event_workers > 0:
+        event_queue = WorkQueue("event", config.event_workers, config.event_queue_size)
+        event_queue.start()
+    plugin_loader.event_queue = event_queue
+
     # Set up event callbacks
-    callbacks = Callbacks(client, store, config, plugin_loader)
+    callbacks = Callbacks(client, store, config, plugin_loader, event_queue)
     client.add_event_callback(callbacks.message, (RoomMessageText,))
     client.add_event_callback(callbacks.invite, (InviteEvent,))
     client.add_event_callback(callbacks.event_unknown, (UnknownEvent,))
@@ -161,11 +181,42 @@ async def main():
             logger.debug(traceback.print_exc())
             logger.warning(f"Unable to connect to homeserver, retrying in 15s...")
 
-            # Sleep so we don't bombard the server with login requests
-            await sleep(15)
-        finally:
             # Make sure to close the client connection on disconnect
             await client.close()
 
+            # Sleep so we don't bombard the server with login requests
+            await sleep(15)
 
-asyncio.new_event_loop().run_until_complete(main())
+
+async def shutdown():
+    """
+    Process pending events, send pending events and write pending plugin data and state before exiting.
+    The event queue is drained first and hooks running in the background are finished, as both may send further events and store data,
+    then the sender, then the client is closed.
+    :return:
+    """
+
+    if event_queue is not None:
+        await event_queue.stop()
+    if "plugin_loader" in globals():
+        await plugin_loader.stop_hooks()
+    await shutdown_sender()
+    if "client" in globals():
+        await client.close()
+    if "plugin_loader" in globals():
+        await plugin_loader.flush_plugin_data()
+    if "store" in globals():
+        await store.close()
+    shutdown_executor()
+
+
+loop = asyncio.new_event_loop()
+main_task: asyncio.Task = loop.create_task(main())
+for signal_number in (signal.SIGINT, signal.SIGTERM):
+    loop.add_signal_handler(signal_number, main_task.cancel)
+try:
+    loop.run_until_complete(main_task)
+except asyncio.CancelledError:
+    logger.info("Shutting down")
+finally:
+    loop.run_until_complete(shutdown())
@@ -117,12 +117,13 @@ async def get_room_db_from_command(command: Command) -> ROOM_DB_TYPE:
 # plugin helpers?
 # read_room_db_from_room_id
 async def get_room_db_from_room_id(room_id: str) -> ROOM_DB_TYPE:
-    rooms_db: ROOMS_DB_TYPE = await plugin.read_data("rooms_db")
-    try:
-        return rooms_db[room_id]
-    except KeyError:
+    # data of previous versions has been stored as a single rooms_db for all rooms
+    await plugin.convert_to_room_data("rooms_db")
+    room_db: ROOM_DB_TYPE or None = await plugin.read_room_data(room_id, "rooms_db")
+    if room_db is None:
         logger.debug(f"No room db found for {room_id}")
         return {}
+    return room_db
 
 
 # plugin helpers?
@@ -134,12 +135,8 @@ async def save_room_db_from_command(command: Command, room_db: ROOM_DB_TYPE) ->
 # plugin helpers?
 # store_room_db_from_room_id
 async def store_room_db_from_room_id(room_id: str, room_db: ROOM_DB_TYPE) -> bool:
-    rooms_db: ROOMS_DB_TYPE = await plugin.read_data("rooms_db")
-    try:
-        rooms_db[room_id] = room_db
-    except TypeError:
-        rooms_db = {room_id: room_db}
-    return await plugin.store_data("rooms_db", rooms_db)
+    await plugin.convert_to_room_data("rooms_db")
+    return await plugin.store_room_data(room_id, "rooms_db", room_db)
 
 
 # plugin helpers?
@@ -156,9 +153,8 @@ async def clear_room_db_from_command(command: Command) -> bool:
 
 
 async def clear_room_db_from_room_id(room_id: str) -> bool:
-    rooms_db: ROOMS_DB_TYPE = await plugin.read_data("rooms_db")
-    del rooms_db[room_id]
-    return await plugin.store_data("rooms_db", rooms_db)
+    await plugin.convert_to_room_data("rooms_db")
+    return await plugin.clear_room_data(room_id, "rooms_db")
 
 
 # aichat command dependency
@@ -1,15 +1,16 @@
 # -*- coding: utf8 -*-
+import asyncio
 import random
 
 from nio import AsyncClient, RoomMessageText
 
-from core.plugin import Plugin
+from core.plugin import Plugin, BROADCAST_CONCURRENCY, PRIORITY_BULK
+from core.persistentmap import PersistentMap
 from typing import Dict, List
 import datetime
 from shlex import split
 import logging
 from dateparser import parse
-from asyncio import sleep
 
 logger = logging.getLogger(__name__)
 plugin = Plugin("dates", "General", "Stores dates and birthdays, posts reminders")
@@ -38,6 +39,7 @@ celebratory_emoji: List[str] = [
 
 
 def setup():
+    plugin.register_data_class(StoreDate)
     plugin.add_command("date", date, "Display the details of the next upcoming date or a specific date")
     plugin.add_command("date_add", date_add, "Add a date or birthday")
     plugin.add_command("date_del", date_del, "Delete a date or birthday", power_level=50)
@@ -392,6 +394,8 @@ async def day_start(client):
     if dates is None:
         dates: Dict[str, StoreDate] = {}
 
+    await (await plugin.open_map("last_tada", ttl=3600)).clear()
+    # remove the data stored by previous versions
     await plugin.clear_data("last_tada")
     # remove in_day_reminder if there are no events today
     plugin.del_timer(post_reminders)
@@ -433,43 +437,65 @@ async def post_reminders(client):
     if dates is None:
         dates: Dict[str, StoreDate] = {}
 
-    store_date: StoreDate
-    for store_date in dates.values():
-        if await store_date.is_today() and await store_date.needs_reminding():
-            if store_date.date_type == "birthday":
-                user_link: str = await plugin.link_user(client, store_date.mx_room, store_date.description)
-                message_id: str = await plugin.send_message(
-                    client,
-                    store_date.mx_room,
-                    f"🎉 @room, it's {user_link}'s birthday! 🎉  \n",
-                )
-
-                # post 3 to 6 random emoji
-                emoji_list: List[str] = random.sample(celebratory_emoji, random.randint(3, 6))
-                emoji: str
-                for emoji in emoji_list:
-                    await plugin.send_reaction(client, store_date.mx_room, message_id, emoji)
-                # sleep for 15 seconds to avoid being ratelimited if there's multiple birthdays
-                await sleep(15)
-
-            elif store_date.date_type == "date":
-                if datetime.datetime.now() < store_date.date:
-                    # date is in the future, post start of day reminder
-                    await plugin.send_message(
-                        client,
-                        store_date.mx_room,
-                        f"**Reminder:** {store_date.name} is today!  \n" f"**Date:** {store_date.date}  \n" f"**Description:** {store_date.description}",
-                    )
-                else:
-                    # date is in the past, post alert
-                    await plugin.send_message(
-                        client,
-                        store_date.mx_room,
-                        f"**{store_date.name}** ({store_date.description}) is **now**!  \n",
-                    )
-
-            await store_date.set_reminded()
-            await plugin.store_data("stored_dates", dates)
+    # post the reminders of several rooms at once, but not to all rooms at the same time
+    reminding: asyncio.Semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def remind(store_date: StoreDate):
+        async with reminding:
+            await post_reminder(client, store_date)
+
+    due_dates: List[StoreDate] = [store_date for store_date in dates.values() if await store_date.is_today() and await store_date.needs_reminding()]
+    if due_dates:
+        results: List[Exception or None] = await asyncio.gather(*[remind(store_date) for store_date in due_dates], return_exceptions=True)
+        store_date: StoreDate
+        for store_date, result in zip(due_dates, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Error posting reminder for {store_date.name} to {store_date.mx_room}: {result!r}")
+            else:
+                await store_date.set_reminded()
+        await plugin.store_data("stored_dates", dates)
+
+
+async def post_reminder(client, store_date: StoreDate):
+    """
+    Post the reminder of a date to its room
+    :param client:
+    :param store_date:
+    :return:
+    """
+
+    if store_date.date_type == "birthday":
+        user_link: str = await plugin.link_user(client, store_date.mx_room, store_date.description)
+        message_id: str = await plugin.send_message(
+            client,
+            store_date.mx_room,
+            f"🎉 @room, it's {user_link}'s birthday! 🎉  \n",
+            priority=PRIORITY_BULK,
+        )
+
+        # post 3 to 6 random emoji, one after another, waiting if the bot is ratelimited
+        emoji_list: List[str] = random.sample(celebratory_emoji, random.randint(3, 6))
+        emoji: str
+        for emoji in emoji_list:
+            await plugin.send_reaction(client, store_date.mx_room, message_id, emoji)
+
+    elif store_date.date_type == "date":
+        if datetime.datetime.now() < store_date.date:
+            # date is in the future, post start of day reminder
+            await plugin.send_message(
+                client,
+                store_date.mx_room,
+                f"**Reminder:** {store_date.name} is today!  \n" f"**Date:** {store_date.date}  \n" f"**Description:** {store_date.description}",
+                priority=PRIORITY_BULK,
+            )
+        else:
+            # date is in the past, post alert
+            await plugin.send_message(
+                client,
+                store_date.mx_room,
+                f"**{store_date.name}** ({store_date.description}) is **now**!  \n",
+                priority=PRIORITY_BULK,
+            )
 
 
 async def birthday_tada(client: AsyncClient, room_id: str, event: RoomMessageText):
@@ -482,14 +508,10 @@ async def birthday_tada(client: AsyncClient, room_id: str, event: RoomMessageTex
     :return:
     """
 
-    # check if at least one hour has passed since last tada in the current room
-    last_tada_dict: Dict[str, datetime.datetime] or None = await plugin.read_data("last_tada")
-    if last_tada_dict is not None:
-        last_tada: datetime.datetime or None = last_tada_dict.get(room_id)
-        if last_tada is not None and last_tada > datetime.datetime.now() - datetime.timedelta(hours=1):
-            return
-    else:
-        last_tada_dict: Dict[str, datetime.datetime] = {}
+    # check if at least one hour has passed since last tada in the current room, entries expire after one hour
+    last_tada: PersistentMap = await plugin.open_map("last_tada", ttl=3600)
+    if room_id in last_tada:
+        return
 
     # check if there are actual dates stored
     dates: Dict[str, StoreDate] = await plugin.read_data("stored_dates")
@@ -505,8 +527,7 @@ async def birthday_tada(client: AsyncClient, room_id: str, event: RoomMessageTex
             # sender is birthday person or birthday person is mentioned
             reactions: List[str] = ["🎉", "❄", "🎆"]
             await plugin.send_message(client, room_id, random.choice(reactions), markdown_convert=False)
-            last_tada_dict[room_id] = datetime.datetime.now()
-            await plugin.store_data("last_tada", last_tada_dict)
+            await last_tada.set(room_id, datetime.datetime.now())
             break
 
 
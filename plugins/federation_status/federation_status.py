@@ -1,4 +1,5 @@
 # -*- coding: utf8 -*-
+import asyncio
 import datetime
 import random
 import ssl
@@ -26,6 +27,7 @@ def setup():
     :return: -
     """
 
+    plugin.register_data_class(Server)
     plugin.add_config("room_list", default_value=None, is_required=False)
     plugin.add_config("warn_cert_expiry", default_value=7, is_required=True)
     plugin.add_config("server_max_age", default_value=60, is_required=True)
@@ -305,6 +307,8 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
         if not room_list:
             room_list = [x for x in client.rooms]
 
+        # messages and notices to send, with the rooms to send them to, so rooms receiving the same message are notified at once
+        messages: Dict[Tuple[str, bool], List[str]] = {}
         for room_id in room_list:
             for server in new_dead_servers:
                 if server not in plugin.read_config("server_ignore_list"):
@@ -312,7 +316,7 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
                         user_ids: List[str] = (await plugin.get_users_on_servers(client, [server], [room_id]))[server]
                         message: str = f"Federation error: {server} offline.  \n"
                         message += f"Isolated users: {', '.join([await plugin.link_user_by_id(client, room_id, user_id) for user_id in user_ids])}."
-                        await plugin.send_notice(client, room_id, message)
+                        messages.setdefault((message, True), []).append(room_id)
                     except KeyError:
                         pass
 
@@ -322,7 +326,7 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
                         user_ids: List[str] = (await plugin.get_users_on_servers(client, [server], [room_id]))[server]
                         message: str = f"Federation recovery: {server} back online.  \n"
                         message += f"Welcome back, {', '.join([await plugin.link_user_by_id(client, room_id, user_id) for user_id in user_ids])}."
-                        await plugin.send_notice(client, room_id, message)
+                        messages.setdefault((message, True), []).append(room_id)
                     except KeyError:
                         pass
 
@@ -336,10 +340,12 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
                             f"{', '.join([await plugin.link_user_by_id(client, room_id, user_id) for user_id in user_ids])} will be isolated until "
                             f"the server's certificate has been renewed."
                         )
-                        await plugin.send_message(client, room_id, message)
+                        messages.setdefault((message, False), []).append(room_id)
                     except KeyError:
                         pass
 
+        await asyncio.gather(*[plugin.broadcast_message(client, room_ids, message, notice=notice) for (message, notice), room_ids in messages.items()])
+
         if data_changed:
             await plugin.store_data("server_list", server_list_new)
 
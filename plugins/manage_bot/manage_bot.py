@@ -1,3 +1,5 @@
+from typing import Dict
+
 from nio import AsyncClient, MatrixRoom
 from core.plugin import Plugin
 
@@ -28,6 +30,27 @@ def setup():
         plugin.read_config("manage_bot_rooms"),
         plugin.read_config("manage_bot_power_level"),
     )
+    plugin.add_command(
+        "bot_hook_metrics",
+        bot_hook_metrics,
+        "Displays execution times of all hooks",
+        plugin.read_config("manage_bot_rooms"),
+        plugin.read_config("manage_bot_power_level"),
+    )
+    plugin.add_command(
+        "bot_write_stats",
+        bot_write_stats,
+        "Displays how often plugin data and state have been written",
+        plugin.read_config("manage_bot_rooms"),
+        plugin.read_config("manage_bot_power_level"),
+    )
+    plugin.add_command(
+        "bot_queue_depths",
+        bot_queue_depths,
+        "Displays the number of pending events per room",
+        plugin.read_config("manage_bot_rooms"),
+        plugin.read_config("manage_bot_power_level"),
+    )
 
 
 async def bot_rooms_list(command):
@@ -93,4 +116,62 @@ async def bot_leave_room(command):
         await plugin.respond_notice(command, f"Usage: `bot_leave_room <room_id>`")
 
 
+async def bot_hook_metrics(command):
+    """
+    Display number of executions, average and maximum execution time, errors and timeouts of all hooks run so far
+    :param command:
+    :return:
+    """
+
+    hook_stats = command.plugin_loader.hook_metrics.get_stats()
+    if hook_stats:
+        message: str = ""
+        for hook_name, stats in sorted(hook_stats.items()):
+            message += f"`{hook_name}`: {stats}  \n"
+    else:
+        message = "No hooks have been run yet"
+    await plugin.respond_notice(command, message)
+
+
+async def bot_write_stats(command):
+    """
+    Display the number of changes to data and state of all plugins, and how many of them have been skipped, coalesced or written
+    :param command:
+    :return:
+    """
+
+    message: str = ""
+    for plugin_name, loaded_plugin in sorted(command.plugin_loader.get_plugins().items()):
+        message += f"`{plugin_name}`: {loaded_plugin.write_stats}  \n"
+    await plugin.respond_notice(command, message)
+
+
+async def bot_queue_depths(command):
+    """
+    Display the number of events waiting to be processed per room, busiest rooms first
+    :param command:
+    :return:
+    """
+
+    if command.plugin_loader.event_queue is None:
+        await plugin.respond_notice(command, "Events are processed directly within the sync loop, there is no event queue")
+        return
+
+    queue_depths: Dict[str, int] = command.plugin_loader.event_queue.get_queue_depths()
+    # this command is processed by the queue of its room itself, don't count it as pending
+    if queue_depths.get(command.room.room_id, 0) > 1:
+        queue_depths[command.room.room_id] -= 1
+    else:
+        queue_depths.pop(command.room.room_id, None)
+    if not queue_depths:
+        await plugin.respond_notice(command, "There are no events waiting to be processed")
+        return
+
+    message: str = ""
+    for room_id, depth in sorted(queue_depths.items(), key=lambda item: item[1], reverse=True):
+        room: MatrixRoom or None = command.client.rooms.get(room_id)
+        message += f"`{room.display_name if room else room_id}` ({room_id}): {depth}  \n"
+    await plugin.respond_notice(command, message)
+
+
 setup()
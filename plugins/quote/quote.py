@@ -1,5 +1,6 @@
 from nio import AsyncClient, UnknownEvent
 from core.plugin import Plugin
+from core.persistentmap import PersistentMap
 from typing import Dict, List, Tuple
 import time
 import random
@@ -28,6 +29,9 @@ def setup():
     :return:
     """
 
+    plugin.register_data_class(Quote)
+    plugin.register_data_class(QuoteLine)
+    plugin.register_data_class(TrackedQuote)
     plugin.add_config("manage_quote_rooms", default_value=[], is_required=False)
     plugin.add_command(
         "quote",
@@ -181,7 +185,7 @@ class Quote:
 
     async def set_id(self) -> str:
 
-        quotes = await plugin.read_data("quotes")
+        quotes = await plugin.read_data("quotes", read_only=True)
         quote_id: str
         if quotes:
             quote_id = str(max(list(map(int, quotes.keys()))) + 1)
@@ -217,7 +221,7 @@ class Quote:
             quote_text = quote_text.replace(" | ", "  \n")
 
             """optionally replace nicknames by userlinks"""
-            if await plugin.read_data("nick_links"):
+            if await plugin.read_data("nick_links", read_only=True):
                 nick: str
                 nick_link: str
                 for nick in nick_list:
@@ -236,7 +240,7 @@ class Quote:
                 if line.message_type == "message" or line.message_type == "action":
                     message: str = line.message.replace("<", "&lt;").replace(">", "&gt;").replace("`", "&#96;").replace("*", "\\*").replace("_", "\\_")
 
-                    if await plugin.read_data("nick_links") and await plugin.read_data("nick_links_fuzzy"):
+                    if await plugin.read_data("nick_links", read_only=True) and await plugin.read_data("nick_links_fuzzy", read_only=True):
                         nick: str = await plugin.link_user(
                             command.client,
                             command.room.room_id,
@@ -244,7 +248,7 @@ class Quote:
                             strictness="fuzzy",
                             fuzziness=80,
                         )
-                    elif await plugin.read_data("nick_links") and not await plugin.read_data("nick_links_fuzzy"):
+                    elif await plugin.read_data("nick_links", read_only=True) and not await plugin.read_data("nick_links_fuzzy", read_only=True):
                         nick: str = await plugin.link_user(command.client, command.room.room_id, line.nick)
                     else:
                         nick: str = line.nick.replace("`", "&#96;").replace("_", "\\_")
@@ -424,7 +428,7 @@ async def quote_command(command):
 
     """Load all active (quote.deleted == False) quotes"""
     try:
-        quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+        quotes: Dict[str, Quote] = await plugin.read_data("quotes", read_only=True)
         quotes = dict(filter(lambda item: not item[1].deleted, quotes.items()))
         if not quotes:
             await plugin.respond_notice(command, "Error: no quotes stored")
@@ -498,18 +502,27 @@ async def post_quote(command, quote_object: Quote, match_index: int = -1, total_
         await plugin.send_reaction(command.client, command.room.room_id, event_id, reaction)
 
     """store the event id of the message to allow for tracking reactions to the last 100 posted quotes"""
-    tracked_quotes: List[TrackedQuote]
-    try:
-        tracked_quotes = await plugin.read_data("tracked_quotes")
-        if not tracked_quotes:
-            tracked_quotes = []
-        while len(tracked_quotes) > 100:
-            tracked_quotes.pop()
-        tracked_quote = TrackedQuote(event_id, quote_object.id)
-        tracked_quotes.insert(0, tracked_quote)
-        await plugin.store_data("tracked_quotes", tracked_quotes)
-    except KeyError:
-        await plugin.store_data("tracked_quotes", [TrackedQuote(event_id, quote_object.id)])
+    tracked_quotes: PersistentMap = await open_tracked_quotes()
+    await tracked_quotes.set(event_id, quote_object.id)
+
+
+async def open_tracked_quotes() -> PersistentMap:
+    """
+    Open the map of event ids of the last 100 posted quotes and their quote ids,
+    converting the list of TrackedQuotes stored by previous versions
+    :return: the map of tracked quotes
+    """
+
+    tracked_quotes: PersistentMap = await plugin.open_map("tracked_quotes", max_size=100)
+
+    legacy_tracked_quotes: List[TrackedQuote] = await plugin.read_data("tracked_quotes", read_only=True)
+    if legacy_tracked_quotes:
+        # previous versions stored the most recent quote first
+        for tracked_quote in reversed(legacy_tracked_quotes):
+            await tracked_quotes.set(tracked_quote.event_id, str(tracked_quote.quote_id))
+        await plugin.clear_data("tracked_quotes")
+
+    return tracked_quotes
 
 
 async def find_quote_by_search_term(quotes: Dict[str, Quote], terms: List[str], match_id: int = 0) -> Tuple[Quote, int, int] or None:
@@ -600,13 +613,13 @@ async def quote_replace_command(command):
     :return:
     """
 
-    if len(command.args) > 2 and re.match(r"\d+", command.args[0]) and command.args[0] in (await plugin.read_data("quotes")).keys():
+    if len(command.args) > 2 and re.match(r"\d+", command.args[0]) and command.args[0] in (await plugin.read_data("quotes", read_only=True)).keys():
 
         if not await plugin.backup_data():
             await plugin.respond_notice(command, f"Error creating backup file, quote not replaced.")
             return
 
-        old_quote_text: str = await (await plugin.read_data("quotes"))[command.args[0]].display_text(command)
+        old_quote_text: str = await (await plugin.read_data("quotes", read_only=True))[command.args[0]].display_text(command)
         quote: Quote = await quote_add_or_replace(command, command.args[0])
         await plugin.respond_notice(
             command,
@@ -625,7 +638,7 @@ async def quote_add_or_replace(command, quote_id: str = "0") -> Quote or None:
     :return: added quote_object or None
     """
 
-    quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+    quotes: Dict[str, Quote] = await plugin.read_data_for_update("quotes")
     if not quotes:
         quotes = {}
 
@@ -684,7 +697,7 @@ async def quote_delete_command(command):
     :return:
     """
 
-    quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+    quotes: Dict[str, Quote] = await plugin.read_data_for_update("quotes")
     if not quotes:
         quotes = {}
 
@@ -711,7 +724,7 @@ async def quote_restore_command(command):
     :return:
     """
 
-    quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+    quotes: Dict[str, Quote] = await plugin.read_data_for_update("quotes")
     if not quotes:
         quotes = {}
 
@@ -738,7 +751,7 @@ async def quote_del_annotations_command(command):
     :return:
     """
 
-    quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+    quotes: Dict[str, Quote] = await plugin.read_data_for_update("quotes")
     if not quotes:
         quotes = {}
 
@@ -749,7 +762,7 @@ async def quote_del_annotations_command(command):
     if len(command.args) == 1 and command.args[0].isdigit():
         quote_id: str = str(command.args[0])
         try:
-            old_quote_text: str = await (await plugin.read_data("quotes"))[quote_id].display_text(command)
+            old_quote_text: str = await (await plugin.read_data("quotes", read_only=True))[quote_id].display_text(command)
             await quotes[quote_id].del_annotations()
             await plugin.respond_notice(command, f"{await quotes[quote_id].display_text(command)}",
                                         expanded_message=f"**Old:**  \n{old_quote_text}  \n\n")
@@ -801,7 +814,7 @@ async def quote_stats_command(command):
     :return:
     """
 
-    quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+    quotes: Dict[str, Quote] = await plugin.read_data("quotes", read_only=True)
     if not quotes:
         quotes = {}
 
@@ -886,25 +899,18 @@ async def quote_add_reaction(client: AsyncClient, room_id: str, event: UnknownEv
     :return:
     """
 
-    quotes: Dict[str, Quote] = await plugin.read_data("quotes")
-    if not quotes:
-        quotes = {}
-
-    tracked_quotes: List[TrackedQuote]
-    tracked_quotes = await plugin.read_data("tracked_quotes")
-    if not tracked_quotes:
-        tracked_quotes = []
+    tracked_quotes: PersistentMap = await open_tracked_quotes()
 
     relates_to: str = event.source["content"]["m.relates_to"]["event_id"]
     reaction: str = event.source["content"]["m.relates_to"]["key"]
-    quote_id: str = "-1"
-
-    for tracked_quote in tracked_quotes:
-        if relates_to == tracked_quote.event_id:
-            quote_id = str(tracked_quote.quote_id)
-            break
+    quote_id: str = str(tracked_quotes.get(relates_to, "-1"))
 
     if quote_id != "-1":
+        # only copy the quotes if a reaction actually needs to be stored
+        quotes: Dict[str, Quote] = await plugin.read_data_for_update("quotes")
+        if not quotes:
+            quotes = {}
+
         quote_object: Quote = await find_quote_by_id(quotes, quote_id)
         # strip " <int>" from reactions to avoid tracking clicks on self-posted reactions
         reaction = re.sub(r"\s\d+", "", reaction)
@@ -919,7 +925,7 @@ async def upgrade_quotes(command):
     :return:
     """
 
-    quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+    quotes: Dict[str, Quote] = await plugin.read_data_for_update("quotes")
     if not quotes:
         quotes = {}
 
@@ -956,7 +962,7 @@ async def quote_replace_nick_command(command):
     """
 
     if len(command.args) == 2 or (len(command.args) == 3 and command.args[0] == "-s"):
-        quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+        quotes: Dict[str, Quote] = await plugin.read_data_for_update("quotes")
         if not quotes:
             await plugin.respond_notice(command, f"Error: no quotes stored")
         else:
@@ -4,9 +4,23 @@ __version__ = "1.1"
 __author__ = "Dingo"
 
 from core.plugin import Plugin
+from typing import List
 import random
 
 
+def roll_dice(number: int, lowest_value: int, sides: int) -> List[int]:
+    """
+    Roll the given number of dice
+    :param number: number of dice
+    :param lowest_value: lowest value of each die
+    :param sides: highest value of each die
+    :return: list of the values rolled
+    """
+
+    random.seed()
+    return [random.randint(lowest_value, sides) for _ in range(number)]
+
+
 async def roll(command):
 
     if not command.args:
@@ -54,16 +68,17 @@ async def roll(command):
             "Number of dice or sides per die are zero! Please use only nonzero numbers.",
         )
         return None
-    random.seed()
-    roll_list = []
     if number > 100000:
         await plugin.respond_notice(
             command,
             "Number of dice too large! Try a more reasonable number. (5 digits are fine)",
         )
         return None
-    for _ in range(number):
-        roll_list.append(random.randint(lowest_value, sides))
+    if number > 1000:
+        # rolling lots of dice takes a while, don't block the bot meanwhile
+        roll_list = await plugin.run_cpu(roll_dice, number, lowest_value, sides)
+    else:
+        roll_list = roll_dice(number, lowest_value, sides)
     if len(roll_list) > 50:
         result_list = "  <detailed list too large>"
     else:
@@ -20,6 +20,7 @@ timers_enabled: bool = False
 
 
 def setup():
+    plugin.register_data_class(Sample)
     plugin.add_command(
         "sample",
         sample_command,
@@ -1,12 +1,13 @@
 # -*- coding: utf8 -*-
+import asyncio
 import datetime
-from typing import List
+from typing import Dict, List
 
 from PIL import Image
 from nio import AsyncClient, UnknownEvent
 
 from core.bot_commands import Command
-from core.plugin import Plugin
+from core.plugin import Plugin, BROADCAST_CONCURRENCY
 import logging
 import xkcd
 
@@ -147,13 +148,19 @@ async def xkcd_check(client):
             if plugin.read_config("notification_only") == True:
                 # notification_only is set, only post a notification about a new comic
                 plugin.del_hook("m.reaction", xkcd_react)
-                message_ids: List[str] = []
-                for room_id in room_list:
-                    message_id: str or None = await plugin.send_notice(
-                        client, room_id, f"New xkcd-Comic: [{comic.title} ({comic.number})]({comic.link}). `!xkcd` or 👀 to display."
-                    )
-                    await plugin.send_reaction(client, room_id, message_id, "👀")
-                    message_ids.append(message_id)
+                results: Dict[str, str or Exception] = await plugin.broadcast_message(
+                    client, room_list, f"New xkcd-Comic: [{comic.title} ({comic.number})]({comic.link}). `!xkcd` or 👀 to display."
+                )
+                message_ids: List[str] = [event_id for event_id in results.values() if isinstance(event_id, str)]
+
+                # react to the notifications of several rooms at once, but not of all rooms at the same time
+                reacting: asyncio.Semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+                async def react(room_id: str, event_id: str):
+                    async with reacting:
+                        await plugin.send_reaction(client, room_id, event_id, "👀")
+
+                await asyncio.gather(*[react(room_id, event_id) for room_id, event_id in results.items() if isinstance(event_id, str)])
                 if message_ids:
                     plugin.add_hook("m.reaction", xkcd_react, room_list, message_ids, hook_type="dynamic")
 